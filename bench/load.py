@@ -0,0 +1,520 @@
+"""Load test: N teachers using one Streamlit app at the same time.
+
+Starts `streamlit run` on a local port with the offline FakeBackend (model
+latency --latency) and its job workers, then drives every session over
+Streamlit's websocket protocol the way a browser does: page load, typing a
+topic, submitting, polling the job fragment, then changing widgets on the
+finished plan. Think times between steps are random around --think.
+
+    python bench/load.py --sessions 1,5,10,20            # ramp to find the saturation point
+    python bench/load.py --app legacy --sessions 10 --plans 3 --latency 2
+    python bench/load.py --sessions 10 --save-baseline   # record bench/load_baseline.json
+    python bench/load.py --sessions 10                   # compare against it
+
+For each level it reports plans/min, end-to-end latency (submit -> plan on
+screen) and widget rerun latency at p50/p95/p99, server CPU per rerun, and
+server memory per session and per plan generated. Memory and CPU are read
+from /proc, so this runs on Linux. Needs the `websockets` package.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+from core.catalog import get_index  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_baseline.json")
+
+# Per app: script, topic/objective widgets, the submit button, text that shows a finished plan,
+# and the widgets a teacher plays with afterwards
+APPS: Dict[str, Dict[str, Any]] = {
+    "main": {
+        "script": os.path.join(SRC, "app", "main.py"),
+        "topic": "Topic",
+        "objective": "Learning Objectives (comma-separated)",
+        "submit": "Generate Lesson Plan",
+        "ready": "Lesson plan ready.",
+        "interact": ["Sections to rewrite", "Language"],
+    },
+    "legacy": {
+        "script": os.path.join(ROOT, "lesson_planner.py"),
+        "topic": "Lesson Topic",
+        "objective": "Learning Objective for this Topic",
+        "submit": "🚀 Generate Lesson Plan",
+        "ready": "3. Your AI-Generated Lesson Plan",
+        "interact": ["Sections to rewrite"],
+    },
+}
+
+# Terminal statuses of a script run; FINISHED_EARLY_FOR_RERUN is followed by another run
+FINISHED = {"FINISHED_SUCCESSFULLY", "FINISHED_WITH_COMPILE_ERROR", "FINISHED_FRAGMENT_RUN_SUCCESSFULLY"}
+
+
+# --- server and /proc ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _cpu_rss(pid: int) -> Tuple[float, int]:
+    """CPU seconds and resident bytes of one process."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+def _descendants(pid: int) -> List[int]:
+    parents: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except OSError:
+            continue
+        parents.setdefault(ppid, []).append(int(name))
+    found, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+class Server:
+    """`streamlit run` in a scratch directory; every store is fresh, so no plan comes from a cache."""
+
+    def __init__(self, app: str, latency: float, workers: int, warm: bool):
+        self.dir = tempfile.mkdtemp(prefix="planit-load-")
+        self.port = _free_port()
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": os.pathsep.join(filter(None, [SRC, env.get("PYTHONPATH")])),
+            "LLM_BACKEND": "fake",
+            "FAKE_LATENCY": str(latency),
+            "JOBS_WORKERS": str(workers),
+        })
+        for name in ("JOBS_PATH", "CACHE_PATH", "LIBRARY_PATH", "SIMILAR_PATH", "TRANSLATION_MEMORY_PATH"):
+            env[name] = os.path.join(self.dir, name.split("_")[0].lower() + ".sqlite3")
+        if not warm:
+            # Every submit reaches the model: measures the worst case, not the cache
+            env["CACHE_ENABLED"] = env["SIMILAR_ENABLED"] = "0"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", APPS[app]["script"], "--server.headless", "true",
+             "--server.port", str(self.port), "--browser.gatherUsageStats", "false"],
+            cwd=self.dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self._wait()
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def _wait(self, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError("streamlit exited during start-up")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1).read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("streamlit did not start")
+
+    def usage(self) -> Dict[str, float]:
+        cpu, rss = _cpu_rss(self.proc.pid)
+        workers = 0.0
+        for pid in _descendants(self.proc.pid):
+            try:
+                workers += _cpu_rss(pid)[0]
+            except OSError:
+                pass
+        return {"cpu": cpu, "rss": rss, "worker_cpu": workers}
+
+    def close(self) -> None:
+        for pid in _descendants(self.proc.pid):
+            try:
+                os.kill(pid, 15)
+            except OSError:
+                pass
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# --- one simulated browser ---
+
+class Widget:
+    def __init__(self, kind: str, proto: Any, fragment_id: str, sidebar: bool):
+        self.kind = kind
+        self.id = proto.id
+        self.label = proto.label
+        self.options = list(getattr(proto, "options", []))
+        self.fragment_id = fragment_id
+        self.sidebar = sidebar
+
+
+class Session:
+    """Speaks Streamlit's BackMsg/ForwardMsg protocol; keeps widget values like the frontend does."""
+
+    def __init__(self, ws: Any):
+        self.ws = ws
+        self.widgets: Dict[str, List[Widget]] = {}
+        self.states: Dict[str, Any] = {}
+        self.triggers: List[str] = []
+        self.auto: Dict[str, float] = {}
+        self.texts: List[str] = []
+        self.errors: List[str] = []
+
+    @classmethod
+    async def open(cls, url: str) -> "Session":
+        import websockets
+
+        return cls(await websockets.connect(url, subprotocols=["streamlit"], max_size=None))
+
+    def find(self, label: str) -> Optional[Widget]:
+        # Labels repeat between the page and the sidebar library; the page wins
+        found = sorted(self.widgets.get(label, []), key=lambda w: w.sidebar)
+        return found[0] if found else None
+
+    def set(self, label: str, value: Any) -> Widget:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        widget = self.find(label)
+        if widget is None:
+            raise LookupError(f"no widget labelled {label!r}")
+        state = WidgetState(id=widget.id)
+        if widget.kind == "multiselect":
+            state.string_array_value.data.extend(value)
+        else:
+            state.string_value = value
+        self.states[widget.id] = state
+        return widget
+
+    def click(self, label: str) -> Widget:
+        widget = self.find(label)
+        if widget is None:
+            raise LookupError(f"no button labelled {label!r}")
+        self.triggers.append(widget.id)
+        return widget
+
+    async def rerun(self, fragment_id: str = "", auto: bool = False) -> float:
+        """Send a rerun with the current widget values; seconds until the script run(s) finish."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        msg.rerun_script.fragment_id = fragment_id
+        msg.rerun_script.is_auto_rerun = auto
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        for widget_id in self.triggers:
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=widget_id, trigger_value=True))
+        self.triggers = []
+        self.texts = []
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        await self._read()
+        return time.perf_counter() - start
+
+    async def _read(self) -> None:
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        registered: Dict[str, float] = {}
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await asyncio.wait_for(self.ws.recv(), 120))
+            kind = fwd.WhichOneof("type")
+            if kind == "delta":
+                self._delta(fwd)
+            elif kind == "auto_rerun":
+                registered[fwd.auto_rerun.fragment_id] = fwd.auto_rerun.interval
+                self.auto[fwd.auto_rerun.fragment_id] = fwd.auto_rerun.interval
+            elif kind == "stop_auto_rerun":
+                for fragment_id in fwd.stop_auto_rerun.fragment_ids:
+                    self.auto.pop(fragment_id, None)
+            elif kind == "script_finished":
+                status = ForwardMsg.ScriptFinishedStatus.Name(fwd.script_finished)
+                if status == "FINISHED_SUCCESSFULLY":
+                    # Fragments that did not render in a full run stop polling
+                    self.auto = registered
+                if status in FINISHED:
+                    return
+
+    def _delta(self, fwd: Any) -> None:
+        delta = fwd.delta
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        proto = getattr(element, kind)
+        if kind == "exception":
+            self.errors.append(f"{proto.type}: {proto.message}")
+        elif kind in ("markdown", "heading", "alert"):
+            self.texts.append(proto.body)
+        elif hasattr(proto, "id") and hasattr(proto, "label"):
+            sidebar = bool(fwd.metadata.delta_path) and fwd.metadata.delta_path[0] == 1
+            widget = Widget(kind, proto, delta.fragment_id, sidebar)
+            same = [w for w in self.widgets.get(widget.label, []) if w.sidebar != sidebar]
+            self.widgets[widget.label] = same + [widget]
+
+    def shows(self, text: str) -> bool:
+        return any(text in t for t in self.texts)
+
+    async def close(self) -> None:
+        await self.ws.close()
+
+
+# --- scenario ---
+
+def _think(rng: random.Random, mean: float) -> float:
+    return min(3 * mean, max(0.2 * mean, rng.expovariate(1 / mean))) if mean > 0 else 0.0
+
+
+class Stats:
+    def __init__(self):
+        self.e2e: List[float] = []
+        self.reruns: Dict[str, List[float]] = {"load": [], "input": [], "submit": [], "poll": [], "interact": []}
+        self.plans = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        # (plans finished so far, server RSS) at every finished plan: the slope is memory kept per plan
+        self.memory: List[Tuple[int, int]] = []
+
+
+async def teacher(n: int, server: Server, app: str, plans: int, think: float, interactions: int,
+                  topics: List[str], stats: Stats, deadline: float) -> None:
+    spec = APPS[app]
+    rng = random.Random(n)
+    session = await Session.open(server.url)
+    try:
+        stats.reruns["load"].append(await session.rerun())
+        for round_ in range(plans):
+            await asyncio.sleep(_think(rng, think))
+            session.set(spec["topic"], topics[(n * plans + round_) % len(topics)])
+            stats.reruns["input"].append(await session.rerun())
+            session.set(spec["objective"], f"Explain and apply the key idea ({n}.{round_})")
+            await asyncio.sleep(_think(rng, think))
+            session.click(spec["submit"])
+            start = time.perf_counter()
+            stats.reruns["submit"].append(await session.rerun())
+            # The job fragment polls on its run_every timer until the finished plan is on screen
+            while not session.shows(spec["ready"]):
+                if not session.auto or time.perf_counter() - start > deadline:
+                    stats.failed += 1
+                    break
+                fragment_id, interval = next(iter(session.auto.items()))
+                await asyncio.sleep(interval)
+                stats.reruns["poll"].append(await session.rerun(fragment_id, auto=True))
+            else:
+                stats.e2e.append(time.perf_counter() - start)
+                stats.plans += 1
+                stats.memory.append((stats.plans, server.usage()["rss"]))
+            for _ in range(interactions):
+                await asyncio.sleep(_think(rng, think))
+                widget = session.find(rng.choice(spec["interact"]))
+                if widget is None or not widget.options:
+                    continue
+                if widget.kind == "multiselect":
+                    session.set(widget.label, rng.sample(widget.options, rng.randint(1, min(3, len(widget.options)))))
+                else:
+                    session.set(widget.label, rng.choice(widget.options))
+                stats.reruns["interact"].append(await session.rerun(widget.fragment_id))
+    finally:
+        stats.errors.extend(session.errors)
+        await session.close()
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def _level(server: Server, app: str, sessions: int, args: argparse.Namespace, topics: List[str]) -> Dict[str, Any]:
+    stats = Stats()
+    # One full session first, so lazy imports (exporters, fonts) are not charged to the measured sessions
+    await teacher(-1, server, app, 1, 0.0, args.interactions, topics, Stats(), args.deadline)
+    before = server.usage()
+    start = time.perf_counter()
+    tasks = []
+    for n in range(sessions):
+        tasks.append(asyncio.create_task(teacher(n, server, app, args.plans, args.think, args.interactions,
+                                                 topics, stats, args.deadline)))
+        # Sessions arrive spread over --ramp seconds, not all in the same instant
+        await asyncio.sleep(args.ramp / sessions)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    wall = time.perf_counter() - start
+    after = server.usage()
+    stats.errors.extend(f"{type(r).__name__}: {r}" for r in results if isinstance(r, BaseException))
+
+    reruns = sum(len(v) for v in stats.reruns.values())
+    growth = 0.0
+    if len(stats.memory) >= 3 and len({p for p, _ in stats.memory}) > 1:
+        growth = statistics.linear_regression([p for p, _ in stats.memory], [r for _, r in stats.memory]).slope
+    interactive = stats.reruns["input"] + stats.reruns["interact"]
+    return {
+        "sessions": sessions,
+        "plans": stats.plans,
+        "failed": stats.failed,
+        "errors": len(stats.errors),
+        "first_error": stats.errors[0] if stats.errors else "",
+        "wall_s": wall,
+        "plans_per_min": stats.plans / wall * 60 if wall else 0.0,
+        "e2e_p50": _pct(stats.e2e, 0.50),
+        "e2e_p95": _pct(stats.e2e, 0.95),
+        "e2e_p99": _pct(stats.e2e, 0.99),
+        "rerun_p50_ms": _pct(interactive, 0.50) * 1000,
+        "rerun_p95_ms": _pct(interactive, 0.95) * 1000,
+        "rerun_p99_ms": _pct(interactive, 0.99) * 1000,
+        "poll_p95_ms": _pct(stats.reruns["poll"], 0.95) * 1000,
+        "reruns": reruns,
+        "cpu_ms_per_rerun": (after["cpu"] - before["cpu"]) / reruns * 1000 if reruns else 0.0,
+        "worker_cpu_s": after["worker_cpu"] - before["worker_cpu"],
+        "rss_mb": after["rss"] / 2**20,
+        # Sessions are still held by the server here; their state is included until it expires them
+        "mb_per_session": (after["rss"] - before["rss"]) / 2**20 / sessions,
+        "mb_per_plan": growth / 2**20,
+    }
+
+
+def run(app: str, levels: List[int], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    index = get_index()
+    board = index.boards()[0]
+    subject = index.subjects(board)[0] if index.subjects(board) else ""
+    topics = index.topics_for(board, subject) or ["Fractions", "Photosynthesis", "Nouns"]
+    rows = []
+    for sessions in levels:
+        # A fresh server per level, so memory and CPU are not carried over from the last one
+        server = Server(app, args.latency, args.workers, args.warm)
+        try:
+            rows.append(asyncio.run(_level(server, app, sessions, args, topics)))
+        finally:
+            server.close()
+        print(_line(rows[-1]), flush=True)
+    return rows
+
+
+HEADER = (f"{'sessions':>8} {'plans/min':>9} {'e2e p50':>8} {'p95':>7} {'p99':>7} {'rerun p50':>10} {'p95':>7} "
+          f"{'p99':>7} {'cpu/rerun':>10} {'MB/session':>10} {'MB/plan':>8} {'failed':>6}")
+
+
+def _line(row: Dict[str, Any]) -> str:
+    return (f"{row['sessions']:>8} {row['plans_per_min']:>9.1f} {row['e2e_p50']:>7.2f}s {row['e2e_p95']:>6.2f}s "
+            f"{row['e2e_p99']:>6.2f}s {row['rerun_p50_ms']:>8.0f}ms {row['rerun_p95_ms']:>5.0f}ms "
+            f"{row['rerun_p99_ms']:>5.0f}ms {row['cpu_ms_per_rerun']:>8.1f}ms {row['mb_per_session']:>10.2f} "
+            f"{row['mb_per_plan']:>8.3f} {row['failed'] + row['errors']:>6}")
+
+
+def saturation(rows: List[Dict[str, Any]]) -> Optional[int]:
+    """First level where more sessions add less than 10% throughput: the server is saturated there."""
+    for prev, row in zip(rows, rows[1:]):
+        if row["plans_per_min"] < prev["plans_per_min"] * 1.1:
+            return prev["sessions"]
+    return None
+
+
+def compare(rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float) -> List[Tuple[str, float]]:
+    regressions = []
+    old = {row["sessions"]: row for row in baseline}
+    for row in rows:
+        base = old.get(row["sessions"])
+        if base is None:
+            continue
+        for key in ("e2e_p95", "rerun_p95_ms", "cpu_ms_per_rerun", "mb_per_session"):
+            # Tiny values are noise; an absolute floor keeps them from tripping the gate
+            if base[key] > 0.05 and row[key] > base[key] * (1 + threshold):
+                regressions.append((f"{row['sessions']} sessions {key}", row[key] / base[key]))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Simulate concurrent teachers against a Streamlit app.")
+    parser.add_argument("--app", choices=sorted(APPS), default="main")
+    parser.add_argument("--sessions", default="1,5,10", help="comma-separated concurrency levels")
+    parser.add_argument("--plans", type=int, default=2, help="plans each session generates")
+    parser.add_argument("--interactions", type=int, default=3, help="widget changes after each plan")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between steps, seconds")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which sessions arrive")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake model latency per call, seconds")
+    parser.add_argument("--workers", type=int, default=2, help="job worker processes (JOBS_WORKERS)")
+    parser.add_argument("--deadline", type=float, default=300.0, help="give up on a plan after this many seconds")
+    parser.add_argument("--warm", action="store_true", help="keep the plan cache and similar-plan offers on")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("LOAD_THRESHOLD", "0.5")),
+                        help="allowed growth vs baseline for p95s, CPU/rerun and MB/session (0.5 = 50%%)")
+    parser.add_argument("--out", help="also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir("/proc/self"):
+        print("bench/load.py reads CPU and memory from /proc; run it on Linux", file=sys.stderr)
+        return 2
+    levels = [int(s) for s in args.sessions.split(",") if s]
+    print(f"{args.app}: fake latency {args.latency}s, {args.workers} workers, think {args.think}s, "
+          f"{args.plans} plans x {args.interactions} interactions per session")
+    print(HEADER)
+    rows = run(args.app, levels, args)
+    for row in rows:
+        if row["first_error"]:
+            print(f"{row['sessions']} sessions: {row['errors']} errors, first: {row['first_error']}")
+    point = saturation(rows)
+    if point is not None:
+        print(f"saturated at about {point} sessions: more sessions add no throughput")
+
+    doc = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(), "time": time.time(),
+                 "app": args.app, "latency": args.latency, "workers": args.workers, "think": args.think},
+        "results": rows,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    failed = any(row["failed"] or row["errors"] for row in rows)
+    if not os.path.exists(args.baseline):
+        return 1 if failed else 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("app") != args.app:
+        return 1 if failed else 0
+    regressions = compare(rows, baseline["results"], args.threshold)
+    for key, ratio in regressions:
+        print(f"REGRESSION {key}: {ratio:.2f}x baseline")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
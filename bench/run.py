@@ -0,0 +1,202 @@
+"""Pipeline benchmarks: form submit -> plan -> Markdown/DOCX/PDF.
+
+Every stage runs against the offline FakeBackend, so no network or API key
+is needed. Results are compared with a saved baseline and the run fails
+when any stage's median regresses by more than the threshold.
+
+    python bench/run.py --save-baseline          # record bench/baseline.json
+    python bench/run.py --threshold 0.25         # compare against it
+    python bench/run.py --only to_pdf --repeat 9
+
+PDF stages also report pages/s for the document they render.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from core.backends import FakeBackend, set_backend  # noqa: E402
+from core.generator import LessonRequest, LessonPlan, build_prompt, parse_plan, generate_lesson  # noqa: E402
+from core.utils import SECTION_ORDER, to_markdown  # noqa: E402
+from core.export import docx_bytes, pdf_bytes  # noqa: E402
+from core import legacy  # noqa: E402
+from core.pdf import page_count  # noqa: E402
+
+PDF_STAGES = ("to_pdf", "legacy_create_pdf")
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# items per section for each plan size
+SIZES = {"small": 3, "medium": 10, "large": 40, "xlarge": 150}
+
+PHRASES = {
+    "latin": "Students compare the rates of photosynthesis under different light conditions and record results",
+    "gujarati": "વિદ્યાર્થીઓ વિવિધ પ્રકાશની સ્થિતિમાં પ્રકાશસંશ્લેષણના દરની તુલના કરે છે અને પરિણામો નોંધે છે",
+    "devanagari": "छात्र विभिन्न प्रकाश स्थितियों में प्रकाश संश्लेषण की दर की तुलना करते हैं और परिणाम दर्ज करते हैं",
+}
+
+TOPICS = {"latin": "Photosynthesis", "gujarati": "પ્રકાશસંશ્લેષણ", "devanagari": "प्रकाश संश्लेषण"}
+
+CASES = [
+    ("small", "latin"), ("medium", "latin"), ("large", "latin"), ("xlarge", "latin"),
+    ("medium", "gujarati"), ("large", "gujarati"),
+    ("medium", "devanagari"), ("large", "devanagari"),
+]
+
+
+def make_request(script: str) -> LessonRequest:
+    return LessonRequest(
+        board="GSEB" if script == "gujarati" else "CBSE",
+        grade=8,
+        subject="વિજ્ઞાન (Science)" if script == "gujarati" else "Science",
+        topic=TOPICS[script],
+        duration="45 min",
+        pedagogy="Inquiry-Based",
+        bloom="Apply",
+        learning_objectives=["Explain", "Apply"],
+        constraints=["40 students", "No lab"],
+    )
+
+
+def make_plan(size: str, script: str) -> Dict[str, Any]:
+    n = SIZES[size]
+    phrase = PHRASES[script]
+    return {
+        "title": f"Lesson Plan: {phrase.split()[0]}",
+        "sections": {s: [f"{i + 1}. {phrase}." for i in range(n)] for s in SECTION_ORDER},
+    }
+
+
+def make_legacy_text(plan: Dict[str, Any]) -> str:
+    items = plan["sections"]["Lesson Flow"]
+    parts = []
+    for heading in ("📝 Introduction", "🎯 Main Activity", "✨ Conclusion", "📝 Quiz"):
+        parts.append(f"### {heading}\n" + "\n".join(f"- {x}" for x in items))
+    return "\n\n".join(parts)
+
+
+def stages(size: str, script: str) -> Dict[str, Callable[[], Any]]:
+    req = make_request(script)
+    plan = make_plan(size, script)
+    raw = "```json\n" + json.dumps(plan, ensure_ascii=False) + "\n```"
+    payload = json.loads(json.dumps(plan))
+    legacy_text = make_legacy_text(plan)
+    fake = FakeBackend(latency=0, jitter=0, output_tokens=SIZES[size] * len(SECTION_ORDER) * 16)
+
+    def pipeline():
+        set_backend(fake)
+        result = generate_lesson(req, use_cache=False).model_dump()
+        to_markdown(result)
+        docx_bytes(result)
+        pdf_bytes(result)
+
+    def legacy_pipeline():
+        set_backend(fake)
+        text = legacy.generate_lesson_plan(req.board, "8th Grade", req.subject, req.topic, "explain it")
+        legacy.parse_lesson_sections(text)
+        legacy.create_pdf(text)
+        legacy.create_docx(text)
+
+    return {
+        "prompt": lambda: build_prompt(req),
+        "json_parse": lambda: json.loads(re.sub(r"^```(json)?|```$", "", raw.strip(), flags=re.MULTILINE)),
+        "validate": lambda: LessonPlan(**payload),
+        "parse_plan": lambda: parse_plan(raw),
+        "to_markdown": lambda: to_markdown(plan),
+        "to_docx": lambda: docx_bytes(plan),
+        "to_pdf": lambda: pdf_bytes(plan),
+        "legacy_parse": lambda: legacy.parse_lesson_sections(legacy_text),
+        "legacy_create_pdf": lambda: legacy.create_pdf(legacy_text),
+        "legacy_create_docx": lambda: legacy.create_docx(legacy_text),
+        "pipeline": pipeline,
+        "legacy_pipeline": legacy_pipeline,
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(samples), "min": min(samples), "number": number}
+
+
+def run(only: List[str], repeat: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for size, script in CASES:
+        for name, fn in stages(size, script).items():
+            if only and name not in only:
+                continue
+            key = f"{name}/{size}-{script}"
+            results[key] = measure(fn, repeat)
+            line = f"{key:42s} {results[key]['median'] * 1e3:10.3f} ms"
+            if name in PDF_STAGES:
+                # Throughput: pages of the rendered document per second of median render time
+                pages = page_count(fn())
+                results[key]["pages_per_sec"] = pages / results[key]["median"]
+                line += f"  {pages:4d} pages {results[key]['pages_per_sec']:8.1f} pages/s"
+            print(line, flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[Tuple[str, float]]:
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base or base["median"] <= 0:
+            continue
+        ratio = current["median"] / base["median"]
+        if ratio > 1 + threshold:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the lesson-plan pipeline.")
+    parser.add_argument("--only", action="append", default=[], help="stage name to run (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_THRESHOLD", "0.25")),
+                        help="allowed slowdown vs baseline median (0.25 = 25%%)")
+    parser.add_argument("--out", help="also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    results = run(args.only, args.repeat)
+    doc = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(), "time": time.time()},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for key, ratio in regressions:
+        print(f"REGRESSION {key}: {ratio:.2f}x baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
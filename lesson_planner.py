@@ -1,297 +1,245 @@
 import os
 import streamlit as st
-import base64
-import google.generativeai as genai
-import re
-from fpdf import FPDF
-from docx import Document
-from io import BytesIO
-from dotenv import load_dotenv
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from core.config import GEMINI_API_KEY, LLM_BACKEND
+from core.curriculum import GRADES_MAPPING
+from core.catalog import get_index
+from core.assets import background_css
+from core.library import FACETS, plan_library
+from core.legacy import parse_lesson_sections, export_file
+from core.jobs import DONE, FAILED, QUEUED, ensure_workers, job_queue, merge_counters, submit
+from core.translate import LANGUAGES
+from core import metrics
 
-load_dotenv()
 
 # --- CONFIGURATION & API SETUP ---
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
+# Generation goes through core.backends; LLM_BACKEND=fake runs offline
+if LLM_BACKEND == "gemini" and not GEMINI_API_KEY:
     st.error("Error: GOOGLE_API_KEY not found in environment variables.")
     st.stop()
 
-try:
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-except Exception as e:
-    st.error(f"Error configuring the API: {e}")
-    st.stop()
-
 # --- DATA ---
-
-# Full subject lists mapped by board, grade, and (for grade 11+) streams where applicable
-
-LESSON_DATA = {
-    "CBSE": {
-        "Primary (1-5)": {
-            "Mathematics": [],
-            "English": [],
-            "Hindi": [],
-            "Environmental Science (EVS)": [],
-            "Sanskrit": [],
-            "Urdu": [],
-            "Tamil": [],
-            "Kannada": [],
-            # Add regional languages as needed
-        },
-        "Middle (6-8)": {
-            "Mathematics": [],
-            "English": [],
-            "Hindi": [],
-            "Science": [],
-            "Social Science": [],
-            "Sanskrit": [],
-            "Tamil": [],
-            # Add more if applicable
-        },
-        "Secondary (9-10)": {
-            "Mathematics": [],
-            "English": [],
-            "Hindi": [],
-            "Science": [],
-            "Social Science": [],
-            "Computer Applications": [],
-            "Sanskrit": [],
-            "Tamil": [],
-            # More subjects possible
-        },
-        "Senior Secondary": {
-            "Science": {
-                "Physics": [],
-                "Chemistry": [],
-                "Biology": [],
-                "Mathematics": [],
-                "Computer Science": [],
-                "Informatics Practices": [],
-            },
-            "Commerce": {
-                "Business Studies": [],
-                "Accountancy": [],
-                "Economics": [],
-                "Mathematics": [],
-                "Entrepreneurship": [],
-            },
-            "Arts": {
-                "Political Science": [],
-                "Geography": [],
-                "History": [],
-                "Psychology": [],
-                "Sociology": [],
-                "Economics": [],
-                "English": [],
-                "Hindi": [],
-                "Physical Education": [],
-                "Fine Arts": [],
-            }
-        }
-    },
-    "GSEB": {
-        "Primary (1-5)": {
-            "ગણિત (Mathematics)": [],
-            "ગુજરાતી (Gujarati)": [],
-            "અંગ્રેજી (English)": [],
-            "વિજ્ઞાન (Science/EVS)": [],
-            "સામાજિક વિજ્ઞાન (Social Science)": [],
-            # Add more Gujarati medium subjects as needed
-        },
-        "Middle (6-8)": {
-            "ગણિત (Mathematics)": [],
-            "ગુજરાતી (Gujarati)": [],
-            "અંગ્રેજી (English)": [],
-            "વિજ્ઞાન (Science)": [],
-            "સામાજિક વિજ્ઞાન (Social Science)": [],
-            # More as applicable
-        },
-        "Secondary (9-10)": {
-            "ગણિત (Mathematics)": [],
-            "ગુજરાતી (Gujarati)": [],
-            "અંગ્રેજી (English)": [],
-            "વિજ્ઞાન (Science)": [],
-            "સામાજિક વિજ્ઞાન (Social Science)": [],
-            "કમ્પ્યુટર (Computer)": [],
-            # Add more if needed
-        },
-        "Senior Secondary": {
-            "Science": {
-                "ભૌતિક વિજ્ઞાન (Physics)": [],
-                "રાસાયણિક વિજ્ઞાન (Chemistry)": [],
-                "જીવ વિજ્ઞાન (Biology)": [],
-                "ગણિત (Mathematics)": [],
-            },
-            "Commerce": {
-                "વાણિજ્ય અભ્યાસ (Business Studies)": [],
-                "લેખાપાલન (Accountancy)": [],
-                "અર્થશાસ્ત્ર (Economics)": [],
-                "ગણિત (Mathematics)": [],
-            },
-            "Arts": {
-                "રાજકારણ શાસ્ત્ર (Political Science)": [],
-                "ભૂગોળ (Geography)": [],
-                "ઇતિહાસ (History)": [],
-                "મનોઃશાસ્ત્ર (Psychology)": [],
-                "સામાજિક શાસ્ત્ર (Sociology)": [],
-                "અંગ્રેજી (English)": [],
-                "ગુજરાતી (Gujarati)": [],
-                # Add other humanities subjects
-            }
-        }
-    }
-}
-
-# Map grades to categories used above
-GRADES_MAPPING = {
-    # Nursery, LKG, UKG mapped to Primary
-    'Nursery': 'Primary (1-5)', 'LKG': 'Primary (1-5)', 'UKG': 'Primary (1-5)',
-    # Grades 1-5 Primary
-    '1st Grade': 'Primary (1-5)', '2nd Grade': 'Primary (1-5)', '3rd Grade': 'Primary (1-5)',
-    '4th Grade': 'Primary (1-5)', '5th Grade': 'Primary (1-5)',
-    # Grades 6-8 Middle
-    '6th Grade': 'Middle (6-8)', '7th Grade': 'Middle (6-8)', '8th Grade': 'Middle (6-8)',
-    # Grades 9-10 Secondary
-    '9th Grade': 'Secondary (9-10)', '10th Grade': 'Secondary (9-10)',
-    # Grades 11-12 Senior Secondary (streams)
-    '11th Grade': 'Senior Secondary', '12th Grade': 'Senior Secondary'
-}
-
-# For grades 11 and 12, user must select stream:
-STREAMS = {
-    "Science": None,  # Use LESSON_DATA[board]["Senior Secondary"]["Science"]
-    "Commerce": None, # Use LESSON_DATA[board]["Senior Secondary"]["Commerce"]
-    "Arts": None      # Use LESSON_DATA[board]["Senior Secondary"]["Arts"]
-}
+# Boards, grades, streams, subjects and topics are served by core.catalog, compiled from
+# src/core/curriculum.py plus an optional syllabus file (CURRICULUM_PATH)
+catalog = get_index()
+# Prompt, generation, section parsing and exporters live in src/core/legacy.py
 
 # --- HELPER FUNCTIONS ---
 
-@st.cache_data
-def get_img_as_base64(file):
-    with open(file, "rb") as f:
-        data = f.read()
-    return base64.b64encode(data).decode()
-
-def generate_lesson_plan(board, grade, subject, topic, objective):
-    prompt = f"""
-As an expert curriculum designer for the {board} board in India, create a 15-minute micro-lesson plan for {grade}, focusing on the subject {subject}.
-**Topic:** {topic}
-**Objective:** By the end of this lesson, students should be able to {objective}.
-Generate the output in simple Markdown. Use these exact headings for each section: '### 📝 Introduction', '### 🎯 Main Activity', and '### ✨ Conclusion'.
-Under each heading, provide a clear, concise, and actionable plan.
-
-Also, generate a short 5-question multiple-choice quiz (with answers) related to the lesson at the end under '### 📝 Quiz'.
-"""
-    try:
-        response = model.generate_content(prompt, request_options={'timeout': 60})
-        return response.text
-    except Exception as e:
-        return f"An error occurred: {e}"
-
-def create_pdf(text_content):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    cleaned_text = text_content.encode('latin-1', 'ignore').decode('latin-1')
-    pdf.multi_cell(0, 10, cleaned_text)
-    return bytes(pdf.output(dest='S').encode('latin-1'))
-
-def create_docx(text_content):
-    doc = Document()
-    cleaned_text = text_content.encode('ascii', 'ignore').decode('ascii')
-    doc.add_paragraph(cleaned_text)
-    bio = BytesIO()
-    doc.save(bio)
-    return bio.getvalue()
-
-def translate_text(text, target_lang='hi'):
-    # Placeholder for translation API integration, returns original text for now
-    return text
+LESSON_FIELDS = ("board", "grade", "subject", "topic", "objective")
+
+
+def keep_request(request):
+    # The request behind the plan on screen: rewrites and file names use it, not whatever the form shows now
+    st.session_state.lesson_request = {k: request.get(k, "") for k in LESSON_FIELDS}
+
+
+def start_job(kind, payload):
+    # Model calls run in background worker processes; the job id in the URL survives reruns and reconnects
+    ensure_workers()
+    job_id = submit(job_queue(), kind, payload)
+    st.session_state.job = job_id
+    st.query_params["job"] = str(job_id)
+    st.session_state.pop("job_error", None)
+
+
+@st.fragment(run_every=0.5)
+def job_progress(job_id):
+    job = job_queue().get(job_id)
+    if job is None or job.status in (DONE, FAILED):
+        del st.session_state.job
+        if job is not None and job.trace:
+            metrics.merge(job.trace)
+            merge_counters(job.trace)
+        if job is not None and job.status == DONE:
+            # Translation (core.translate) runs in the worker after generation
+            st.session_state.lesson_plan = job.result["text"]
+            keep_request(job.payload)
+        elif job is not None and job.kind == "legacy_generate":
+            st.session_state.lesson_plan = f"An error occurred: {job.error}"
+        elif job is not None:
+            st.session_state.job_error = f"Failed to rewrite sections: {job.error}"
+        st.rerun()
+    progress = job.progress or {}
+    if job.status == QUEUED:
+        st.info("⏳ Waiting for a free worker...")
+    elif progress.get("translating"):
+        st.info(f"🌐 Translating to {LANGUAGES[progress['translating']]}... sections will appear as they are done.")
+    else:
+        st.info("🧠 The AI is thinking... sections will appear as they are written.")
+    for heading, body in progress.get("sections", []):
+        with st.expander(f"**{heading}**", expanded=True):
+            st.markdown(body)
+
+
+@st.fragment
+def library_panel():
+    # Searching, filtering and paging rerun only this panel; opening a plan reruns the page
+    library = plan_library()
+    query = st.text_input("Search saved plans", key="library_query")
+    picked = {name: st.session_state.get(f"library_{name}") for name in FACETS}
+    counts = library.facets(query, source="legacy", **picked)
+    for name in FACETS:
+        options = [v for v, _ in counts[name]]
+        if picked[name] and picked[name] not in options:
+            options.append(picked[name])
+        label = dict(counts[name])
+        st.selectbox(name.title(), options, index=None, key=f"library_{name}",
+                     format_func=lambda v, label=label: f"{v} ({label.get(v, 0)})")
+
+    scope = (query, tuple(picked.values()))
+    if st.session_state.get("library_scope") != scope:
+        st.session_state.library_scope = scope
+        st.session_state.library_cursors = [None]
+    cursor = st.session_state.library_cursors[-1]
+    if query.strip():
+        page = library.search(query, 10, offset=cursor or 0, source="legacy", **picked)
+    else:
+        page = library.history(10, after=cursor, source="legacy", **picked)
+
+    for entry in page.items:
+        if st.button(f"{entry.title} · {entry.subject} · {entry.grade}", key=f"library_open_{entry.id}", use_container_width=True):
+            saved = library.get(entry.id)
+            st.session_state.lesson_plan = saved["plan"]["text"]
+            keep_request(saved["request"])
+            st.session_state.pop("job", None)
+            st.query_params.pop("job", None)
+            st.rerun()
+        if entry.snippet:
+            st.caption(entry.snippet)
+    if not page.items:
+        st.caption("No saved plans yet." if not (query or any(picked.values())) else "No matches.")
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("Prev", disabled=len(st.session_state.library_cursors) == 1, use_container_width=True):
+        st.session_state.library_cursors.pop()
+        st.rerun()
+    if next_col.button("Next", disabled=page.next is None, use_container_width=True):
+        st.session_state.library_cursors.append(page.next)
+        st.rerun()
+
+
+@st.fragment
+def rewrite_sections(plan_text, details):
+    # Picking sections reruns only this fragment; starting the rewrite reruns the page
+    with st.expander("🔁 Rewrite only some sections"):
+        section_keys = {"Introduction": "intro", "Main Activity": "activity", "Conclusion": "conclusion", "Quiz": "quiz"}
+        chosen = st.multiselect("Sections to rewrite", list(section_keys))
+        feedback = st.text_input("What should change? (optional)", key="rewrite_feedback")
+        if st.button("Rewrite selected", disabled=not chosen, use_container_width=True):
+            start_job("legacy_regenerate", {**details, "plan_text": plan_text,
+                                            "keys": [section_keys[c] for c in chosen], "feedback": feedback.strip()})
+            st.rerun()
+
+
+@st.fragment
+def downloads(plan_text, topic):
+    # Each file is rendered once per plan (core.export memo); on_click="ignore" serves it without a rerun
+    col_pdf, col_docx = st.columns(2)
+    with col_pdf:
+        try:
+            pdf_data = export_file(plan_text, "pdf")
+            st.download_button(label="⬇️ Download as PDF", data=pdf_data, file_name=f"{topic}_lesson_plan.pdf", mime="application/pdf", on_click="ignore", use_container_width=True)
+        except Exception as e:
+            st.error(f"Failed to create PDF: {e}")
+    with col_docx:
+        try:
+            docx_data = export_file(plan_text, "docx")
+            st.download_button(label="⬇️ Download as Word (DOCX)", data=docx_data, file_name=f"{topic}_lesson_plan.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", on_click="ignore", use_container_width=True)
+        except Exception as e:
+            st.error(f"Failed to create DOCX: {e}")
+
 
 # --- STREAMLIT UI ---
 
 st.set_page_config(layout="wide", page_title="Smart Lesson Planner", page_icon="🧑‍🏫")
 
-try:
-    img = get_img_as_base64("background.jpg")
-    page_bg_img = f"""
+# Background is served from ./static (hashed AVIF/WebP/JPEG variants picked by viewport),
+# so each rerun only resends a few KB of CSS instead of the base64-encoded image
+page_bg_css = background_css('[data-testid="stAppViewContainer"] > .main')
+if page_bg_css:
+    st.markdown(f"""
     <style>
-    [data-testid="stAppViewContainer"] > .main {{
-    background-image: url("data:image/jpeg;base64,{img}");
-    background-size: cover;
-    background-position: center;
-    background-repeat: no-repeat;
-    background-attachment: fixed;
-    }}
+    {page_bg_css}
     [data-testid="stHeader"] {{
     background: rgba(0,0,0,0);
     }}
     </style>
-    """
-    st.markdown(page_bg_img, unsafe_allow_html=True)
-except FileNotFoundError:
-    st.warning("background.jpg not found. Please add it to the root folder.", icon="⚠️")
+    """, unsafe_allow_html=True)
+else:
+    st.warning("Background assets not built. Run `cd src && python -m core.assets`.", icon="⚠️")
 
 st.title("CurAIte: Smart Lesson Planner")
 
 with st.container():
     st.subheader("1. Select Your Class Details")
     col1, col2, col3, col4 = st.columns(4)
+    # Cascading lookups come from the shared curriculum index, built once per process
     with col1:
-        board = st.selectbox("Educational Board", list(LESSON_DATA.keys()))
+        board = st.selectbox("Educational Board", [b for b in catalog.boards() if catalog.bands(b)])
     with col2:
         grade = st.selectbox("Grade", list(GRADES_MAPPING.keys()))
-    grade_category = GRADES_MAPPING.get(grade, "Primary (1-5)")
+    grade_category = catalog.band_for_grade(grade)
 
     # If grade is 11 or 12, ask for stream selection
     stream = None
     if grade_category == "Senior Secondary":
         with col3:
-            stream = st.selectbox("Select Stream", ["Science", "Commerce", "Arts"])
-        subjects_list = list(LESSON_DATA[board][grade_category][stream].keys())
+            stream = st.selectbox("Select Stream", catalog.streams(board, grade_category))
+        with col4:
+            subjects_list = catalog.subjects(board, grade_category, stream)
+            subject = st.selectbox("Subject", subjects_list) if subjects_list else None
     else:
         with col3:
-            subjects_list = list(LESSON_DATA.get(board, {}).get(grade_category, {}).keys())
-            if subjects_list:
-                subject = st.selectbox("Subject", subjects_list)
-            else:
-                subject = None
-        stream = None
-
-    # Show subjects depending on stream if applicable
-    if grade_category == "Senior Secondary" and stream:
-        subject = st.selectbox("Subject", list(LESSON_DATA[board][grade_category][stream].keys()))
-    elif grade_category != "Senior Secondary":
-        # Already handled above
-        pass
-    else:
-        subject = None
+            subjects_list = catalog.subjects(board, grade_category)
+            subject = st.selectbox("Subject", subjects_list) if subjects_list else None
 
     st.subheader("2. Define Your Lesson")
 
     if subject:
-        available_topics = []  # For now keep empty, users can type
         topic = st.text_input("Lesson Topic", placeholder="Enter lesson topic here")
+        if topic.strip():
+            available_topics = catalog.search(topic, board, subject)
+        else:
+            available_topics = catalog.topics_for(board, subject, limit=10)
+        if available_topics:
+            picked = st.selectbox("Matching syllabus topics", available_topics, index=None, placeholder="Pick a syllabus topic or keep your own")
+            if picked:
+                topic = picked
     else:
         topic = ""
 
     objective = st.text_area("Learning Objective for this Topic", placeholder="e.g., describe the stages of evaporation and condensation")
 
-    translate = st.checkbox("Translate lesson plan to Hindi", value=False)
+    # Gujarati is the medium of instruction for most GSEB schools
+    languages = ["hi", "gu"] if board != "GSEB" else ["gu", "hi"]
+    translate = st.selectbox("Translate lesson plan", [""] + languages, index=0,
+                             format_func=lambda code: LANGUAGES[code] if code else "No translation (English)")
 
     if st.button("🚀 Generate Lesson Plan", type="primary", use_container_width=True):
         if all([board, grade, subject, topic, objective]):
-            with st.spinner("🧠 The AI is thinking... this may take a moment."):
-                lesson_plan = generate_lesson_plan(board, grade, subject, topic, objective)
-                if translate:
-                    lesson_plan = translate_text(lesson_plan, target_lang='hi')
-                st.session_state.lesson_plan = lesson_plan
+            st.session_state.lesson_plan = ""
+            start_job("legacy_generate", {"board": board, "grade": grade, "subject": subject, "topic": topic,
+                                          "objective": objective, "translate": translate})
         else:
             st.warning("Please fill in all fields to generate a lesson plan.", icon="⚠️")
 
+# A fresh session opened on ?job=N (reload, reconnect) picks the job up again
+if "job" not in st.session_state and not st.session_state.get("lesson_plan") and st.query_params.get("job", "").isdigit():
+    st.session_state.job = int(st.query_params["job"])
+
+if st.session_state.get("job"):
+    job_progress(st.session_state.job)
+elif st.session_state.get("job_error"):
+    st.error(st.session_state.job_error)
+
+# --- SAVED PLANS ---
+# Every generated plan is saved to the plan library; reopen one instead of generating it again
+with st.sidebar:
+    st.subheader("📚 Saved lesson plans")
+    library_panel()
+
 if 'lesson_plan' in st.session_state and st.session_state.lesson_plan:
     st.markdown("---")
     st.subheader("3. Your AI-Generated Lesson Plan")
@@ -300,15 +248,8 @@ if 'lesson_plan' in st.session_state and st.session_state.lesson_plan:
     if plan_text.startswith("An error occurred"):
         st.error(plan_text)
     else:
-        intro_match = re.search(r'### 📝 Introduction.*?\n(.*?)(?=\n###|$)', plan_text, re.S)
-        activity_match = re.search(r'### 🎯 Main Activity.*?\n(.*?)(?=\n###|$)', plan_text, re.S)
-        conclusion_match = re.search(r'### ✨ Conclusion.*?\n(.*?)(?=\n###|$)', plan_text, re.S)
-        quiz_match = re.search(r'### 📝 Quiz.*?\n(.*)', plan_text, re.S)
-
-        intro = intro_match.group(1).strip() if intro_match else "Could not parse Introduction."
-        activity = activity_match.group(1).strip() if activity_match else "Could not parse Main Activity."
-        conclusion = conclusion_match.group(1).strip() if conclusion_match else "Could not parse Conclusion."
-        quiz = quiz_match.group(1).strip() if quiz_match else "No quiz generated."
+        parsed = parse_lesson_sections(plan_text)
+        intro, activity, conclusion, quiz = parsed["intro"], parsed["activity"], parsed["conclusion"], parsed["quiz"]
 
         m1, m2, m3, m4 = st.columns(4)
         m1.metric(label="Introduction", value="~3 Mins")
@@ -325,21 +266,23 @@ if 'lesson_plan' in st.session_state and st.session_state.lesson_plan:
         with st.expander("📝 **Quiz**", expanded=True):
             st.markdown(quiz)
 
+        lesson_request = st.session_state.lesson_request
+        rewrite_sections(plan_text, lesson_request)
+
         st.markdown("---")
         st.write("Copy the full lesson plan text below:")
         st.code(plan_text, language='markdown')
 
         st.write("Or download the file:")
-        col_pdf, col_docx = st.columns(2)
-        with col_pdf:
-            try:
-                pdf_data = create_pdf(plan_text)
-                st.download_button(label="⬇️ Download as PDF", data=pdf_data, file_name=f"{topic}_lesson_plan.pdf", mime="application/pdf", use_container_width=True)
-            except Exception as e:
-                st.error(f"Failed to create PDF: {e}")
-        with col_docx:
-            try:
-                docx_data = create_docx(plan_text)
-                st.download_button(label="⬇️ Download as Word (DOCX)", data=docx_data, file_name=f"{topic}_lesson_plan.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True)
-            except Exception as e:
-                st.error(f"Failed to create DOCX: {e}")
+        downloads(plan_text, lesson_request["topic"])
+
+# --- DEBUG ---
+# Stage timings of the last requests (generation runs in job workers) and of every stage since start-up
+with st.sidebar.expander("🔍 Debug: request timings"):
+    if not metrics.enabled():
+        st.caption("Metrics are off (METRICS_ENABLED=0).")
+    elif metrics.recent():
+        st.dataframe(metrics.debug_rows(10), hide_index=True)
+        st.dataframe(metrics.stage_summary(), hide_index=True)
+    else:
+        st.caption("No requests yet.")
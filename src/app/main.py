@@ -1,29 +1,176 @@
 from __future__ import annotations
-import os
 import streamlit as st
 from typing import List
 from datetime import datetime
 
 from core.config import APP_NAME
 from core.curriculum import BOARDS, SUBJECTS, BLOOMS_LEVELS, PEDAGOGY_STYLES, DURATIONS
-from core.generator import LessonRequest, generate_lesson
-from core.utils import to_markdown
-from core.export import to_docx, to_pdf
+from core.catalog import get_index
+from core.generator import LessonRequest, LessonPlan, SimilarPlan, find_similar, cache_stats, similar_stats, quiz_stats, parse_stats
+from core.utils import SECTION_ORDER, to_markdown, section_to_markdown
+from core.export import MIME_TYPES, export_bytes, export_stats
+from core.library import FACETS, plan_library
+from core.budget import budget_stats
+from core.jobs import DONE, FAILED, QUEUED, ensure_workers, job_queue, merge_counters, submit
+from core.translate import LANGUAGES, translation_memory
+from core import metrics
 
 st.set_page_config(page_title=APP_NAME, page_icon="📚", layout="centered")
 
 st.title("📚 PLANIT — Smart Lesson Planner")
 st.caption("Aligned to boards. Built for teachers.")
 
+
+def keep_plan(plan: LessonPlan, req: LessonRequest) -> None:
+    # Kept in the session so later widget interactions do not lose the plan
+    st.session_state.plan = plan.model_dump()
+    st.session_state.request = req.model_dump()
+    st.session_state.created = datetime.now().strftime("%Y%m%d_%H%M")
+
+
+def start_job(kind: str, payload: dict) -> None:
+    # Model calls run in background worker processes; the job id in the URL survives reruns and reconnects
+    ensure_workers()
+    job_id = submit(job_queue(), kind, payload)
+    st.session_state.job = job_id
+    st.query_params["job"] = str(job_id)
+    st.session_state.pop("job_error", None)
+
+
+@st.fragment(run_every=0.5)
+def job_progress(job_id: int) -> None:
+    # Only this fragment reruns while polling; the page reruns once when the job finishes
+    job = job_queue().get(job_id)
+    if job is None or job.status in (DONE, FAILED):
+        del st.session_state.job
+        if job is not None and job.trace:
+            # The worker's stage breakdown, for the debug panel, and its counts for the Cache panel
+            metrics.merge(job.trace)
+            merge_counters(job.trace)
+        if job is not None and job.status == DONE:
+            keep_plan(LessonPlan(**job.result), LessonRequest(**job.payload["request"]))
+        elif job is not None:
+            st.session_state.job_error = job.error
+        st.rerun()
+    partial = job.progress or {}
+    st.info("Waiting for a free worker…" if job.status == QUEUED else "Thinking…")
+    if partial.get("title"):
+        st.markdown(f"# {partial['title']}")
+    for name, content in partial.get("sections", {}).items():
+        st.markdown(section_to_markdown(name, content))
+
+
+@st.fragment
+def plan_actions(plan: dict, req: LessonRequest) -> None:
+    # Picking sections or a language reruns only this fragment; starting a job reruns the page
+    with st.expander("Regenerate sections"):
+        chosen = st.multiselect("Sections to rewrite", [s for s in SECTION_ORDER if s in plan["sections"]])
+        feedback = st.text_input("What should change? (optional)")
+        if st.button("Regenerate selected", disabled=not chosen, use_container_width=True):
+            start_job("regenerate", {"request": req.model_dump(), "plan": plan, "sections": chosen,
+                                     "feedback": feedback.strip()})
+            st.rerun()
+
+    with st.expander("Translate"):
+        # Sections stream in as they are translated; stock phrasing comes from the translation memory
+        targets = [code for code in LANGUAGES if code != "en"]
+        target = st.selectbox("Language", targets, format_func=LANGUAGES.get)
+        if st.button("Translate plan", use_container_width=True):
+            start_job("translate", {"request": req.model_dump(), "plan": plan, "target": target})
+            st.rerun()
+
+
+@st.fragment
+def downloads(plan: dict, base: str) -> None:
+    # Rendered in memory, once per plan and format: reruns and repeat downloads reuse the bytes
+    pdf_error = None
+    with metrics.trace("export"):
+        docx_data = export_bytes(plan, "docx")
+        try:
+            pdf_data = export_bytes(plan, "pdf")
+        except RuntimeError as e:
+            # core.pdf.MissingFontError (core.pdf loads reportlab, so it is not imported here): no font
+            # for the plan's script, and a PDF without that text is worse than none
+            pdf_data, pdf_error = None, e
+    colx, coly = st.columns(2)
+    # on_click="ignore": a download is served without rerunning anything
+    colx.download_button("Download .docx", data=docx_data, file_name=f"{base}.docx", mime=MIME_TYPES["docx"],
+                         on_click="ignore", use_container_width=True)
+    if pdf_error is not None:
+        coly.error(f"Failed to create PDF: {pdf_error}")
+    else:
+        coly.download_button("Download .pdf", data=pdf_data, file_name=f"{base}.pdf", mime=MIME_TYPES["pdf"],
+                             on_click="ignore", use_container_width=True)
+
+
+@st.fragment
+def library_panel() -> None:
+    # Searching, filtering and paging rerun only this panel; opening a plan reruns the page
+    library = plan_library()
+    query = st.text_input("Search saved plans", key="library_query")
+    picked = {name: st.session_state.get(f"library_{name}") for name in FACETS}
+    counts = library.facets(query, source="main", **picked)
+    for name in FACETS:
+        options = [v for v, _ in counts[name]]
+        if picked[name] and picked[name] not in options:
+            options.append(picked[name])
+        label = dict(counts[name])
+        st.selectbox(name.title(), options, index=None, key=f"library_{name}",
+                     format_func=lambda v, label=label: f"{v} ({label.get(v, 0)})")
+
+    # Cursor stack for Prev/Next; any change to the query or filters starts again at page one
+    scope = (query, tuple(picked.values()))
+    if st.session_state.get("library_scope") != scope:
+        st.session_state.library_scope = scope
+        st.session_state.library_cursors = [None]
+    cursor = st.session_state.library_cursors[-1]
+    if query.strip():
+        page = library.search(query, 10, offset=cursor or 0, source="main", **picked)
+    else:
+        page = library.history(10, after=cursor, source="main", **picked)
+
+    for entry in page.items:
+        if st.button(f"{entry.title} · {entry.subject} · Grade {entry.grade}", key=f"library_open_{entry.id}",
+                     use_container_width=True):
+            saved = library.get(entry.id)
+            keep_plan(LessonPlan(**saved["plan"]), LessonRequest(**saved["request"]))
+            st.session_state.pop("similar", None)
+            st.session_state.pop("job", None)
+            st.query_params.pop("job", None)
+            st.rerun()
+        if entry.snippet:
+            st.caption(entry.snippet)
+    if not page.items:
+        st.caption("No saved plans yet." if not (query or any(picked.values())) else "No matches.")
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("Prev", disabled=len(st.session_state.library_cursors) == 1, use_container_width=True):
+        st.session_state.library_cursors.pop()
+        st.rerun()
+    if next_col.button("Next", disabled=page.next is None, use_container_width=True):
+        st.session_state.library_cursors.append(page.next)
+        st.rerun()
+
+
+# Board/subject/topic sit outside the form so the cascade and topic suggestions update live
+catalog = get_index()
+col1, col2 = st.columns(2)
+with col1:
+    board = st.selectbox("Board", BOARDS, index=0)
+    subject = st.selectbox("Subject", catalog.subjects(board) or SUBJECTS["CBSE"])
+with col2:
+    topic = st.text_input("Topic", placeholder="Fractions / Photosynthesis / Nouns…")
+    suggestions = catalog.search(topic, board, subject) if topic.strip() else catalog.topics_for(board, subject, limit=10)
+    if suggestions:
+        picked = st.selectbox("Syllabus topics", suggestions, index=None, placeholder="Pick a matching syllabus topic…")
+        if picked:
+            topic = picked
+
 with st.form("controls"):
     col1, col2 = st.columns(2)
     with col1:
-        board = st.selectbox("Board", BOARDS, index=0)
         grade = st.number_input("Grade", min_value=1, max_value=12, value=5)
-        subject = st.selectbox("Subject", SUBJECTS.get(board, SUBJECTS["CBSE"]))
         duration = st.selectbox("Duration", DURATIONS, index=2)
     with col2:
-        topic = st.text_input("Topic", placeholder="Fractions / Photosynthesis / Nouns…")
         pedagogy = st.selectbox("Pedagogy", PEDAGOGY_STYLES, index=1)
         bloom = st.selectbox("Bloom's Level", BLOOMS_LEVELS, index=2)
 
@@ -50,28 +197,93 @@ if submitted:
         constraints=[c.strip() for c in constraints.splitlines() if c.strip()],
     )
 
-    with st.spinner("Thinking…"):
-        plan = generate_lesson(req)
+    # A near-duplicate of an earlier request is offered instead of spending a model call
+    matches = find_similar(req)
+    if matches:
+        st.session_state.similar = {"request": req.model_dump(), "match": matches[0].model_dump()}
+        st.session_state.pop("plan", None)
+    else:
+        st.session_state.pop("similar", None)
+        st.session_state.pop("plan", None)
+        start_job("generate", {"request": req.model_dump()})
+
+# A fresh session opened on ?job=N (reload, reconnect) picks the job up again
+if "job" not in st.session_state and not st.session_state.get("plan") and st.query_params.get("job", "").isdigit():
+    st.session_state.job = int(st.query_params["job"])
+
+if st.session_state.get("job"):
+    job_progress(st.session_state.job)
+elif st.session_state.get("job_error"):
+    st.error(f"Generation failed: {st.session_state.job_error}")
+
+if st.session_state.get("similar"):
+    offer = st.session_state.similar
+    req = LessonRequest(**offer["request"])
+    match = SimilarPlan(**offer["match"])
+    changed = ", ".join(f.replace("_", " ") for f in match.differs) or "nothing"
+    st.info(f"A similar plan already exists ({match.score:.0%} match; differs in {changed}).")
+    with st.expander(match.plan.get("title", "Lesson Plan")):
+        st.markdown(to_markdown(match.plan))
+    col1, col2, col3 = st.columns(3)
+    if col1.button("Use this plan", use_container_width=True):
+        del st.session_state.similar
+        keep_plan(LessonPlan(**match.plan), req)
+        st.rerun()
+    if col2.button("Adapt changed sections", disabled=not match.differs, use_container_width=True):
+        del st.session_state.similar
+        start_job("adapt", {"request": req.model_dump(), "match": match.model_dump()})
+        st.rerun()
+    if col3.button("Generate fresh", use_container_width=True):
+        del st.session_state.similar
+        start_job("generate", {"request": req.model_dump()})
+        st.rerun()
+
+if st.session_state.get("plan"):
+    plan = st.session_state.plan
+    req = LessonRequest(**st.session_state.request)
 
     st.success("Lesson plan ready.")
-    md = to_markdown(plan.model_dump())
-    st.markdown(md)
+    st.markdown(to_markdown(plan))
+    plan_actions(plan, req)
+    downloads(plan, f"{req.subject}_{req.topic}_{st.session_state.created}".replace(" ", "_"))
 
-    colx, coly = st.columns(2)
-    now = datetime.now().strftime("%Y%m%d_%H%M")
-    base = f"{req.subject}_{req.topic}_{now}".replace(" ", "_")
-
-    with colx:
-        if st.button("Export DOCX", use_container_width=True):
-            out = to_docx(plan.model_dump(), path=f"{base}.docx")
-            with open(out, "rb") as f:
-                st.download_button("Download .docx", data=f, file_name=os.path.basename(out), mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True)
-
-    with coly:
-        if st.button("Export PDF", use_container_width=True):
-            out = to_pdf(plan.model_dump(), path=f"{base}.pdf")
-            with open(out, "rb") as f:
-                st.download_button("Download .pdf", data=f, file_name=os.path.basename(out), mime="application/pdf", use_container_width=True)
+with st.sidebar.expander("Library", expanded=False):
+    # Every generated plan is saved; browse newest first or search section text
+    library_panel()
+
+with st.sidebar.expander("Cache"):
+    stats = cache_stats()
+    st.caption(f"Hits: {stats['hits']} · Misses: {stats['misses']} · Coalesced: {stats['coalesced']}")
+    parsing = parse_stats()
+    st.caption(f"Repaired: {parsing['repair_rate']:.0%} · Section retries: {parsing['retry_rate']:.0%} · Calls saved: {parsing['calls_saved']}")
+    budget = budget_stats()
+    if budget["calls"]:
+        st.caption(f"Output budget: {budget['utilization']:.0%} used · truncated {budget['truncated']} of {budget['calls']} calls")
+    exports = export_stats()
+    if exports["renders"] or exports["disk_hits"]:
+        st.caption(f"Exports: {exports['renders']} rendered · {exports['hits'] + exports['disk_hits']} reused")
+    memory = translation_memory().stats()
+    if memory.get("stored_total"):
+        st.caption(f"Translation memory: {memory['stored_total']} segments")
+    similar = similar_stats()
+    if similar:
+        st.caption(f"Similar plans: {similar['plans']} indexed · offered for {similar['hits']} of {similar['lookups']} requests")
+    quiz = quiz_stats()
+    if quiz.get("items"):
+        st.caption(f"Quiz bank: {quiz['items']} questions")
+    jobs = job_queue().stats()
+    st.caption(f"Jobs: {jobs['queued']} queued · {jobs['running']} running · wait p95 {jobs['wait_p95']:.1f}s · "
+               f"run p95 {jobs['run_p95']:.1f}s · {jobs['failed']} failed")
+
+with st.sidebar.expander("Debug"):
+    # Stage timings of the last requests (generation runs in job workers) and of every stage since start-up
+    if not metrics.enabled():
+        st.caption("Metrics are off (METRICS_ENABLED=0).")
+    elif metrics.recent():
+        st.dataframe(metrics.debug_rows(10), hide_index=True)
+        st.dataframe(metrics.stage_summary(), hide_index=True)
+    else:
+        st.caption("No requests yet.")
 
 st.divider()
 st.caption("Made with ❤️ for teachers. SDG4: Quality Education.")
\ No newline at end of file
@@ -0,0 +1,237 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import quote
+
+from pydantic import BaseModel, Field, ValidationError
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from .backends import BackendError
+from .catalog import get_index
+from .config import API_DEADLINE, API_MAX_DEADLINE
+from .curriculum import GRADES_MAPPING
+from .export import FORMATS, MIME_TYPES, export_bytes, iter_zip, safe_filename
+from .generator import LessonPlan, LessonRequest, agenerate_lesson, agenerate_lesson_stream
+from .library import record_demand
+from .metrics import render as render_metrics, trace
+
+# Headless service for LMS integrations: run with `cd src && python -m core.api`
+# (or any ASGI server: `uvicorn core.api:app`).
+
+
+class ZipRequest(BaseModel):
+    plans: List[LessonPlan]
+    formats: List[str] = Field(default_factory=lambda: list(FORMATS))
+
+
+class APIError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None,
+                 details: Optional[Any] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+        self.details = details
+
+
+async def _body(request: Request, model: type) -> Any:
+    try:
+        return model.model_validate(await request.json())
+    except ValueError as e:
+        if isinstance(e, ValidationError):
+            raise APIError(422, "invalid request body", details=json.loads(e.json(include_url=False))) from e
+        raise APIError(400, "body must be JSON") from e
+
+
+def _deadline(request: Request) -> float:
+    """Seconds this request may take: ?timeout=N, capped at API_MAX_DEADLINE."""
+    raw = request.query_params.get("timeout")
+    try:
+        value = float(raw) if raw else API_DEADLINE
+    except ValueError:
+        raise APIError(400, "timeout must be a number of seconds")
+    if value <= 0:
+        raise APIError(400, "timeout must be positive")
+    return min(value, API_MAX_DEADLINE)
+
+
+def _backend_error(e: BackendError) -> APIError:
+    # Rounded up: "0" would tell clients to retry at once
+    headers = {"Retry-After": str(max(1, math.ceil(e.retry_after)))} if e.retry_after else None
+    status = e.status if e.status in (429, 503) else 502
+    return APIError(status, f"model backend error: {e}", headers)
+
+
+def _wants_stream(request: Request) -> bool:
+    return request.query_params.get("stream") in ("1", "true") or \
+        "text/event-stream" in request.headers.get("accept", "")
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def _events(data: LessonRequest, deadline: float) -> AsyncIterator[bytes]:
+    # Errors after the response has started can only be reported in-band
+    title, sections = "Lesson Plan", {}
+    stream = agenerate_lesson_stream(data, timeout=deadline).__aiter__()
+    end = time.monotonic() + deadline
+    try:
+        with trace("api.generate", stream=True):
+            while True:
+                # The deadline covers waiting on the model, not the time the client takes to read an event
+                try:
+                    name, content = await asyncio.wait_for(stream.__anext__(), max(0.0, end - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                if name == "title":
+                    title = content
+                    yield _sse("title", {"title": content})
+                else:
+                    sections[name] = content
+                    yield _sse("section", {"name": name, "content": content})
+        yield _sse("plan", LessonPlan(title=title, sections=sections).model_dump())
+    except (TimeoutError, asyncio.TimeoutError):
+        yield _sse("error", {"error": "deadline exceeded", "status": 504})
+    except BackendError as e:
+        err = _backend_error(e)
+        yield _sse("error", {"error": err.message, "status": err.status})
+    except ValueError as e:
+        yield _sse("error", {"error": str(e), "status": 502})
+    finally:
+        await stream.aclose()
+
+
+async def generate(request: Request) -> Response:
+    data = await _body(request, LessonRequest)
+    deadline = _deadline(request)
+    record_demand(data.model_dump())
+    if _wants_stream(request):
+        return StreamingResponse(_events(data, deadline), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    try:
+        with trace("api.generate"):
+            plan = await asyncio.wait_for(agenerate_lesson(data, timeout=deadline), deadline)
+    except (TimeoutError, asyncio.TimeoutError):
+        raise APIError(504, "deadline exceeded")
+    except BackendError as e:
+        raise _backend_error(e)
+    except ValueError as e:
+        raise APIError(502, str(e))
+    return JSONResponse(plan.model_dump())
+
+
+async def export(request: Request) -> Response:
+    fmt = request.path_params["fmt"]
+    if fmt not in FORMATS:
+        raise APIError(404, f"unknown format {fmt!r}; use one of {', '.join(FORMATS)}")
+    plan = (await _body(request, LessonPlan)).model_dump()
+    # DOCX/PDF rendering is CPU-bound; keep it off the event loop
+    with trace("api.export", format=fmt):
+        data = await run_in_threadpool(export_bytes, plan, fmt)
+    filename = f"{safe_filename(plan['title'])}.{fmt}"
+    return Response(data, media_type=MIME_TYPES[fmt],
+                    headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename, safe='')}"})
+
+
+async def export_zip(request: Request) -> Response:
+    body = await _body(request, ZipRequest)
+    unknown = [f for f in body.formats if f not in FORMATS]
+    if unknown or not body.formats:
+        raise APIError(422, f"formats must be a non-empty subset of {', '.join(FORMATS)}")
+    plans = [p.model_dump() for p in body.plans]
+    # A sync iterator: Starlette pulls each chunk in its threadpool
+    return StreamingResponse(iter_zip(plans, body.formats), media_type=MIME_TYPES["zip"],
+                             headers={"Content-Disposition": 'attachment; filename="lesson_plans.zip"'})
+
+
+async def boards(request: Request) -> Response:
+    index = get_index()
+    return JSONResponse({"boards": [{"name": b, "bands": index.bands(b)} for b in index.boards()]})
+
+
+async def subjects(request: Request) -> Response:
+    q = request.query_params
+    index = get_index()
+    board = q.get("board")
+    if not board:
+        raise APIError(422, "board is required")
+    band = q.get("band") or (index.band_for_grade(q["grade"]) if q.get("grade") else "")
+    if q.get("grade") and not band:
+        raise APIError(422, f"unknown grade {q['grade']!r}; use one of {', '.join(GRADES_MAPPING)}")
+    stream = q.get("stream", "")
+    return JSONResponse({"board": board, "band": band, "streams": index.streams(board, band) if band else [],
+                         "subjects": index.subjects(board, band, stream)})
+
+
+async def topics(request: Request) -> Response:
+    q = request.query_params
+    try:
+        limit = max(1, min(int(q.get("limit", "10")), 100))
+    except ValueError:
+        raise APIError(400, "limit must be an integer")
+    index = get_index()
+    text = q.get("q", "").strip()
+    board, subject = q.get("board"), q.get("subject")
+    if text:
+        found = index.search(text, board, subject, limit)
+    elif board and subject:
+        found = index.topics_for(board, subject, limit)
+    else:
+        raise APIError(422, "pass q, or board and subject")
+    return JSONResponse({"topics": found})
+
+
+async def health(request: Request) -> Response:
+    return JSONResponse({"ok": True})
+
+
+async def metrics(request: Request) -> Response:
+    # Prometheus text exposition of this process's stage histograms and token counters
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+async def _api_error(request: Request, exc: APIError) -> Response:
+    body: Dict[str, Any] = {"error": exc.message}
+    if exc.details is not None:
+        body["details"] = exc.details
+    return JSONResponse(body, status_code=exc.status, headers=exc.headers)
+
+
+app = Starlette(
+    routes=[
+        Route("/healthz", health),
+        Route("/metrics", metrics),
+        Route("/v1/lessons", generate, methods=["POST"]),
+        Route("/v1/export/zip", export_zip, methods=["POST"]),
+        Route("/v1/export/{fmt}", export, methods=["POST"]),
+        Route("/v1/curriculum/boards", boards),
+        Route("/v1/curriculum/subjects", subjects),
+        Route("/v1/curriculum/topics", topics),
+    ],
+    exception_handlers={APIError: _api_error},
+)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the lesson planner HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
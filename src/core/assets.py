@@ -0,0 +1,134 @@
+from __future__ import annotations
+import argparse
+import base64
+import functools
+import hashlib
+import json
+import os
+import sys
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Streamlit serves <main script dir>/static at app/static/ when enableStaticServing is on
+STATIC_DIR = os.path.join(ROOT, "static")
+STATIC_URL = "app/static"
+MANIFEST = "assets.json"
+
+# Largest variant first; the smaller ones are picked for narrow viewports
+WIDTHS = (736, 480)
+FORMATS = (("avif", "image/avif", 45), ("webp", "image/webp", 60), ("jpg", "image/jpeg", 70))
+
+
+def _encode(img, fmt: str, quality: int) -> bytes:
+    buf = BytesIO()
+    if fmt == "jpg":
+        img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif fmt == "webp":
+        img.save(buf, "WEBP", quality=quality, method=6)
+    else:
+        img.save(buf, "AVIF", quality=quality)
+    return buf.getvalue()
+
+
+def build_image(src: str, name: str, out_dir: str = STATIC_DIR, widths: Sequence[int] = WIDTHS) -> Dict[str, Any]:
+    """Write resized AVIF/WebP/JPEG variants plus an inline blurred placeholder for one image."""
+    try:
+        from PIL import Image, ImageFilter, features
+    except ImportError as e:
+        raise RuntimeError("Building assets needs Pillow: pip install Pillow") from e
+
+    with open(src, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()[:10]
+    img = Image.open(BytesIO(raw)).convert("RGB")
+    os.makedirs(out_dir, exist_ok=True)
+
+    variants: List[Dict[str, Any]] = []
+    for width in widths:
+        width = min(width, img.width)
+        resized = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        for fmt, mime, quality in FORMATS:
+            if fmt in ("avif", "webp") and not features.check(fmt):
+                continue
+            # Content hash in the name makes the URL safe to cache indefinitely
+            filename = f"{name}-{width}-{digest}.{fmt}"
+            data = _encode(resized, fmt, quality)
+            with open(os.path.join(out_dir, filename), "wb") as f:
+                f.write(data)
+            variants.append({"width": width, "format": fmt, "mime": mime, "file": filename, "bytes": len(data)})
+
+    tiny = img.resize((16, round(img.height * 16 / img.width))).filter(ImageFilter.GaussianBlur(1))
+    placeholder = "data:image/jpeg;base64," + base64.b64encode(_encode(tiny, "jpg", 40)).decode()
+    return {"hash": digest, "source_bytes": len(raw), "placeholder": placeholder, "variants": variants}
+
+
+def build(src: str, out_dir: str = STATIC_DIR) -> Dict[str, Any]:
+    manifest = {"background": build_image(src, "background", out_dir)}
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    load_manifest.cache_clear()
+    return manifest
+
+
+@functools.lru_cache(maxsize=4)
+def load_manifest(out_dir: str = STATIC_DIR) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _image_set(variants: List[Dict[str, Any]], width: int) -> str:
+    parts = [f'url("{STATIC_URL}/{v["file"]}") type("{v["mime"]}")' for v in variants if v["width"] == width]
+    return "image-set(" + ", ".join(parts) + ")"
+
+
+@functools.lru_cache(maxsize=16)
+def _background_css(manifest_json: str, selector: str) -> str:
+    image = json.loads(manifest_json)
+    variants = image["variants"]
+    widths = sorted({v["width"] for v in variants}, reverse=True)
+    largest = widths[0]
+    jpg = next(v for v in variants if v["width"] == largest and v["format"] == "jpg")
+    rules = [
+        f"{selector} {{",
+        # Plain url() first for browsers without image-set(); the blurred placeholder shows until it loads
+        f'background-image: url("{STATIC_URL}/{jpg["file"]}"), url("{image["placeholder"]}");',
+        f'background-image: {_image_set(variants, largest)}, url("{image["placeholder"]}");',
+        "background-size: cover;",
+        "background-position: center;",
+        "background-repeat: no-repeat;",
+        "background-attachment: fixed;",
+        "}",
+    ]
+    for width in widths[1:]:
+        rules.append(f"@media (max-width: {width}px) {{ {selector} {{ "
+                     f'background-image: {_image_set(variants, width)}, url("{image["placeholder"]}"); }} }}')
+    return "\n".join(rules)
+
+
+def background_css(selector: str, out_dir: str = STATIC_DIR) -> Optional[str]:
+    """CSS (a few KB) pointing at the statically served variants, or None if assets were not built."""
+    manifest = load_manifest(out_dir)
+    if not manifest or "background" not in manifest:
+        return None
+    return _background_css(json.dumps(manifest["background"], sort_keys=True), selector)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build optimized static image variants.")
+    parser.add_argument("--src", default=os.path.join(ROOT, "background.jpg"))
+    parser.add_argument("--out", default=STATIC_DIR)
+    args = parser.parse_args(argv)
+
+    image = build(args.src, args.out)["background"]
+    for v in image["variants"]:
+        print(f'{v["file"]:40s} {v["bytes"] / 1024:8.1f} KB')
+    print(f'source {image["source_bytes"] / 1024:.1f} KB, placeholder {len(image["placeholder"])} bytes')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Protocol, Tuple
+
+from pydantic import BaseModel
+
+from .config import (
+    GEMINI_API_KEY,
+    DEFAULT_MODEL,
+    LLM_BACKEND,
+    FAKE_LATENCY,
+    FAKE_JITTER,
+    FAKE_ERROR_RATE,
+    FAKE_OUTPUT_TOKENS,
+    FAKE_SEED,
+    FAKE_CAPACITY,
+    FAKE_RPS,
+    FAKE_RETRY_AFTER,
+    FAKE_SLOW_RATE,
+    FAKE_SLOW_FACTOR,
+    FAKE_MODEL_LATENCY,
+    MODEL_ADAPTIVE,
+)
+from .metrics import record_tokens
+from .utils import SECTION_ORDER
+
+
+class LLMResponse(BaseModel):
+    text: str
+    model: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    finish_reason: Optional[str] = None
+
+
+class BackendError(RuntimeError):
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMBackend(Protocol):
+    name: str
+
+    def generate(self, prompt: str, *, model: Optional[str] = None, config: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None) -> LLMResponse: ...
+
+    def stream(self, prompt: str, *, model: Optional[str] = None, config: Optional[Dict[str, Any]] = None,
+               timeout: Optional[float] = None) -> Iterator[str]: ...
+
+    # Async variants for the HTTP API, so a slow model call does not hold a worker thread
+    async def agenerate(self, prompt: str, *, model: Optional[str] = None, config: Optional[Dict[str, Any]] = None,
+                        timeout: Optional[float] = None) -> LLMResponse: ...
+
+    def astream(self, prompt: str, *, model: Optional[str] = None, config: Optional[Dict[str, Any]] = None,
+                timeout: Optional[float] = None) -> AsyncIterator[str]: ...
+
+
+class GeminiBackend:
+    """google.generativeai behind a process-wide configure and a per-model client pool."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, default_model: str = DEFAULT_MODEL):
+        self.api_key = api_key
+        self.default_model = default_model
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._genai = None
+
+    def _model(self, name: Optional[str]):
+        name = name or self.default_model
+        with self._lock:
+            if self._genai is None:
+                if not self.api_key:
+                    raise RuntimeError("GEMINI_API_KEY is not set. Create a .env or set the env var.")
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._genai = genai
+            if name not in self._models:
+                self._models[name] = self._genai.GenerativeModel(name)
+            return self._models[name]
+
+    def _kwargs(self, config: Optional[Dict[str, Any]], timeout: Optional[float]) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {}
+        if config:
+            kwargs["generation_config"] = config
+        if timeout:
+            kwargs["request_options"] = {"timeout": timeout}
+        return kwargs
+
+    def _response(self, resp, model: Optional[str]) -> LLMResponse:
+        usage = getattr(resp, "usage_metadata", None)
+        candidates = getattr(resp, "candidates", None) or []
+        finish = getattr(candidates[0], "finish_reason", None) if candidates else None
+        out = LLMResponse(
+            text=resp.text or "",
+            model=model or self.default_model,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            finish_reason=getattr(finish, "name", None) or (str(finish) if finish is not None else None),
+        )
+        record_tokens(out.model, out.prompt_tokens, out.output_tokens)
+        return out
+
+    def _stream_usage(self, chunk, model: Optional[str]) -> None:
+        # Streamed responses carry cumulative usage; the last chunk has the totals
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage is not None:
+            record_tokens(model or self.default_model, getattr(usage, "prompt_token_count", 0) or 0,
+                          getattr(usage, "candidates_token_count", 0) or 0)
+
+    @contextmanager
+    def _errors(self) -> Iterator[None]:
+        # google.api_core errors carry the HTTP status as .code; surface them as BackendError
+        # so the retry layer can tell a 429 from a bad request
+        try:
+            yield
+        except Exception as e:
+            status = getattr(e, "code", None)
+            if type(e).__module__.startswith("google.api_core") and isinstance(status, int):
+                raise BackendError(str(e), status=status, retry_after=_retry_after(e)) from e
+            raise
+
+    def generate(self, prompt, *, model=None, config=None, timeout=None) -> LLMResponse:
+        client = self._model(model)
+        with self._errors():
+            return self._response(client.generate_content(prompt, **self._kwargs(config, timeout)), model)
+
+    def stream(self, prompt, *, model=None, config=None, timeout=None) -> Iterator[str]:
+        client = self._model(model)
+        with self._errors():
+            chunk = None
+            for chunk in client.generate_content(prompt, stream=True, **self._kwargs(config, timeout)):
+                yield chunk.text
+            self._stream_usage(chunk, model)
+
+    async def agenerate(self, prompt, *, model=None, config=None, timeout=None) -> LLMResponse:
+        # The SDK's async client keeps one gRPC channel per process, so connections are reused
+        client = self._model(model)
+        with self._errors():
+            resp = await client.generate_content_async(prompt, **self._kwargs(config, timeout))
+            return self._response(resp, model)
+
+    async def astream(self, prompt, *, model=None, config=None, timeout=None) -> AsyncIterator[str]:
+        client = self._model(model)
+        with self._errors():
+            resp = await client.generate_content_async(prompt, stream=True, **self._kwargs(config, timeout))
+            chunk = None
+            async for chunk in resp:
+                yield chunk.text
+            self._stream_usage(chunk, model)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds from a RetryInfo detail or a "retry in 12.3s" message, if the service sent one."""
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + getattr(delay, "nanos", 0) / 1e9
+    m = re.search(r"retry (?:in|after) (\d+(?:\.\d+)?)\s*s", str(error), re.IGNORECASE)
+    return float(m.group(1)) if m else None
+
+
+_FILLER = (
+    "students observe and discuss examples of {topic} in small groups",
+    "the teacher models {topic} with a worked example on the board",
+    "learners record key ideas about {topic} in their notebooks",
+    "pairs explain {topic} to each other using everyday situations",
+    "a short exit ticket checks understanding of {topic}",
+    "the class connects {topic} to prior knowledge",
+)
+# Average words per filler line with a one-word topic; each extra topic word adds one
+_FILLER_WORDS = 9
+_STEMS = (
+    "What is the main idea of {topic}?",
+    "Which example best shows {topic} in everyday life?",
+    "Why is {topic} important?",
+    "Which statement about {topic} is correct?",
+    "How would you use {topic} to solve a new problem?",
+    "Which of these is NOT related to {topic}?",
+    "Which is the best way to check an answer about {topic}?",
+    "What would you design to show {topic} to a younger class?",
+)
+_OPTIONS = ("a cause of {topic}", "an example of {topic}", "a result of {topic}", "a use of {topic}",
+            "a model of {topic}", "a test of {topic}")
+
+
+class FakeBackend:
+    """Offline stand-in that returns templated plans after a simulated delay.
+
+    Output is deterministic per (prompt, seed). Prompts asking for the legacy
+    '###' Markdown layout get Markdown back, everything else gets plan JSON.
+    With `capacity` or `rps` set it behaves like a quota-limited endpoint:
+    latency grows with load, and calls over either limit fail fast with a
+    429 carrying `retry_after`. `slow_rate` of calls take `slow_factor`
+    times as long (a heavy tail), and `model_latency` gives some models
+    their own latency, e.g. a faster fallback.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: float = FAKE_LATENCY,
+        jitter: float = FAKE_JITTER,
+        error_rate: float = FAKE_ERROR_RATE,
+        output_tokens: int = FAKE_OUTPUT_TOKENS,
+        seed: int = FAKE_SEED,
+        chunk_chars: int = 80,
+        capacity: int = FAKE_CAPACITY,
+        rps: float = FAKE_RPS,
+        retry_after: float = FAKE_RETRY_AFTER,
+        slow_rate: float = FAKE_SLOW_RATE,
+        slow_factor: float = FAKE_SLOW_FACTOR,
+        model_latency: Optional[Dict[str, float]] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+        self.seed = seed
+        self.chunk_chars = chunk_chars
+        self.capacity = capacity
+        self.rps = rps
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.model_latency = _model_latency(FAKE_MODEL_LATENCY) if model_latency is None else model_latency
+        self.calls = 0
+        self.throttled = 0
+        self.inflight = 0
+        self._started: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _rng(self, prompt: str) -> Tuple[random.Random, random.Random]:
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest()
+        # Content depends only on the prompt; delays/errors also vary per call
+        return random.Random(int(digest[:16], 16)), random.Random(int(digest[16:32], 16) + call)
+
+    def _delay(self, rng: random.Random, scale: float = 1.0, model: Optional[str] = None) -> float:
+        # `latency` is for a full-length response; like a real model, shorter output is faster
+        latency = self.model_latency.get(model or "", self.latency)
+        delay = max(0.0, latency + rng.uniform(-self.jitter, self.jitter)) * scale
+        if self.slow_rate and rng.random() < self.slow_rate:
+            delay *= self.slow_factor
+        if self.capacity:
+            # A loaded service queues work: up to twice as slow at full capacity
+            delay *= 1 + min(self.inflight, self.capacity) / self.capacity
+        return delay
+
+    def _admit(self) -> None:
+        """Take an in-flight slot or raise the 429 a quota-limited endpoint would."""
+        now = time.monotonic()
+        with self._lock:
+            while self._started and now - self._started[0] >= 1.0:
+                self._started.popleft()
+            over_capacity = self.capacity and self.inflight >= self.capacity
+            over_rate = self.rps and len(self._started) >= self.rps
+            if over_capacity or over_rate:
+                self.throttled += 1
+                wait = 1.0 - (now - self._started[0]) if over_rate else self.retry_after
+                raise BackendError("fake backend: quota exceeded", status=429,
+                                   retry_after=max(wait, self.retry_after))
+            self.inflight += 1
+            self._started.append(now)
+
+    def _leave(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+    def _maybe_fail(self, rng: random.Random) -> None:
+        if self.error_rate and rng.random() < self.error_rate:
+            raise BackendError("fake backend: simulated overload", status=503)
+
+    def render(self, prompt: str, rng: random.Random) -> str:
+        topic_match = re.search(r"Topic:\**\s*(.+)", prompt)
+        topic = topic_match.group(1).strip() if topic_match else "the topic"
+        limits = self._limits(prompt)
+
+        # Multiple-choice questions only when the prompt asks for them (core.quizbank supplies the rest)
+        asked = re.search(r"(\d+)(?:-question)? multiple-choice", prompt)
+        questions = self._questions(topic, int(asked.group(1)) if asked else 0, rng)
+
+        def lines(name: str, share: int) -> List[str]:
+            # Within the section's word target (core.budget), so budgeted output is not cut off
+            words, line = limits.get(name), _FILLER_WORDS + len(topic.split()) - 1
+            per = max(1, words // line if words else round(self._words(prompt) / share / line))
+            return [f"{rng.choice(_FILLER).format(topic=topic).capitalize()}." for _ in range(per)]
+
+        if "###" in prompt:
+            # Only the headings the prompt lists; a section rewrite names just the ones it wants
+            headings = re.findall(r"'### ([^']+)'", prompt) or ["📝 Introduction", "🎯 Main Activity", "✨ Conclusion"]
+            rewrite = "Rewrite only these sections" in prompt
+            body = [h for h in headings if "Quiz" not in h]
+            parts = [f"### {h}\n" + "\n".join(f"- {line}" for line in lines(h.split(" ", 1)[-1], len(body) + 1))
+                     for h in body]
+            if questions and (not rewrite or any("Quiz" in h for h in headings)):
+                parts.append("### 📝 Quiz\n" + "\n".join(
+                    f"{i}. {stem}\n" + "".join(f"   {'abcd'[j]}) {o}\n" for j, o in enumerate(options))
+                    + f"   Answer: {'abcd'[answer]}" for i, (stem, options, answer) in enumerate(questions, 1)))
+            return "\n\n".join(parts)
+
+        # Only the keys the prompt asks for: a section re-request names the ones it wants
+        keys = re.search(r"Return JSON with only these keys: (.+?)\.?\n", prompt)
+        names = [k.strip() for k in keys.group(1).split(", ")] if keys else SECTION_ORDER
+        sections = {s: lines(s, len(names)) for s in names}
+        if "Assessment" in sections:
+            sections["Assessment"] += [
+                f"{stem} " + " ".join(f"{'ABCD'[j]}) {o}" for j, o in enumerate(options))
+                + f" Answer: {'ABCD'[answer]}" for stem, options, answer in questions
+            ]
+        payload = {"title": f"Lesson Plan: {topic}", "sections": sections} if not keys else sections
+        return "```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```"
+
+    @staticmethod
+    def _limits(prompt: str) -> Dict[str, int]:
+        """Per-section word targets from the prompt's length guide: {"Lesson Flow": 140, ...}."""
+        guide = re.search(r"words in total \((.*)\)\.", prompt)
+        if not guide:
+            return {}
+        return {name.strip(): int(n) for name, n in re.findall(r"([^;]+?) at most (\d+) words", guide.group(1))}
+
+    @staticmethod
+    def _questions(topic: str, n: int, rng: random.Random) -> List[Tuple[str, List[str], int]]:
+        stems = rng.sample(_STEMS, len(_STEMS))
+        return [(stems[i % len(stems)].format(topic=topic),
+                 [o.format(topic=topic).capitalize() for o in rng.sample(_OPTIONS, 4)], rng.randrange(4))
+                for i in range(n)]
+
+    def _words(self, prompt: str) -> int:
+        # Follows a length target in the prompt (core.budget), otherwise writes about output_tokens
+        target = re.search(r"about (\d+) words in total", prompt)
+        return int(target.group(1)) if target else max(self.output_tokens * 3 // 4, 40)
+
+    def _output(self, prompt: str, rng: random.Random,
+                config: Optional[Dict[str, Any]]) -> Tuple[str, str, float]:
+        """Text, finish reason and delay scale; output is cut at config["max_output_tokens"] like the real API."""
+        text = self.render(prompt, rng)
+        scale = self._words(prompt) / max(self.output_tokens * 3 // 4, 40)
+        limit = (config or {}).get("max_output_tokens")
+        if limit and len(text) // 4 > limit:
+            return text[:limit * 4], "MAX_TOKENS", scale * limit * 4 / len(text)
+        return text, "STOP", scale
+
+    def _response(self, prompt: str, text: str, finish: str, model: Optional[str]) -> LLMResponse:
+        record_tokens(model or "fake", len(prompt) // 4, len(text) // 4)
+        return LLMResponse(text=text, model=model or "fake", prompt_tokens=len(prompt) // 4,
+                           output_tokens=len(text) // 4, finish_reason=finish)
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+
+    def generate(self, prompt, *, model=None, config=None, timeout=None) -> LLMResponse:
+        content_rng, call_rng = self._rng(prompt)
+        text, finish, scale = self._output(prompt, content_rng, config)
+        self._admit()
+        try:
+            time.sleep(self._delay(call_rng, scale, model))
+            self._maybe_fail(call_rng)
+        finally:
+            self._leave()
+        return self._response(prompt, text, finish, model)
+
+    def stream(self, prompt, *, model=None, config=None, timeout=None) -> Iterator[str]:
+        content_rng, call_rng = self._rng(prompt)
+        text, _, scale = self._output(prompt, content_rng, config)
+        self._admit()
+        try:
+            total = self._delay(call_rng, scale, model)
+            self._maybe_fail(call_rng)
+            chunks = self._chunks(text)
+            # Roughly a fifth of the time goes to the first token, the rest is spread over chunks
+            time.sleep(total * 0.2)
+            for chunk in chunks:
+                yield chunk
+                time.sleep(total * 0.8 / len(chunks))
+            record_tokens(model or "fake", len(prompt) // 4, sum(map(len, chunks)) // 4)
+        finally:
+            self._leave()
+
+    async def agenerate(self, prompt, *, model=None, config=None, timeout=None) -> LLMResponse:
+        content_rng, call_rng = self._rng(prompt)
+        text, finish, scale = self._output(prompt, content_rng, config)
+        self._admit()
+        try:
+            await asyncio.sleep(self._delay(call_rng, scale, model))
+            self._maybe_fail(call_rng)
+        finally:
+            self._leave()
+        return self._response(prompt, text, finish, model)
+
+    async def astream(self, prompt, *, model=None, config=None, timeout=None) -> AsyncIterator[str]:
+        content_rng, call_rng = self._rng(prompt)
+        text, _, scale = self._output(prompt, content_rng, config)
+        self._admit()
+        try:
+            total = self._delay(call_rng, scale, model)
+            self._maybe_fail(call_rng)
+            chunks = self._chunks(text)
+            await asyncio.sleep(total * 0.2)
+            for chunk in chunks:
+                yield chunk
+                await asyncio.sleep(total * 0.8 / len(chunks))
+            record_tokens(model or "fake", len(prompt) // 4, sum(map(len, chunks)) // 4)
+        finally:
+            self._leave()
+
+
+def _model_latency(spec: str) -> Dict[str, float]:
+    """{"gemini-1.5-flash-8b": 0.4} for "gemini-1.5-flash-8b=0.4"."""
+    pairs = (item.split("=", 1) for item in spec.split(",") if "=" in item)
+    return {name.strip(): float(value) for name, value in pairs}
+
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = FakeBackend() if LLM_BACKEND == "fake" else GeminiBackend()
+            if MODEL_ADAPTIVE:
+                from .limiter import ResilientBackend
+                _backend = ResilientBackend(_backend)
+        return _backend
+
+
+def set_backend(backend: LLMBackend) -> None:
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,299 @@
+from __future__ import annotations
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from pydantic import BaseModel
+
+from .curriculum import (
+    BOARDS,
+    SUBJECTS,
+    BLOOMS_LEVELS,
+    PEDAGOGY_STYLES,
+    DURATIONS,
+    LESSON_DATA,
+    GRADES_MAPPING,
+)
+from .generator import LessonRequest, LessonPlan, generate_lesson, request_key
+from .legacy import generate_lesson_plan, lesson_key
+
+# What --legacy batches ask micro-lessons for; the app takes the teacher's own objective
+LEGACY_OBJECTIVE = "explain the key ideas of {topic}"
+
+
+class LegacyRequest(BaseModel):
+    """A micro-lesson request as lesson_planner.py makes it: grade is the form's label, e.g. "7th Grade"."""
+    board: str
+    grade: str
+    subject: str
+    topic: str
+    objective: str
+
+
+class LegacyPlan(BaseModel):
+    # As the plan library stores micro-lessons
+    title: str
+    text: str
+
+
+BatchRequest = Union[LessonRequest, LegacyRequest]
+
+
+def batch_key(req: BatchRequest) -> str:
+    """The plan cache key the app making this request would use."""
+    if isinstance(req, LegacyRequest):
+        return lesson_key(req.board, req.grade, req.subject, req.topic, req.objective)
+    return request_key(req)
+
+
+def generate_legacy(req: LegacyRequest) -> LegacyPlan:
+    text = generate_lesson_plan(req.board, req.grade, req.subject, req.topic, req.objective)
+    if text.startswith("An error occurred"):
+        raise RuntimeError(text)
+    return LegacyPlan(title=req.topic, text=text)
+
+
+class BatchResult(BaseModel):
+    index: int
+    key: str
+    request: BatchRequest
+    plan: Optional[Union[LessonPlan, LegacyPlan]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.plan is not None
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, up to `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def _run_one(
+    index: int,
+    req: BatchRequest,
+    generate: Callable[[Any], Any],
+    bucket: TokenBucket,
+    retries: int,
+    backoff: float,
+) -> BatchResult:
+    start = time.monotonic()
+    error = None
+    for attempt in range(1, retries + 2):
+        bucket.acquire()
+        try:
+            plan = generate(req)
+            return BatchResult(index=index, key=batch_key(req), request=req, plan=plan,
+                               attempts=attempt, elapsed=time.monotonic() - start)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempt <= retries:
+                time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+    return BatchResult(index=index, key=batch_key(req), request=req, error=error,
+                       attempts=retries + 1, elapsed=time.monotonic() - start)
+
+
+def generate_lessons_batch(
+    requests: Iterable[BatchRequest],
+    concurrency: int = 4,
+    rate: float = 2.0,
+    burst: Optional[float] = None,
+    retries: int = 3,
+    backoff: float = 1.0,
+    generate: Callable[[Any], Any] = generate_lesson,
+) -> Iterator[BatchResult]:
+    """Run requests on a bounded pool and yield results in completion order.
+
+    Pass `generate=generate_legacy` for LegacyRequest items (see legacy_requests).
+
+    Failures are retried with jittered exponential backoff and then reported
+    as a result with `error` set, so one bad item never stops the batch.
+    """
+    bucket = TokenBucket(rate, burst)
+    items = enumerate(requests)
+    pending: set[Future] = set()
+    # Keep only a small window queued so huge batches stay bounded in memory
+    window = concurrency * 2
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lesson-batch") as pool:
+        def fill() -> None:
+            for index, req in items:
+                pending.add(pool.submit(_run_one, index, req, generate, bucket, retries, backoff))
+                if len(pending) >= window:
+                    break
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                pending.discard(fut)
+                yield fut.result()
+            fill()
+
+
+# --- request expansion ---
+
+def curriculum_requests(
+    topics: Dict[str, List[str]],
+    grades: Iterable[int] = range(1, 13),
+    durations: Iterable[str] = DURATIONS,
+    pedagogy: str = PEDAGOGY_STYLES[1],
+    bloom: str = BLOOMS_LEVELS[2],
+    boards: Iterable[str] = BOARDS,
+) -> Iterator[LessonRequest]:
+    """BOARDS x SUBJECTS x grades x durations, for every topic listed per subject ("*" applies to all)."""
+    grades, durations = list(grades), list(durations)
+    for board in boards:
+        for subject in SUBJECTS.get(board, []):
+            for topic in topics.get(subject, []) + topics.get("*", []):
+                for grade in grades:
+                    for duration in durations:
+                        yield LessonRequest(board=board, grade=grade, subject=subject, topic=topic,
+                                            duration=duration, pedagogy=pedagogy, bloom=bloom)
+
+
+def legacy_requests(
+    topics: Dict[str, List[str]],
+    objective: str = LEGACY_OBJECTIVE,
+) -> Iterator[LegacyRequest]:
+    """Walk LESSON_DATA (with streams for Senior Secondary) and its topic lists plus extra `topics`.
+
+    Requests are the micro-lesson app's, one per grade label, so their plans land under the keys
+    the app looks up; `objective` is formatted with the topic.
+    """
+    for board, categories in LESSON_DATA.items():
+        for grade, category in GRADES_MAPPING.items():
+            tree = categories.get(category, {})
+            if category == "Senior Secondary":
+                subjects: Dict[str, Any] = {}
+                for stream_subjects in tree.values():
+                    subjects.update(stream_subjects)
+            else:
+                subjects = tree
+            for subject, known in subjects.items():
+                for topic in list(known) + topics.get(subject, []) + topics.get("*", []):
+                    yield LegacyRequest(board=board, grade=grade, subject=subject, topic=topic,
+                                        objective=objective.format(topic=topic))
+
+
+# --- CLI ---
+
+def _read_jsonl(path: str) -> Iterator[LessonRequest]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield LessonRequest(**json.loads(line))
+
+
+def _done_keys(path: str) -> set[str]:
+    keys = set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # partially written line from an interrupted run
+                if row.get("plan"):
+                    keys.add(row["key"])
+    except FileNotFoundError:
+        pass
+    return keys
+
+
+def _grades(spec: str) -> List[int]:
+    out: List[int] = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        out.extend(range(int(lo), int(hi or lo) + 1))
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate lesson plans in bulk and stream them to JSONL.")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--input", help="JSONL file of LessonRequest objects")
+    src.add_argument("--curriculum", action="store_true", help="expand BOARDS x SUBJECTS x grades x durations")
+    src.add_argument("--legacy", action="store_true", help="expand the LESSON_DATA tree")
+    parser.add_argument("--topics", help='JSON file mapping subject -> [topics]; "*" applies to every subject')
+    parser.add_argument("--topic", action="append", default=[], help="topic for every subject (repeatable)")
+    parser.add_argument("--grades", default="1-12", help="e.g. 6-8 or 1,5,9-10")
+    parser.add_argument("--durations", default=",".join(DURATIONS))
+    parser.add_argument("--objective", default=LEGACY_OBJECTIVE,
+                        help="--legacy: learning objective, {topic} is replaced by the topic")
+    parser.add_argument("--out", default="-", help="output JSONL path, '-' for stdout")
+    parser.add_argument("--resume", action="store_true", help="skip requests already successful in --out")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="max model calls per second")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    topics: Dict[str, List[str]] = {}
+    if args.topics:
+        with open(args.topics, encoding="utf-8") as f:
+            topics = json.load(f)
+    if args.topic:
+        topics["*"] = topics.get("*", []) + args.topic
+
+    generate: Callable[[Any], Any] = generate_lesson
+    if args.input:
+        requests: Iterable[BatchRequest] = _read_jsonl(args.input)
+    elif args.curriculum:
+        requests = curriculum_requests(topics, _grades(args.grades), args.durations.split(","))
+    else:
+        requests, generate = legacy_requests(topics, args.objective), generate_legacy
+
+    if args.resume and args.out != "-":
+        done = _done_keys(args.out)
+        requests = (r for r in requests if batch_key(r) not in done)
+
+    out = sys.stdout if args.out == "-" else open(args.out, "a", encoding="utf-8")
+    ok = failed = 0
+    try:
+        for result in generate_lessons_batch(requests, args.concurrency, args.rate,
+                                             retries=args.retries, backoff=args.backoff, generate=generate):
+            out.write(result.model_dump_json() + "\n")
+            out.flush()
+            if result.ok:
+                ok += 1
+            else:
+                failed += 1
+                print(f"[{result.index}] {result.request.topic}: {result.error}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"done: {ok} ok, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+from __future__ import annotations
+import math
+import re
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+from pydantic import BaseModel
+
+from .config import (
+    BUDGET_WORDS_PER_MINUTE,
+    BUDGET_TOKENS_PER_WORD,
+    BUDGET_HEADROOM,
+)
+from .metrics import REGISTRY, count
+from .repair import extract_object
+from .utils import SECTION_ORDER
+
+# Share of the plan's words per section; Lesson Flow carries the lesson itself
+SECTION_WEIGHTS = {
+    "Unit Overview": 0.08,
+    "Learning Outcomes": 0.10,
+    "Prerequisites": 0.06,
+    "Materials": 0.06,
+    "Lesson Flow": 0.32,
+    "Differentiation": 0.10,
+    "Assessment": 0.12,
+    "Homework/Extensions": 0.10,
+    "References": 0.06,
+}
+
+# The legacy micro-lesson: fixed 15 minutes, and five MCQs with answers need room of their own
+LEGACY_MINUTES = 15
+LEGACY_WEIGHTS = {"intro": 0.18, "activity": 0.37, "conclusion": 0.15, "quiz": 0.30}
+LEGACY_QUESTIONS = 5
+# A multiple-choice question with four short options and its answer
+QUIZ_ITEM_WORDS = 24
+
+MIN_SECTION_WORDS = 20
+MAX_PLAN_WORDS = 1500
+# JSON keys, quotes and brackets around each section, plus the title
+SECTION_OVERHEAD_TOKENS = 12
+PLAN_OVERHEAD_TOKENS = 30
+
+# Providers that end a response at the token limit report one of these finish reasons
+TRUNCATED_REASONS = {"MAX_TOKENS", "LENGTH"}
+
+REGISTRY.describe("planit_output_tokens_budget_total", "counter", "Output tokens budgeted per model call.")
+REGISTRY.describe("planit_output_tokens_used_total", "counter", "Output tokens used by budgeted model calls.")
+REGISTRY.describe("planit_truncations_total", "counter", "Model responses cut off at the output token budget.")
+
+
+class Budget(BaseModel):
+    words: Dict[str, int]
+    max_output_tokens: int
+
+    @property
+    def total_words(self) -> int:
+        return sum(self.words.values())
+
+    def config(self) -> Dict[str, Any]:
+        return {"max_output_tokens": self.max_output_tokens}
+
+
+def minutes(duration: Any) -> int:
+    """45 for "45 min", 90 for "1.5 h"; 45 when nothing can be read."""
+    m = re.search(r"(\d+(?:\.\d+)?)\s*(h|hr|hour)?", str(duration), re.IGNORECASE)
+    if not m:
+        return 45
+    value = float(m.group(1))
+    return max(5, round(value * 60 if m.group(2) else value))
+
+
+def grade_number(grade: Any) -> int:
+    m = re.match(r"\s*(\d+)", str(grade))
+    # Nursery/LKG/UKG and anything unreadable budget like the lower primary grades
+    return min(12, int(m.group(1))) if m else 1
+
+
+def grade_factor(grade: Any) -> float:
+    # Grade 1 plans run at about 80% of the words of a grade 12 plan: shorter sentences, fewer items
+    return 0.78 + 0.02 * grade_number(grade)
+
+
+def tokens_per_word(sample: str = "") -> float:
+    """Gujarati, Devanagari and other non-Latin scripts cost roughly three times the tokens per word."""
+    letters = [c for c in sample if c.isalpha()]
+    if letters and sum(ord(c) > 0x24F for c in letters) / len(letters) > 0.3:
+        return BUDGET_TOKENS_PER_WORD * 3
+    return BUDGET_TOKENS_PER_WORD
+
+
+def _allocate(total_words: int, weights: Dict[str, float], sections: Sequence[str]) -> Dict[str, int]:
+    share = sum(weights[s] for s in sections) or 1.0
+    return {s: max(MIN_SECTION_WORDS, int(round(total_words * weights[s] / share / 5.0)) * 5) for s in sections}
+
+
+def _tokens(words: Dict[str, int], per_word: float) -> int:
+    # Headroom keeps the hard cap above the soft word targets, so it only bites on runaway output
+    body = sum(words.values()) * per_word * BUDGET_HEADROOM
+    return int(math.ceil(body + SECTION_OVERHEAD_TOKENS * len(words) + PLAN_OVERHEAD_TOKENS))
+
+
+def plan_budget(duration: Any, grade: Any, sections: Sequence[str] = SECTION_ORDER, language_hint: str = "",
+                questions: int = 0) -> Budget:
+    """Word targets per section and an output token cap for a plan (or just `sections` of it).
+
+    `language_hint` is request text (topic, subject) used to tell the script the plan will be written in.
+    `questions` multiple-choice questions asked for in Assessment get room on top of its share.
+    """
+    total = min(MAX_PLAN_WORDS, minutes(duration) * BUDGET_WORDS_PER_MINUTE * grade_factor(grade))
+    # A subset of sections keeps its share of the whole plan's words
+    total *= sum(SECTION_WEIGHTS.get(s, 0.0) for s in sections) / sum(SECTION_WEIGHTS.values())
+    words = _allocate(int(total), SECTION_WEIGHTS, [s for s in sections if s in SECTION_WEIGHTS])
+    if "Assessment" in words:
+        words["Assessment"] += questions * QUIZ_ITEM_WORDS
+    return Budget(words=words, max_output_tokens=_tokens(words, tokens_per_word(language_hint)))
+
+
+def legacy_budget(grade: Any, keys: Sequence[str] = tuple(LEGACY_WEIGHTS), language_hint: str = "",
+                  questions: int = LEGACY_QUESTIONS) -> Budget:
+    """Like plan_budget for the micro-lesson; the quiz shrinks to the `questions` the model writes itself."""
+    total = LEGACY_MINUTES * BUDGET_WORDS_PER_MINUTE * grade_factor(grade)
+    total *= sum(LEGACY_WEIGHTS[k] for k in keys)
+    words = _allocate(int(total), LEGACY_WEIGHTS, keys)
+    if "quiz" in keys:
+        words["quiz"] = max(words["quiz"], LEGACY_QUESTIONS * QUIZ_ITEM_WORDS) * questions // LEGACY_QUESTIONS
+    words = {k: v for k, v in words.items() if v}
+    return Budget(words=words, max_output_tokens=_tokens(words, tokens_per_word(language_hint)))
+
+
+def length_guide(budget: Budget, names: Optional[Dict[str, str]] = None) -> str:
+    """Prompt lines with the word targets; `names` maps budget keys to the headings the model sees."""
+    names = names or {}
+    limits = "; ".join(f"{names.get(k, k)} at most {v} words" for k, v in budget.words.items())
+    return f"Length: about {budget.total_words} words in total ({limits})."
+
+
+def is_truncated(text: str, finish_reason: Optional[str] = None) -> bool:
+    if finish_reason is not None and str(finish_reason).upper() in TRUNCATED_REASONS:
+        return True
+    # Streams carry no finish reason: JSON that never closes was cut off
+    if text.lstrip().startswith(("{", "```")):
+        return extract_object(text)[1]
+    return False
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"calls": 0, "budgeted": 0, "used": 0, "truncated": 0}
+
+    def add(self, **deltas: int) -> None:
+        with self.lock:
+            for k, v in deltas.items():
+                self.counts[k] += v
+
+
+_stats = _Stats()
+
+
+def observe(budget: Optional[Budget], output_tokens: int, truncated: bool, model: str = "") -> None:
+    """Track budgeted vs used output tokens for one call."""
+    if budget is None:
+        return
+    _stats.add(calls=1, budgeted=budget.max_output_tokens, used=output_tokens, truncated=int(truncated))
+    count("planit_output_tokens_budget_total", budget.max_output_tokens, model=model)
+    count("planit_output_tokens_used_total", output_tokens, model=model)
+    if truncated:
+        count("planit_truncations_total", model=model)
+
+
+def merge_budget_stats(deltas: Dict[str, float]) -> None:
+    """Add counts recorded by another process (a job worker) to this one's."""
+    with _stats.lock:
+        for k, v in deltas.items():
+            if k in _stats.counts:
+                _stats.counts[k] += v
+
+
+def budget_stats() -> Dict[str, float]:
+    with _stats.lock:
+        stats: Dict[str, float] = dict(_stats.counts)
+    stats["utilization"] = stats["used"] / stats["budgeted"] if stats["budgeted"] else 0.0
+    stats["truncation_rate"] = stats["truncated"] / stats["calls"] if stats["calls"] else 0.0
+    return stats
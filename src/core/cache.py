@@ -0,0 +1,231 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from .config import CACHE_PATH, CACHE_TTL, CACHE_MEMORY_ITEMS, CACHE_DISK_ITEMS
+
+
+def _normalize(value: Any) -> Any:
+    # Case/whitespace differences should not produce a different plan
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value if not (isinstance(v, str) and not v.strip())]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items())}
+    return value
+
+
+def cache_key(fields: Dict[str, Any], model: str, template: str) -> str:
+    blob = json.dumps(
+        {
+            "fields": _normalize(fields),
+            "model": model,
+            "template": hashlib.sha256(template.encode("utf-8")).hexdigest(),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class LessonCache:
+    """Two-tier (memory LRU + SQLite) cache with single-flight coalescing."""
+
+    def __init__(
+        self,
+        path: Optional[str] = CACHE_PATH,
+        ttl: float = CACHE_TTL,
+        max_memory: int = CACHE_MEMORY_ITEMS,
+        max_disk: int = CACHE_DISK_ITEMS,
+    ):
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self._memory: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if path:
+            folder = os.path.dirname(os.path.abspath(path))
+            os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lessons ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS lessons_accessed ON lessons(accessed)")
+            self._db.commit()
+
+    # --- memory tier ---
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: Dict[str, Any], created: Optional[float] = None) -> None:
+        self._memory[key] = ((created or time.time()) + self.ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    # --- disk tier ---
+
+    def _disk_get(self, key: str) -> Optional[tuple[float, Dict[str, Any]]]:
+        if self._db is None:
+            return None
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute("SELECT value, created FROM lessons WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if created + self.ttl < now:
+                self._db.execute("DELETE FROM lessons WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE lessons SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return created, json.loads(value)
+
+    def _disk_set(self, key: str, value: Dict[str, Any]) -> None:
+        if self._db is None:
+            return
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO lessons (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._evict_disk(now)
+            self._db.commit()
+
+    def _evict_disk(self, now: float) -> None:
+        self._db.execute("DELETE FROM lessons WHERE created < ?", (now - self.ttl,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM lessons").fetchone()
+        if count > self.max_disk:
+            self._db.execute(
+                "DELETE FROM lessons WHERE key IN (SELECT key FROM lessons ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_disk,),
+            )
+
+    # --- public API ---
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._memory_get(key)
+            if value is not None:
+                self._stats["memory_hits"] += 1
+                return value
+        hit = self._disk_get(key)
+        if hit is None:
+            return None
+        created, value = hit
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            self._memory_set(key, value, created)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory_set(key, value)
+        self._disk_set(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            # A leader may have stored the value and retired its flight since our miss above
+            value = self._memory_get(key)
+            if value is not None:
+                self._stats["memory_hits"] += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            with self._lock:
+                self._stats["misses"] += 1
+            flight.result = compute()
+            self.set(key, flight.result)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def merge_stats(self, deltas: Dict[str, float]) -> None:
+        """Add counts recorded by another process (a job worker) to this one's."""
+        with self._lock:
+            for k, v in deltas.items():
+                if k in self._stats:
+                    self._stats[k] += int(v)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        stats["memory_items"] = len(self._memory)
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM lessons")
+                self._db.commit()
+
+
+_cache: Optional[LessonCache] = None
+_cache_lock = threading.Lock()
+
+
+def lesson_cache() -> LessonCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LessonCache()
+        return _cache
@@ -0,0 +1,236 @@
+from __future__ import annotations
+import argparse
+import bisect
+import gzip
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .config import CURRICULUM_PATH
+from .curriculum import BOARDS, SUBJECTS, LESSON_DATA, GRADES_MAPPING
+
+# Syllabus rows: board, grade band, stream, subject, topic. Band "" means any
+# grade (the main app's BOARDS/SUBJECTS); stream is only set for Senior Secondary.
+Row = Tuple[str, str, str, str, str]
+
+
+def builtin_rows() -> Iterator[Row]:
+    for board in BOARDS:
+        for subject in SUBJECTS.get(board, []):
+            yield board, "", "", subject, ""
+    for board, bands in LESSON_DATA.items():
+        for band, tree in bands.items():
+            for name, value in tree.items():
+                if isinstance(value, dict):
+                    for subject, topics in value.items():
+                        yield board, band, name, subject, ""
+                        for topic in topics:
+                            yield board, band, name, subject, topic
+                else:
+                    yield board, band, "", name, ""
+                    for topic in value:
+                        yield board, band, "", name, topic
+
+
+def read_rows(path: str) -> Iterator[Row]:
+    """Read a tab-separated syllabus file (optionally .gz) with five columns per line."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            parts = (line.rstrip("\n").split("\t") + [""] * 5)[:5]
+            yield tuple(p.strip() for p in parts)  # type: ignore[misc]
+
+
+def _fold(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CurriculumIndex:
+    """Precomputed cascading lookups plus prefix/fuzzy topic search.
+
+    Prefix search bisects a sorted list of every word-start suffix of each
+    topic, so "refl" finds "Light: Reflection". Fuzzy search scores trigram
+    overlap through an inverted index. Both are filtered by board/subject.
+    """
+
+    def __init__(self, rows: Iterable[Row]):
+        self._bands: Dict[str, List[str]] = defaultdict(list)
+        self._streams: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        self._subjects: Dict[Tuple[str, str, str], List[str]] = defaultdict(list)
+        self.topics: List[str] = []
+        topic_ids: Dict[str, int] = {}
+        self._scope: Dict[Tuple[str, str], Set[int]] = defaultdict(set)
+        self._board_scope: Dict[str, Set[int]] = defaultdict(set)
+
+        for board, band, stream, subject, topic in rows:
+            if band not in self._bands[board]:
+                self._bands[board].append(band)
+            if stream and stream not in self._streams[(board, band)]:
+                self._streams[(board, band)].append(stream)
+            subjects = self._subjects[(board, band, stream)]
+            if subject and subject not in subjects:
+                subjects.append(subject)
+            if topic:
+                tid = topic_ids.get(topic)
+                if tid is None:
+                    tid = topic_ids[topic] = len(self.topics)
+                    self.topics.append(topic)
+                self._scope[(board, subject)].add(tid)
+                self._board_scope[board].add(tid)
+
+        self._folded = [_fold(t) for t in self.topics]
+        keys: List[Tuple[str, int]] = []
+        grams: Dict[str, List[int]] = defaultdict(list)
+        for tid, folded in enumerate(self._folded):
+            words = folded.split(" ")
+            offset = 0
+            for word in words:
+                keys.append((folded[offset:], tid))
+                offset += len(word) + 1
+            for g in _trigrams(folded):
+                grams[g].append(tid)
+        keys.sort()
+        self._prefix_keys = [k for k, _ in keys]
+        self._prefix_ids = [t for _, t in keys]
+        self._grams = dict(grams)
+        self._gram_counts = [len(_trigrams(f)) for f in self._folded]
+
+    # --- cascading lookups ---
+
+    def boards(self) -> List[str]:
+        return list(self._bands)
+
+    def bands(self, board: str) -> List[str]:
+        return [b for b in self._bands.get(board, []) if b]
+
+    def band_for_grade(self, grade: str) -> str:
+        """The LESSON_DATA band for a GRADES_MAPPING grade; "" for a grade it does not know."""
+        return GRADES_MAPPING.get(grade, "")
+
+    def streams(self, board: str, band: str) -> List[str]:
+        return list(self._streams.get((board, band), []))
+
+    def subjects(self, board: str, band: str = "", stream: str = "") -> List[str]:
+        return list(self._subjects.get((board, band, stream or ""), []))
+
+    def topics_for(self, board: str, subject: str, limit: Optional[int] = None) -> List[str]:
+        ids = sorted(self._scope.get((board, subject), ()))
+        return [self.topics[i] for i in ids[:limit]]
+
+    # --- search ---
+
+    def _allowed(self, board: Optional[str], subject: Optional[str]) -> Optional[Set[int]]:
+        if board and subject:
+            return self._scope.get((board, subject), set())
+        if board:
+            return self._board_scope.get(board, set())
+        return None
+
+    def prefix(self, query: str, board: Optional[str] = None, subject: Optional[str] = None,
+               limit: int = 10) -> List[str]:
+        q = _fold(query)
+        if not q:
+            return []
+        allowed = self._allowed(board, subject)
+        out: List[int] = []
+        seen: Set[int] = set()
+        i = bisect.bisect_left(self._prefix_keys, q)
+        while i < len(self._prefix_keys) and self._prefix_keys[i].startswith(q) and len(out) < limit:
+            tid = self._prefix_ids[i]
+            if tid not in seen and (allowed is None or tid in allowed):
+                seen.add(tid)
+                out.append(tid)
+            i += 1
+        # Topics that start with the query rank above mid-title word matches
+        out.sort(key=lambda t: (not self._folded[t].startswith(q), len(self._folded[t])))
+        return [self.topics[t] for t in out]
+
+    def fuzzy(self, query: str, board: Optional[str] = None, subject: Optional[str] = None,
+              limit: int = 10, min_score: float = 0.3) -> List[str]:
+        q = _fold(query)
+        if not q:
+            return []
+        allowed = self._allowed(board, subject)
+        qgrams = _trigrams(q)
+        counts: Counter = Counter()
+        for g in qgrams:
+            counts.update(self._grams.get(g, ()))
+        # A topic needs at least this many shared trigrams to reach min_score
+        need = min_score * len(qgrams) / 2
+        scored = []
+        for tid, hits in counts.items():
+            if hits < need or (allowed is not None and tid not in allowed):
+                continue
+            # Dice coefficient over trigram sets
+            score = 2 * hits / (len(qgrams) + self._gram_counts[tid])
+            if score >= min_score:
+                scored.append((score, tid))
+        scored.sort(key=lambda x: (-x[0], self._folded[x[1]]))
+        return [self.topics[t] for _, t in scored[:limit]]
+
+    def search(self, query: str, board: Optional[str] = None, subject: Optional[str] = None,
+               limit: int = 10) -> List[str]:
+        results = self.prefix(query, board, subject, limit)
+        if len(results) < limit:
+            for topic in self.fuzzy(query, board, subject, limit):
+                if topic not in results:
+                    results.append(topic)
+                if len(results) >= limit:
+                    break
+        return results
+
+
+_index: Optional[CurriculumIndex] = None
+_index_lock = threading.Lock()
+
+
+def load_index(path: Optional[str] = CURRICULUM_PATH) -> CurriculumIndex:
+    rows: Iterable[Row] = builtin_rows()
+    if path and os.path.exists(path):
+        rows = list(rows) + list(read_rows(path))
+    return CurriculumIndex(rows)
+
+
+def get_index() -> CurriculumIndex:
+    # Built once per process on first use, then shared by every session/rerun
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = load_index()
+        return _index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Query the curriculum index.")
+    parser.add_argument("query")
+    parser.add_argument("--board")
+    parser.add_argument("--subject")
+    parser.add_argument("--file", default=CURRICULUM_PATH, help="syllabus TSV to load")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    index = load_index(args.file)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    results = index.search(args.query, args.board, args.subject, args.limit)
+    took = time.perf_counter() - start
+    for topic in results:
+        print(topic)
+    print(f"{len(index.topics)} topics indexed in {built * 1e3:.1f} ms; query took {took * 1e3:.3f} ms",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,148 @@ load_dotenv()
 
 APP_NAME = os.getenv("APP_NAME", "PLANIT")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gemini-1.5-flash")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
-if not GEMINI_API_KEY:
-    raise RuntimeError("GEMINI_API_KEY is not set. Create a .env or set the env var.")
\ No newline at end of file
+# "gemini" or "fake" (offline, for benchmarks and load tests)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+FAKE_LATENCY = float(os.getenv("FAKE_LATENCY", "1.0"))
+FAKE_JITTER = float(os.getenv("FAKE_JITTER", "0.2"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+FAKE_OUTPUT_TOKENS = int(os.getenv("FAKE_OUTPUT_TOKENS", "800"))
+FAKE_SEED = int(os.getenv("FAKE_SEED", "0"))
+# Simulated quota: calls beyond FAKE_CAPACITY in flight or FAKE_RPS per second get a 429 (0 = unlimited)
+FAKE_CAPACITY = int(os.getenv("FAKE_CAPACITY", "0"))
+FAKE_RPS = float(os.getenv("FAKE_RPS", "0"))
+FAKE_RETRY_AFTER = float(os.getenv("FAKE_RETRY_AFTER", "1.0"))
+# Injected tail latency: FAKE_SLOW_RATE of calls take FAKE_SLOW_FACTOR times as long
+FAKE_SLOW_RATE = float(os.getenv("FAKE_SLOW_RATE", "0"))
+FAKE_SLOW_FACTOR = float(os.getenv("FAKE_SLOW_FACTOR", "10"))
+# Per-model latency overrides, "model=seconds,model=seconds" (e.g. a faster fallback model)
+FAKE_MODEL_LATENCY = os.getenv("FAKE_MODEL_LATENCY", "")
+
+# Model calls (core.limiter): adaptive in-flight limit, and retries on 429/5xx within a total deadline
+MODEL_ADAPTIVE = os.getenv("MODEL_ADAPTIVE", "1") not in ("0", "false", "False")
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "4"))
+MODEL_CONCURRENCY_MIN = int(os.getenv("MODEL_CONCURRENCY_MIN", "1"))
+MODEL_CONCURRENCY_MAX = int(os.getenv("MODEL_CONCURRENCY_MAX", "64"))
+MODEL_DEADLINE = float(os.getenv("MODEL_DEADLINE", "90"))
+MODEL_RETRIES = int(os.getenv("MODEL_RETRIES", "6"))
+MODEL_BACKOFF = float(os.getenv("MODEL_BACKOFF", "0.5"))
+MODEL_BACKOFF_MAX = float(os.getenv("MODEL_BACKOFF_MAX", "20"))
+
+# Tail latency (core.hedge): a plan request gets GENERATE_DEADLINE seconds in total. When the model has not
+# answered after the HEDGE_PERCENTILE latency of recent calls, a duplicate goes to HEDGE_MODEL (empty = same model)
+# and the first valid answer wins. Hedges are skipped while they exceed HEDGE_MAX_RATE of recent calls.
+GENERATE_DEADLINE = float(os.getenv("GENERATE_DEADLINE", "60"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") not in ("0", "false", "False")
+HEDGE_MODEL = os.getenv("HEDGE_MODEL", "")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+# Delay before enough calls have been seen, and bounds on the percentile-based delay
+HEDGE_INITIAL_DELAY = float(os.getenv("HEDGE_INITIAL_DELAY", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "30"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Stage timings and token counts (core.metrics); TRACE_PATH appends one JSON line per request when set
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False")
+TRACE_PATH = os.getenv("TRACE_PATH", "")
+METRICS_RECENT = int(os.getenv("METRICS_RECENT", "50"))
+
+# Output budgets: word targets and max_output_tokens derived from duration, grade and sections
+BUDGET_ENABLED = os.getenv("BUDGET_ENABLED", "1") not in ("0", "false", "False")
+BUDGET_WORDS_PER_MINUTE = float(os.getenv("BUDGET_WORDS_PER_MINUTE", "10"))
+# Latin-script tokens per word; non-Latin scripts are budgeted at three times this
+BUDGET_TOKENS_PER_WORD = float(os.getenv("BUDGET_TOKENS_PER_WORD", "1.6"))
+# max_output_tokens = word targets x tokens per word x headroom, so only runaway output is cut
+BUDGET_HEADROOM = float(os.getenv("BUDGET_HEADROOM", "1.5"))
+
+# Translation (core.translate): "model" goes through the LLM backend, "fake" is offline
+TRANSLATE_BACKEND = os.getenv("TRANSLATE_BACKEND", "fake" if LLM_BACKEND == "fake" else "model")
+TRANSLATE_MODEL = os.getenv("TRANSLATE_MODEL", DEFAULT_MODEL)
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))
+# Segments, and characters, per translator call
+TRANSLATE_BATCH = int(os.getenv("TRANSLATE_BATCH", "24"))
+TRANSLATE_BATCH_CHARS = int(os.getenv("TRANSLATE_BATCH_CHARS", "3000"))
+FAKE_TRANSLATE_LATENCY = float(os.getenv("FAKE_TRANSLATE_LATENCY", "0.3"))
+# Translation memory: every translated segment, reused across plans (empty string keeps it in memory)
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", os.path.join(".cache", "translations.sqlite3"))
+TRANSLATION_MEMORY_ITEMS = int(os.getenv("TRANSLATION_MEMORY_ITEMS", "20000"))
+
+# PDF export (core.pdf): extra TrueType font folders (os.pathsep-separated), searched before the system ones
+PDF_FONT_DIRS = os.getenv("PDF_FONT_DIRS", os.path.join(os.path.dirname(__file__), "fonts"))
+
+# How many times to re-request only the sections missing from a parsed plan
+SECTION_RETRIES = int(os.getenv("SECTION_RETRIES", "1"))
+
+# Optional syllabus file (TSV: board, grade band, stream, subject, topic) merged into the curriculum index
+CURRICULUM_PATH = os.getenv("CURRICULUM_PATH", os.path.join(os.path.dirname(__file__), "data", "curriculum.tsv"))
+
+# Lesson cache: set CACHE_PATH to an empty string to keep the cache in memory only
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") not in ("0", "false", "False")
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join(".cache", "lessons.sqlite3"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "256"))
+CACHE_DISK_ITEMS = int(os.getenv("CACHE_DISK_ITEMS", "20000"))
+
+# Near-duplicate reuse: previously generated plans are indexed here (empty string keeps it in memory)
+SIMILAR_ENABLED = os.getenv("SIMILAR_ENABLED", "1") not in ("0", "false", "False")
+SIMILAR_PATH = os.getenv("SIMILAR_PATH", os.path.join(".cache", "similar.sqlite3"))
+# Estimated Jaccard similarity of topic/objective trigrams above which a stored plan is offered
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.6"))
+
+# Plan library: every generated plan, searchable (empty string keeps it in memory)
+LIBRARY_ENABLED = os.getenv("LIBRARY_ENABLED", "1") not in ("0", "false", "False")
+LIBRARY_PATH = os.getenv("LIBRARY_PATH", os.path.join(".cache", "library.sqlite3"))
+# Writes are queued and committed in batches of up to LIBRARY_BATCH, waiting at most LIBRARY_LINGER seconds
+LIBRARY_BATCH = int(os.getenv("LIBRARY_BATCH", "256"))
+LIBRARY_LINGER = float(os.getenv("LIBRARY_LINGER", "0.5"))
+
+# Quiz item bank: MCQs parsed from generated quizzes, reused for later plans on the same topic and grade
+# (empty path keeps it in memory); plans get QUIZ_ITEMS questions and the model writes only what the bank lacks
+QUIZ_ENABLED = os.getenv("QUIZ_ENABLED", "1") not in ("0", "false", "False")
+QUIZ_BANK_PATH = os.getenv("QUIZ_BANK_PATH", os.path.join(".cache", "quizbank.sqlite3"))
+QUIZ_ITEMS = int(os.getenv("QUIZ_ITEMS", "5"))
+
+# Cache warmer (core.warm): ranks the last WARM_DAYS of plan requests (older days count less, halving every
+# WARM_HALF_LIFE days) and pre-generates the WARM_TOP most requested plans and their WARM_FORMATS exports.
+# It only starts work inside WARM_WINDOW ("HH:MM-HH:MM" local time, may wrap midnight; empty = any time).
+WARM_DAYS = int(os.getenv("WARM_DAYS", "28"))
+WARM_HALF_LIFE = float(os.getenv("WARM_HALF_LIFE", "7"))
+WARM_TOP = int(os.getenv("WARM_TOP", "200"))
+# Request variants (duration, Bloom level, objective, ...) warmed per board/grade/subject/topic, and the fewest
+# requests a variant needs to be worth warming
+WARM_VARIANTS = int(os.getenv("WARM_VARIANTS", "2"))
+WARM_MIN_HITS = int(os.getenv("WARM_MIN_HITS", "2"))
+# Also warm up to this many syllabus topics (core.catalog) per requested board/grade/subject, in syllabus order
+WARM_SYLLABUS = int(os.getenv("WARM_SYLLABUS", "0"))
+WARM_WINDOW = os.getenv("WARM_WINDOW", "01:00-05:00")
+# Spend limits per run: model tokens, and USD at WARM_PRICE_PROMPT/WARM_PRICE_OUTPUT per million tokens (0 = none)
+WARM_MAX_TOKENS = int(os.getenv("WARM_MAX_TOKENS", "500000"))
+WARM_MAX_COST = float(os.getenv("WARM_MAX_COST", "0"))
+WARM_PRICE_PROMPT = float(os.getenv("WARM_PRICE_PROMPT", "0.075"))
+WARM_PRICE_OUTPUT = float(os.getenv("WARM_PRICE_OUTPUT", "0.30"))
+# Plans started per second, and at most WARM_CONCURRENCY at a time
+WARM_RATE = float(os.getenv("WARM_RATE", "0.5"))
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", "2"))
+WARM_FORMATS = os.getenv("WARM_FORMATS", "docx,pdf")
+
+# HTTP API (core.api): default and maximum per-request deadline in seconds (?timeout=N)
+API_DEADLINE = float(os.getenv("API_DEADLINE", "60"))
+API_MAX_DEADLINE = float(os.getenv("API_MAX_DEADLINE", "300"))
+
+# Background jobs (core.jobs): the UIs start JOBS_WORKERS worker processes (0 = run `python -m core.jobs worker` yourself)
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+# Seconds a claimed job stays invisible without a heartbeat before another worker may take it
+JOBS_VISIBILITY = float(os.getenv("JOBS_VISIBILITY", "30"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_POLL = float(os.getenv("JOBS_POLL", "0.2"))
+JOBS_RETENTION = float(os.getenv("JOBS_RETENTION", str(24 * 3600)))
+
+# Rendered DOCX/PDF files kept per plan content and format, so UI reruns and repeat downloads don't render again
+EXPORT_MEMO_ITEMS = int(os.getenv("EXPORT_MEMO_ITEMS", "64"))
+# ...and on disk, shared by every process (core.warm fills it ahead of peak hours); empty path keeps them in memory only
+EXPORT_CACHE_PATH = os.getenv("EXPORT_CACHE_PATH", os.path.join(".cache", "exports"))
+EXPORT_DISK_ITEMS = int(os.getenv("EXPORT_DISK_ITEMS", "2000"))
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Dict, List
+from typing import Any, Dict, List
 
 BOARDS = [
     "CBSE",
@@ -32,4 +32,144 @@ PEDAGOGY_STYLES = [
     "Experiential",
 ]
 
-DURATIONS = ["30 min", "40 min", "45 min", "60 min", "90 min"]
\ No newline at end of file
+DURATIONS = ["30 min", "40 min", "45 min", "60 min", "90 min"]
+
+# Legacy app layout: board -> grade band -> subject (or stream -> subject) -> topics
+LESSON_DATA: Dict[str, Dict[str, Any]] = {
+    "CBSE": {
+        "Primary (1-5)": {
+            "Mathematics": [],
+            "English": [],
+            "Hindi": [],
+            "Environmental Science (EVS)": [],
+            "Sanskrit": [],
+            "Urdu": [],
+            "Tamil": [],
+            "Kannada": [],
+            # Add regional languages as needed
+        },
+        "Middle (6-8)": {
+            "Mathematics": [],
+            "English": [],
+            "Hindi": [],
+            "Science": [],
+            "Social Science": [],
+            "Sanskrit": [],
+            "Tamil": [],
+            # Add more if applicable
+        },
+        "Secondary (9-10)": {
+            "Mathematics": [],
+            "English": [],
+            "Hindi": [],
+            "Science": [],
+            "Social Science": [],
+            "Computer Applications": [],
+            "Sanskrit": [],
+            "Tamil": [],
+            # More subjects possible
+        },
+        "Senior Secondary": {
+            "Science": {
+                "Physics": [],
+                "Chemistry": [],
+                "Biology": [],
+                "Mathematics": [],
+                "Computer Science": [],
+                "Informatics Practices": [],
+            },
+            "Commerce": {
+                "Business Studies": [],
+                "Accountancy": [],
+                "Economics": [],
+                "Mathematics": [],
+                "Entrepreneurship": [],
+            },
+            "Arts": {
+                "Political Science": [],
+                "Geography": [],
+                "History": [],
+                "Psychology": [],
+                "Sociology": [],
+                "Economics": [],
+                "English": [],
+                "Hindi": [],
+                "Physical Education": [],
+                "Fine Arts": [],
+            }
+        }
+    },
+    "GSEB": {
+        "Primary (1-5)": {
+            "ગણિત (Mathematics)": [],
+            "ગુજરાતી (Gujarati)": [],
+            "અંગ્રેજી (English)": [],
+            "વિજ્ઞાન (Science/EVS)": [],
+            "સામાજિક વિજ્ઞાન (Social Science)": [],
+            # Add more Gujarati medium subjects as needed
+        },
+        "Middle (6-8)": {
+            "ગણિત (Mathematics)": [],
+            "ગુજરાતી (Gujarati)": [],
+            "અંગ્રેજી (English)": [],
+            "વિજ્ઞાન (Science)": [],
+            "સામાજિક વિજ્ઞાન (Social Science)": [],
+            # More as applicable
+        },
+        "Secondary (9-10)": {
+            "ગણિત (Mathematics)": [],
+            "ગુજરાતી (Gujarati)": [],
+            "અંગ્રેજી (English)": [],
+            "વિજ્ઞાન (Science)": [],
+            "સામાજિક વિજ્ઞાન (Social Science)": [],
+            "કમ્પ્યુટર (Computer)": [],
+            # Add more if needed
+        },
+        "Senior Secondary": {
+            "Science": {
+                "ભૌતિક વિજ્ઞાન (Physics)": [],
+                "રાસાયણિક વિજ્ઞાન (Chemistry)": [],
+                "જીવ વિજ્ઞાન (Biology)": [],
+                "ગણિત (Mathematics)": [],
+            },
+            "Commerce": {
+                "વાણિજ્ય અભ્યાસ (Business Studies)": [],
+                "લેખાપાલન (Accountancy)": [],
+                "અર્થશાસ્ત્ર (Economics)": [],
+                "ગણિત (Mathematics)": [],
+            },
+            "Arts": {
+                "રાજકારણ શાસ્ત્ર (Political Science)": [],
+                "ભૂગોળ (Geography)": [],
+                "ઇતિહાસ (History)": [],
+                "મનોઃશાસ્ત્ર (Psychology)": [],
+                "સામાજિક શાસ્ત્ર (Sociology)": [],
+                "અંગ્રેજી (English)": [],
+                "ગુજરાતી (Gujarati)": [],
+                # Add other humanities subjects
+            }
+        }
+    }
+}
+
+# Map grades to categories used above
+GRADES_MAPPING = {
+    # Nursery, LKG, UKG mapped to Primary
+    'Nursery': 'Primary (1-5)', 'LKG': 'Primary (1-5)', 'UKG': 'Primary (1-5)',
+    # Grades 1-5 Primary
+    '1st Grade': 'Primary (1-5)', '2nd Grade': 'Primary (1-5)', '3rd Grade': 'Primary (1-5)',
+    '4th Grade': 'Primary (1-5)', '5th Grade': 'Primary (1-5)',
+    # Grades 6-8 Middle
+    '6th Grade': 'Middle (6-8)', '7th Grade': 'Middle (6-8)', '8th Grade': 'Middle (6-8)',
+    # Grades 9-10 Secondary
+    '9th Grade': 'Secondary (9-10)', '10th Grade': 'Secondary (9-10)',
+    # Grades 11-12 Senior Secondary (streams)
+    '11th Grade': 'Senior Secondary', '12th Grade': 'Senior Secondary'
+}
+
+# For grades 11 and 12, user must select stream:
+STREAMS = {
+    "Science": None,  # Use LESSON_DATA[board]["Senior Secondary"]["Science"]
+    "Commerce": None, # Use LESSON_DATA[board]["Senior Secondary"]["Commerce"]
+    "Arts": None      # Use LESSON_DATA[board]["Senior Secondary"]["Arts"]
+}
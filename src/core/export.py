@@ -1,13 +1,45 @@
 from __future__ import annotations
-from typing import Dict, Any
-from docx import Document
-from docx.shared import Pt
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from .utils import SECTION_ORDER
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import zipfile
+from collections import OrderedDict
+from io import BytesIO
+from typing import Callable, Dict, Any, BinaryIO, Iterable, Iterator, List, Optional, Sequence, Tuple
+from .config import EXPORT_CACHE_PATH, EXPORT_DISK_ITEMS, EXPORT_MEMO_ITEMS
+from .metrics import REGISTRY, count, timed
+from .utils import SECTION_ORDER, to_markdown
 
+FORMATS = ("docx", "pdf", "md")
+
+MIME_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+    "md": "text/markdown",
+    "zip": "application/zip",
+}
+
+logger = logging.getLogger(__name__)
+
+# Part of every export's cache key: bump it when pdf.py or a DOCX writer changes what it renders, so
+# files rendered by the old code (kept on disk under EXPORT_CACHE_PATH) are no longer served
+RENDER_VERSION = 3
+
+REGISTRY.describe("planit_export_memo_total", "counter",
+                  "Export requests served from the memo (hit), from disk (disk) or rendered.")
+
+
+# python-docx and reportlab (via core.pdf) are imported on first export, not at app start-up
+@timed("to_docx")
+def write_docx(plan: Dict[str, Any], stream: BinaryIO) -> None:
+    from docx import Document
+    from docx.shared import Pt
 
-def to_docx(plan: Dict[str, Any], path: str) -> str:
     doc = Document()
     styles = doc.styles
     styles["Normal"].font.name = "Calibri"
@@ -26,43 +58,290 @@ def to_docx(plan: Dict[str, Any], path: str) -> str:
             else:
                 doc.add_paragraph(str(content))
 
-    doc.save(path)
+    doc.save(stream)
+
+
+@timed("to_pdf")
+def write_pdf(plan: Dict[str, Any], stream: BinaryIO) -> None:
+    from .pdf import write_plan
+
+    write_plan(plan, stream)
+
+
+def docx_bytes(plan: Dict[str, Any]) -> bytes:
+    buf = BytesIO()
+    write_docx(plan, buf)
+    return buf.getvalue()
+
+
+def pdf_bytes(plan: Dict[str, Any]) -> bytes:
+    buf = BytesIO()
+    write_pdf(plan, buf)
+    return buf.getvalue()
+
+
+def render(plan: Dict[str, Any], fmt: str) -> bytes:
+    if "sections" not in plan and "text" in plan:
+        # A micro-lesson (core.batch --legacy rows) is Markdown text, exported as the micro-lesson app does
+        from .legacy import LEGACY_EXPORTS
+
+        if fmt == "md":
+            return plan["text"].encode("utf-8")
+        if fmt in LEGACY_EXPORTS:
+            return LEGACY_EXPORTS[fmt](plan["text"])
+    if fmt == "docx":
+        return docx_bytes(plan)
+    if fmt == "pdf":
+        return pdf_bytes(plan)
+    if fmt == "md":
+        return to_markdown(plan).encode("utf-8")
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+# --- memoized exports ---
+
+def content_digest(value: Any) -> str:
+    """Hash of a plan (or plan text) and RENDER_VERSION: equal content gives an equal digest, in any dict."""
+    raw = f"{RENDER_VERSION}:" + json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Memo:
+    # LRU of rendered files by (digest, format); bytes are immutable, so hits are handed out as-is
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self.counts = {"hits": 0, "disk_hits": 0, "renders": 0}
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self.lock:
+            data = self.items.get(key)
+            if data is not None:
+                self.items.move_to_end(key)
+                self.counts["hits"] += 1
+            return data
+
+    def put(self, key: Tuple[str, str], data: bytes, counter: str = "renders") -> None:
+        with self.lock:
+            self.items[key] = data
+            self.items.move_to_end(key)
+            self.counts[counter] += 1
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+
+class _Files:
+    # One file per (digest, format); reads refresh the mtime, and the least recently used go past max_items
+    def __init__(self, path: str, max_items: int):
+        self.path = path
+        self.max_items = max_items
+        self.writes = 0
+
+    def _file(self, key: Tuple[str, str]) -> str:
+        return os.path.join(self.path, f"{key[0]}.{key[1]}")
+
+    def exists(self, key: Tuple[str, str]) -> bool:
+        return os.path.exists(self._file(key))
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        name = self._file(key)
+        try:
+            with open(name, "rb") as f:
+                data = f.read()
+            os.utime(name)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key: Tuple[str, str], data: bytes) -> None:
+        name = self._file(key)
+        tmp = f"{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            # Readers in other processes see the whole file or none of it
+            os.replace(tmp, name)
+        except OSError as e:
+            logger.warning("export cache: could not write %s: %s", name, e)
+            return
+        self.writes += 1
+        if self.writes % 64 == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        try:
+            entries = [e for e in os.scandir(self.path) if e.is_file() and not e.name.endswith(".tmp")]
+        except OSError:
+            return 0
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        removed = 0
+        for entry in entries[:max(0, len(entries) - self.max_items)]:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+_memo = _Memo(EXPORT_MEMO_ITEMS)
+_files = _Files(EXPORT_CACHE_PATH, EXPORT_DISK_ITEMS) if EXPORT_CACHE_PATH else None
+
+
+def memoized(digest: str, fmt: str, make: Callable[[], bytes]) -> bytes:
+    """`make()` once per (digest, fmt); later calls return the stored bytes."""
+    key = (digest, fmt)
+    data = _memo.get(key)
+    if data is not None:
+        count("planit_export_memo_total", result="hit", format=fmt)
+        return data
+    data = _files.get(key) if _files else None
+    if data is not None:
+        _memo.put(key, data, "disk_hits")
+        count("planit_export_memo_total", result="disk", format=fmt)
+        return data
+    data = make()
+    _memo.put(key, data)
+    if _files:
+        _files.put(key, data)
+    count("planit_export_memo_total", result="render", format=fmt)
+    return data
+
+
+def is_exported(digest: str, fmt: str) -> bool:
+    """True when the file for (digest, fmt) is already rendered, in this process or on disk."""
+    with _memo.lock:
+        if (digest, fmt) in _memo.items:
+            return True
+    return _files is not None and _files.exists((digest, fmt))
+
+
+def prune_exports() -> int:
+    """Remove the least recently used files past EXPORT_DISK_ITEMS; returns how many went."""
+    return _files.prune() if _files else 0
+
+
+def export_bytes(plan: Dict[str, Any], fmt: str) -> bytes:
+    """`render(plan, fmt)`, rendered at most once per plan content and format."""
+    return memoized(content_digest(plan), fmt, lambda: render(plan, fmt))
+
+
+def export_stats() -> Dict[str, float]:
+    with _memo.lock:
+        stats: Dict[str, float] = dict(_memo.counts)
+        stats["items"] = len(_memo.items)
+        stats["bytes"] = sum(len(v) for v in _memo.items.values())
+    total = stats["hits"] + stats["disk_hits"] + stats["renders"]
+    stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / total if total else 0.0
+    return stats
+
+
+def to_docx(plan: Dict[str, Any], path: str) -> str:
+    with open(path, "wb") as f:
+        write_docx(plan, f)
     return path
 
 
 def to_pdf(plan: Dict[str, Any], path: str) -> str:
-    c = canvas.Canvas(path, pagesize=A4)
-    width, height = A4
-    x, y = 40, height - 40
-
-    def write_line(text: str):
-        nonlocal y
-        if y < 60:
-            c.showPage()
-            y = height - 40
-        c.drawString(x, y, text)
-        y -= 16
-
-    title = plan.get("title", "Lesson Plan")
-    c.setFont("Helvetica-Bold", 16)
-    write_line(title)
-    c.setFont("Helvetica", 11)
+    with open(path, "wb") as f:
+        write_pdf(plan, f)
+    return path
 
-    sections = plan.get("sections", {})
-    for section in SECTION_ORDER:
-        content = sections.get(section)
-        if not content:
-            continue
-        c.setFont("Helvetica-Bold", 12)
-        write_line(section)
-        c.setFont("Helvetica", 11)
-        if isinstance(content, list):
-            for item in content:
-                write_line(f"• {str(item)}")
-        else:
-            for line in str(content).splitlines():
-                write_line(line)
-        y -= 4
-
-    c.save()
-    return path
\ No newline at end of file
+
+# --- bulk export ---
+
+def safe_filename(title: str, limit: int = 80) -> str:
+    # Only strip path/shell-unsafe characters so Gujarati/Devanagari titles survive intact
+    name = re.sub(r'[\s\\/:*?"<>|\x00-\x1f]+', "_", title).strip("_.")
+    return (name or "lesson_plan")[:limit]
+
+
+def _add_plan(zf: zipfile.ZipFile, plan: Dict[str, Any], formats: Sequence[str], used: Dict[str, int]) -> None:
+    base = safe_filename(plan.get("title", "Lesson Plan"))
+    n = used[base] = used.get(base, 0) + 1
+    if n > 1:
+        base = f"{base}_{n}"
+    for fmt in formats:
+        # DOCX/PDF are already compressed containers
+        compress = zipfile.ZIP_DEFLATED if fmt == "md" else zipfile.ZIP_STORED
+        zf.writestr(f"{base}.{fmt}", render(plan, fmt), compress_type=compress)
+
+
+def write_zip(plans: Iterable[Dict[str, Any]], stream: BinaryIO, formats: Sequence[str] = FORMATS) -> int:
+    """Write one entry per plan and format; only one plan is rendered in memory at a time."""
+    used: Dict[str, int] = {}
+    count = 0
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for plan in plans:
+            _add_plan(zf, plan, formats, used)
+            count += 1
+    return count
+
+
+class _Chunks:
+    # Write-only sink; zipfile falls back to data descriptors when it cannot seek
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def iter_zip(plans: Iterable[Dict[str, Any]], formats: Sequence[str] = FORMATS) -> Iterator[bytes]:
+    """Yield a ZIP archive in chunks, one per plan, for streaming responses."""
+    sink = _Chunks()
+    used: Dict[str, int] = {}
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for plan in plans:
+            _add_plan(zf, plan, formats, used)
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory is written on close
+    yield sink.drain()
+
+
+# --- CLI ---
+
+def _read_plans(path: str) -> Iterator[Dict[str, Any]]:
+    # Accepts plain plan rows or core.batch result rows ({"plan": {...}, ...})
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            plan = row.get("plan", row) if "sections" not in row else row
+            if plan:
+                yield plan
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bundle lesson plans from a JSONL file into one ZIP.")
+    parser.add_argument("--input", required=True, help="JSONL of plans or core.batch results")
+    parser.add_argument("--out", required=True, help="ZIP path, '-' for stdout")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    args = parser.parse_args(argv)
+
+    formats = [f for f in args.formats.split(",") if f]
+    plans = _read_plans(args.input)
+    if args.out == "-":
+        count = write_zip(plans, sys.stdout.buffer, formats)
+    else:
+        with open(args.out, "wb") as f:
+            count = write_zip(plans, f, formats)
+    print(f"exported {count} plans", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
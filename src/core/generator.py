@@ -1,8 +1,23 @@
 from __future__ import annotations
-from typing import Dict, Any, List
-import google.generativeai as genai
+import asyncio
+import json
+import re
+import time
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 from pydantic import BaseModel, Field
-from .config import GEMINI_API_KEY, DEFAULT_MODEL
+from .config import (DEFAULT_MODEL, CACHE_ENABLED, SECTION_RETRIES, SIMILAR_ENABLED, SIMILARITY_THRESHOLD,
+                     LIBRARY_ENABLED, BUDGET_ENABLED, GENERATE_DEADLINE, QUIZ_ENABLED)
+from .backends import get_backend
+from .hedge import collect, hedger
+from .budget import Budget, is_truncated, length_guide, observe, plan_budget
+from .cache import cache_key, lesson_cache
+from .library import plan_library
+from .metrics import record_span, span, trace
+from .quizbank import QuizDraw, harvest, parse_lines, plan_draw, quiz_bank
+from .similar import SimilarPlan, similar_index
+from .utils import SECTION_ORDER, to_markdown
+from .streaming import JSONSectionParser
+from .repair import canonical_section, salvage, repair_json, normalize_payload, missing_sections, record_retry, parse_stats
 
 class LessonRequest(BaseModel):
     board: str
@@ -35,16 +50,129 @@ Context:
 - Learning Objectives: {objectives}
 - Constraints: {constraints}
 Ensure age-appropriate language and alignment to the board.
+{quiz}
+{length}
 """
 
-def _client():
-    genai.configure(api_key=GEMINI_API_KEY)
-    return genai.GenerativeModel(DEFAULT_MODEL)
+SECTIONS_PROMPT = """
+You are an expert teacher completing an existing lesson plan.
+Return JSON with only these keys: {sections}.
+Keep lists as arrays of bullet points where appropriate. Avoid overlong prose.
+Context:
+- Board: {board}
+- Grade: {grade}
+- Subject: {subject}
+- Topic: {topic}
+- Duration: {duration}
+- Pedagogy: {pedagogy}
+- Bloom: {bloom}
+{length}
+Existing sections (stay consistent, do not repeat them):
+{existing}
+{feedback}"""
+
+# Sections to re-request when a near-duplicate seed plan differs from the new request in a field
+DELTA_SECTIONS = {
+    "topic": ["Unit Overview", "Learning Outcomes", "Prerequisites", "Lesson Flow", "Assessment",
+              "Homework/Extensions", "References"],
+    "duration": ["Materials", "Lesson Flow", "Homework/Extensions"],
+    "pedagogy": ["Lesson Flow", "Differentiation"],
+    "bloom": ["Learning Outcomes", "Lesson Flow", "Assessment"],
+    "learning_objectives": ["Learning Outcomes", "Assessment"],
+    "constraints": ["Materials", "Lesson Flow", "Differentiation"],
+}
+
+def request_key(data: LessonRequest) -> str:
+    return cache_key(data.model_dump(), DEFAULT_MODEL, PROMPT)
+
+
+def generate_lesson(data: LessonRequest, use_cache: bool = CACHE_ENABLED, reuse: bool = False,
+                    timeout: float = GENERATE_DEADLINE) -> LessonPlan:
+    """Generate a plan; with `reuse`, adapt the closest near-duplicate instead when there is one.
+
+    The model call is hedged (core.hedge) and raises TimeoutError after `timeout` seconds.
+    """
+    compute = (lambda: _reuse_or_generate(data, timeout)) if reuse else (lambda: _generate(data, timeout))
+    with trace("generate"):
+        if not use_cache:
+            return compute()
+        # Identical requests share one model call, in-flight or cached
+        payload = lesson_cache().get_or_compute(request_key(data), lambda: compute().model_dump())
+        with span("validate"):
+            return LessonPlan(**payload)
+
+
+def cache_stats() -> Dict[str, int]:
+    return lesson_cache().stats()
+
+
+def similar_stats() -> Dict[str, int]:
+    return similar_index().stats() if SIMILAR_ENABLED else {}
+
+
+def quiz_stats() -> Dict[str, int]:
+    return quiz_bank().stats() if QUIZ_ENABLED else {}
+
+
+def request_budget(data: LessonRequest, sections: List[str] = SECTION_ORDER, questions: int = 0) -> Optional[Budget]:
+    """Word targets and output token cap for this request's duration and grade; None when budgeting is off."""
+    if not BUDGET_ENABLED:
+        return None
+    return plan_budget(data.duration, data.grade, sections, f"{data.topic} {data.subject}", questions)
+
+
+def quiz_draw(data: LessonRequest) -> Optional[QuizDraw]:
+    """Assessment questions for this topic, grade and Bloom level already in the quiz bank."""
+    return plan_draw(data.topic, data.grade, data.subject, data.bloom) if QUIZ_ENABLED else None
+
+
+def _questions(draw: Optional[QuizDraw]) -> int:
+    return draw.shortfall if draw else 0
 
 
-def generate_lesson(data: LessonRequest) -> LessonPlan:
-    model = _client()
-    prompt = PROMPT.format(
+def _quiz(data: LessonRequest, draw: Optional[QuizDraw]) -> str:
+    if draw is None:
+        return ""
+    if not draw.shortfall:
+        return f"In Assessment, do not write multiple-choice questions; {len(draw.items)} come from the question bank."
+    return (f"In Assessment, include {draw.shortfall} multiple-choice questions at the {data.bloom} level,"
+            " each one bullet of the form 'Question? A) ... B) ... C) ... D) ... Answer: B'.")
+
+
+def _assessment(content: Any, draw: Optional[QuizDraw]) -> Any:
+    # Bank questions are appended to whatever the model wrote for Assessment
+    if not draw or not draw.items:
+        return content
+    lines = content if isinstance(content, list) else [content] if content else []
+    return lines + [item.line() for item in draw.items]
+
+
+def _with_bank(plan: LessonPlan, draw: Optional[QuizDraw]) -> LessonPlan:
+    if not draw or not draw.items:
+        return plan
+    sections = dict(plan.sections)
+    sections["Assessment"] = _assessment(sections.get("Assessment"), draw)
+    return LessonPlan(title=plan.title, sections=sections)
+
+
+def _config(budget: Optional[Budget]) -> Optional[Dict[str, Any]]:
+    return budget.config() if budget else None
+
+
+def _length(budget: Optional[Budget]) -> str:
+    return length_guide(budget) if budget else ""
+
+
+def _observe(budget: Optional[Budget], text: str, output_tokens: int = 0, finish_reason: Optional[str] = None) -> bool:
+    """Record budget use; True when the response was cut off at the limit."""
+    truncated = is_truncated(text, finish_reason)
+    # Streams report no usage here; about four characters per token is close enough for tracking
+    observe(budget, output_tokens or len(text) // 4, truncated, DEFAULT_MODEL)
+    return truncated
+
+
+def build_prompt(data: LessonRequest, draw: Optional[QuizDraw] = None) -> str:
+    return PROMPT.format(
         board=data.board,
         grade=data.grade,
         subject=data.subject,
@@ -54,13 +182,380 @@ def generate_lesson(data: LessonRequest) -> LessonPlan:
         bloom=data.bloom,
         objectives=", ".join(data.learning_objectives) or "-",
         constraints=", ".join(data.constraints) or "-",
+        quiz=_quiz(data, draw),
+        length=_length(request_budget(data, questions=_questions(draw))),
     )
-    resp = model.generate_content(prompt)
-    text = resp.text or "{}"
 
+
+def parse_plan(text: str) -> LessonPlan:
     # Model sometimes wraps JSON in code fences
-    import json, re
-    cleaned = re.sub(r"^```(json)?|```$", "", text.strip(), flags=re.MULTILINE)
-    payload = json.loads(cleaned)
+    cleaned = re.sub(r"^```(json)?|```$", "", (text or "{}").strip(), flags=re.MULTILINE)
+    with span("parse"):
+        payload = json.loads(cleaned)
+    with span("validate"):
+        return LessonPlan(**payload)
+
+
+def _compact(sections: Dict[str, Any], limit: int = 240) -> str:
+    lines = []
+    for name, content in sections.items():
+        text = "; ".join(map(str, content)) if isinstance(content, list) else str(content)
+        lines.append(f"- {name}: {text[:limit]}")
+    return "\n".join(lines) or "-"
+
+
+def _fetch_sections(data: LessonRequest, names: List[str], existing: Dict[str, Any],
+                    feedback: str = "") -> Dict[str, Any]:
+    budget = request_budget(data, names)
+    prompt = SECTIONS_PROMPT.format(
+        sections=", ".join(names),
+        board=data.board,
+        grade=data.grade,
+        subject=data.subject,
+        topic=data.topic,
+        duration=data.duration,
+        pedagogy=data.pedagogy,
+        bloom=data.bloom,
+        existing=_compact(existing),
+        feedback=f"Teacher feedback on the previous version: {feedback}\n" if feedback else "",
+        length=_length(budget),
+    )
+    with span("model.sections"):
+        resp = get_backend().generate(prompt, model=DEFAULT_MODEL, config=_config(budget))
+    _observe(budget, resp.text, resp.output_tokens, resp.finish_reason)
+    with span("parse"):
+        payload, _ = repair_json(resp.text)
+        if payload is None:
+            return {}
+        sections = normalize_payload({"sections": payload.get("sections", payload)})["sections"]
+    return {k: v for k, v in sections.items() if k in names}
+
+
+def complete_plan(data: LessonRequest, text: str, retries: int = SECTION_RETRIES,
+                  truncated: bool = False) -> LessonPlan:
+    """Repair raw model output and re-request only the sections it is missing.
+
+    When the output was cut off at the token budget, the last section it
+    reached is incomplete, so it is re-requested along with the missing ones.
+    """
+    with span("parse"):
+        payload, missing = salvage(text)
+    if truncated and payload["sections"]:
+        cut = list(payload["sections"])[-1]
+        del payload["sections"][cut]
+        missing = missing_sections(payload["sections"])
+    for _ in range(retries):
+        if not missing:
+            break
+        record_retry(len(missing))
+        payload["sections"].update(_fetch_sections(data, missing, payload["sections"]))
+        missing = missing_sections(payload["sections"])
+    if not payload["sections"]:
+        raise ValueError("The model returned no usable lesson plan.")
+    with span("validate"):
+        return LessonPlan(**payload)
+
+
+def regenerate_sections(data: LessonRequest, plan: LessonPlan, names: List[str], feedback: str = "") -> LessonPlan:
+    """Rewrite only `names`, passing the rest of the plan as compact context, and merge them back."""
+    keep = {k: v for k, v in plan.sections.items() if k not in names}
+    fresh = _fetch_sections(data, names, keep, feedback)
+    if not fresh:
+        raise ValueError("The model returned none of the requested sections.")
+    sections = dict(plan.sections)
+    sections.update(fresh)
+    updated = LessonPlan(title=plan.title, sections=sections)
+    _remember(data, updated)
+    return updated
+
+
+def _remember(data: LessonRequest, plan: LessonPlan) -> None:
+    # Library writes are queued to a background thread; the similarity index is a small local insert
+    with span("remember"):
+        if LIBRARY_ENABLED:
+            plan_library().save(data.model_dump(), plan.model_dump(), to_markdown(plan.model_dump()))
+        if SIMILAR_ENABLED:
+            similar_index().add(request_key(data), data.model_dump(), plan.model_dump())
+        if QUIZ_ENABLED:
+            # Questions the model wrote join the bank; drawn ones are already there and are skipped
+            content = plan.sections.get("Assessment") or []
+            harvest(parse_lines(content if isinstance(content, list) else [content]),
+                    data.topic, data.grade, data.subject, data.board, data.bloom)
+
+
+def find_similar(data: LessonRequest, threshold: float = SIMILARITY_THRESHOLD, limit: int = 3) -> List[SimilarPlan]:
+    """Previously generated plans for near-duplicate requests (same board, grade and subject), best first."""
+    if not SIMILAR_ENABLED:
+        return []
+    return similar_index().find(data.model_dump(), threshold, limit, exclude=request_key(data))
+
+
+def _describe(value: Any) -> str:
+    if isinstance(value, list):
+        return ", ".join(map(str, value)) or "none"
+    return str(value)
+
+
+def adapt_plan(data: LessonRequest, match: SimilarPlan) -> LessonPlan:
+    """Use a near-duplicate plan as the seed and re-request only the sections its differing fields affect."""
+    seed = LessonPlan(**match.plan)
+    names = [s for s in SECTION_ORDER if any(s in DELTA_SECTIONS[f] for f in match.differs)]
+    sections = dict(seed.sections)
+    if names:
+        changes = "; ".join(
+            f"{f.replace('_', ' ')} was {_describe(match.request.get(f))!r}, now {_describe(getattr(data, f))!r}"
+            for f in match.differs
+        )
+        keep = {k: v for k, v in seed.sections.items() if k not in names}
+        fresh = _fetch_sections(data, names, keep, feedback=f"adapt it to the new request ({changes})")
+        if not fresh:
+            raise ValueError("The model returned none of the sections to adapt.")
+        sections.update(fresh)
+    title = data.topic if "topic" in match.differs else seed.title
+    plan = LessonPlan(title=title, sections=sections)
+    _remember(data, plan)
+    return plan
+
+
+def _reuse_or_generate(data: LessonRequest, timeout: float = GENERATE_DEADLINE) -> LessonPlan:
+    matches = find_similar(data)
+    return adapt_plan(data, matches[0]) if matches else _generate(data, timeout)
+
+
+def _usable(text: str) -> str:
+    # A hedged attempt only wins with output that holds at least one section
+    payload, _ = repair_json(text)
+    if payload is None or not normalize_payload(payload)["sections"]:
+        raise ValueError("The model returned no usable lesson plan.")
+    return text
+
+
+def _generate(data: LessonRequest, timeout: float = GENERATE_DEADLINE) -> LessonPlan:
+    draw = quiz_draw(data)
+    budget = request_budget(data, questions=_questions(draw))
+    prompt = build_prompt(data, draw)
+
+    def attempt(model: str, cancel, remaining: float) -> str:
+        # Streamed so the losing attempt can be stopped mid-response
+        return _usable(collect(get_backend().stream(prompt, model=model, config=_config(budget),
+                                                    timeout=remaining), cancel))
+
+    with span("model"):
+        text = hedger("generate").run(attempt, timeout)
+    truncated = _observe(budget, text)
+    plan = _with_bank(complete_plan(data, text, truncated=truncated), draw)
+    _remember(data, plan)
+    return plan
+
+
+def _stream_name(name: str) -> str:
+    # Sections go out under the names the finished plan will use, so none is sent twice under two spellings
+    return name if name == "title" else canonical_section(name) or name
+
+
+def generate_lesson_stream(data: LessonRequest, use_cache: bool = CACHE_ENABLED,
+                           timeout: float = GENERATE_DEADLINE) -> Iterator[Tuple[str, Any]]:
+    """Yield ("title", str) and then (section, content) pairs as each one completes.
+
+    A stream with no first chunk by the hedge delay gets a duplicate; the first to start is kept.
+    A section that changes once the response is complete (the last one of a response cut off at
+    the token budget is re-requested) is yielded again with its final content.
+    """
+    key = request_key(data)
+    cached = lesson_cache().get(key) if use_cache else None
+    if cached is not None:
+        yield "title", cached["title"]
+        yield from cached["sections"].items()
+        return
+
+    parser = JSONSectionParser()
+    chunks: List[str] = []
+    sent: Dict[str, Any] = {}
+    # Includes the incremental section scan; the caller's time between sections is not counted
+    stream_time = 0.0
+    draw = quiz_draw(data)
+    budget = request_budget(data, questions=_questions(draw))
+    prompt = build_prompt(data, draw)
+    started = time.perf_counter()
+    for text in hedger("generate.stream").stream(
+            lambda model, remaining: get_backend().stream(prompt, model=model, config=_config(budget),
+                                                          timeout=remaining), timeout):
+        chunks.append(text)
+        for name, content in parser.feed(text):
+            name = _stream_name(name)
+            if name in sent:
+                continue
+            sent[name] = _assessment(content, draw) if name == "Assessment" else content
+            stream_time += time.perf_counter() - started
+            yield name, sent[name]
+            started = time.perf_counter()
+    record_span("model.stream", stream_time + time.perf_counter() - started)
+    text = "".join(chunks)
+    truncated = _observe(budget, text)
+
+    plan = _with_bank(complete_plan(data, text, truncated=truncated), draw)
+    # Anything the incremental scan could not isolate, or that repair replaced, comes from the final plan
+    if sent.get("title") != plan.title:
+        yield "title", plan.title
+    for section, content in plan.sections.items():
+        if sent.get(section) != content:
+            yield section, content
+    if use_cache:
+        lesson_cache().set(key, plan.model_dump())
+    _remember(data, plan)
+
+
+# --- async variants for the HTTP API ---
+# The model call is awaited; repair (rarely a follow-up call) and bookkeeping run in a worker thread.
+
+def _finish(data: LessonRequest, text: str, key: str, use_cache: bool, truncated: bool = False,
+            draw: Optional[QuizDraw] = None) -> LessonPlan:
+    plan = _with_bank(complete_plan(data, text, truncated=truncated), draw)
+    if use_cache:
+        lesson_cache().set(key, plan.model_dump())
+    _remember(data, plan)
+    return plan
+
+
+# Async generations in flight by request key: identical concurrent API requests share one model call,
+# as generate_lesson's do through LessonCache.get_or_compute
+_aflights: Dict[str, "asyncio.Future[LessonPlan]"] = {}
+
+
+async def _joined(key: str) -> Optional[LessonPlan]:
+    """The plan from an identical generation already in flight; None when there is none or it was abandoned."""
+    flight = _aflights.get(key)
+    if flight is None:
+        return None
+    lesson_cache().merge_stats({"coalesced": 1})
+    try:
+        return (await asyncio.shield(flight)).model_copy(deep=True)
+    except asyncio.CancelledError:
+        # The leader's client went away: generate for this one instead. Our own cancellation propagates.
+        if flight.cancelled():
+            return None
+        raise
+
+
+def _lead(key: str) -> "asyncio.Future[LessonPlan]":
+    flight = _aflights[key] = asyncio.get_running_loop().create_future()
+    return flight
+
+
+def _land(key: str, flight: "asyncio.Future[LessonPlan]", error: Optional[BaseException] = None) -> None:
+    if not flight.done() and error is not None:
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            flight.cancel()
+        else:
+            flight.set_exception(error)
+            # Followers re-raise it; with none, it must not be logged as never retrieved
+            flight.exception()
+    if _aflights.get(key) is flight:
+        del _aflights[key]
+
+
+async def agenerate_lesson(data: LessonRequest, use_cache: bool = CACHE_ENABLED,
+                           timeout: Optional[float] = None) -> LessonPlan:
+    key = request_key(data)
+    if not use_cache:
+        return await _agenerate(data, key, use_cache, timeout)
+    cached = lesson_cache().get(key)
+    if cached is not None:
+        return LessonPlan(**cached)
+    plan = await _joined(key)
+    if plan is not None:
+        return plan
+    flight = _lead(key)
+    try:
+        plan = await _agenerate(data, key, use_cache, timeout)
+    except BaseException as e:
+        _land(key, flight, e)
+        raise
+    flight.set_result(plan)
+    _land(key, flight)
+    return plan
+
+
+async def _agenerate(data: LessonRequest, key: str, use_cache: bool, timeout: Optional[float]) -> LessonPlan:
+    draw = quiz_draw(data)
+    budget = request_budget(data, questions=_questions(draw))
+    prompt = build_prompt(data, draw)
+
+    async def attempt(model: str, remaining: float):
+        resp = await get_backend().agenerate(prompt, model=model, config=_config(budget), timeout=remaining)
+        _usable(resp.text)
+        return resp
+
+    with span("model"):
+        resp = await hedger("generate").arun(attempt, timeout or GENERATE_DEADLINE)
+    truncated = _observe(budget, resp.text, resp.output_tokens, resp.finish_reason)
+    return await asyncio.to_thread(_finish, data, resp.text, key, use_cache, truncated, draw)
+
+
+async def agenerate_lesson_stream(data: LessonRequest, use_cache: bool = CACHE_ENABLED,
+                                  timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Async generate_lesson_stream: ("title", str) and then (section, content) pairs.
+
+    A request identical to one already streaming waits for that plan and gets it in one go.
+    """
+    key = request_key(data)
+    cached = lesson_cache().get(key) if use_cache else None
+    if cached is None and use_cache:
+        joined = await _joined(key)
+        cached = joined.model_dump() if joined is not None else None
+    if cached is not None:
+        yield "title", cached["title"]
+        for item in cached["sections"].items():
+            yield item
+        return
+    if not use_cache:
+        async for item in _astream(data, key, use_cache, timeout):
+            yield item
+        return
+
+    flight = _lead(key)
+    try:
+        async for item in _astream(data, key, use_cache, timeout, flight):
+            yield item
+    except BaseException as e:
+        _land(key, flight, e)
+        raise
+    _land(key, flight)
+
+
+async def _astream(data: LessonRequest, key: str, use_cache: bool, timeout: Optional[float],
+                   flight: "Optional[asyncio.Future[LessonPlan]]" = None) -> AsyncIterator[Tuple[str, Any]]:
+    parser = JSONSectionParser()
+    chunks: List[str] = []
+    sent: Dict[str, Any] = {}
+    stream_time = 0.0
+    draw = quiz_draw(data)
+    budget = request_budget(data, questions=_questions(draw))
+    prompt = build_prompt(data, draw)
+    started = time.perf_counter()
+    async for text in hedger("generate.stream").astream(
+            lambda model, remaining: get_backend().astream(prompt, model=model, config=_config(budget),
+                                                           timeout=remaining), timeout or GENERATE_DEADLINE):
+        chunks.append(text)
+        for name, content in parser.feed(text):
+            name = _stream_name(name)
+            if name in sent:
+                continue
+            sent[name] = _assessment(content, draw) if name == "Assessment" else content
+            stream_time += time.perf_counter() - started
+            yield name, sent[name]
+            started = time.perf_counter()
+    record_span("model.stream", stream_time + time.perf_counter() - started)
+    text = "".join(chunks)
+    truncated = _observe(budget, text)
 
-    return LessonPlan(**payload)
\ No newline at end of file
+    plan = await asyncio.to_thread(_finish, data, text, key, use_cache, truncated, draw)
+    if flight is not None:
+        # Followers get the plan as soon as it is complete, not when this client has read it all
+        flight.set_result(plan)
+    # Anything the incremental scan could not isolate, or that repair replaced, comes from the final plan
+    if sent.get("title") != plan.title:
+        yield "title", plan.title
+    for section, content in plan.sections.items():
+        if sent.get(section) != content:
+            yield section, content
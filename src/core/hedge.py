@@ -0,0 +1,499 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import collections
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from .config import (
+    DEFAULT_MODEL,
+    GENERATE_DEADLINE,
+    HEDGE_ENABLED,
+    HEDGE_MODEL,
+    HEDGE_PERCENTILE,
+    HEDGE_MAX_RATE,
+    HEDGE_INITIAL_DELAY,
+    HEDGE_MIN_DELAY,
+    HEDGE_MAX_DELAY,
+    HEDGE_WINDOW,
+    HEDGE_MIN_SAMPLES,
+)
+from .limiter import IGNORED, classify
+from .metrics import REGISTRY, count, record_span
+
+# Tail-latency policy around a model call: start it, and if it has not answered by the
+# HEDGE_PERCENTILE latency of recent calls, start a duplicate (optionally on a faster
+# fallback model). The first valid answer wins and the other attempt is cancelled. A
+# primary that fails with a transient error gets the duplicate straight away, if the
+# hedge budget allows one. Everything runs under one overall deadline.
+
+T = TypeVar("T")
+
+REGISTRY.describe("planit_hedge_calls_total", "counter", "Hedged model calls by operation and outcome.")
+REGISTRY.describe("planit_hedges_total", "counter", "Duplicate model calls started by the hedging policy.")
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class Hedger:
+    """Hedging policy and statistics for one kind of model call (plan JSON, legacy Markdown, ...).
+
+    `attempt` callables get the model to use and the seconds left before the
+    deadline; sync ones also get a threading.Event that is set when the
+    attempt has lost and should stop. An attempt raises to say its answer is
+    not usable, and the other attempt (if any) is waited for.
+    """
+
+    def __init__(self, name: str, model: str = DEFAULT_MODEL, fallback: str = HEDGE_MODEL,
+                 percentile: float = HEDGE_PERCENTILE, max_rate: float = HEDGE_MAX_RATE,
+                 initial_delay: float = HEDGE_INITIAL_DELAY, min_delay: float = HEDGE_MIN_DELAY,
+                 max_delay: float = HEDGE_MAX_DELAY, window: int = HEDGE_WINDOW,
+                 min_samples: int = HEDGE_MIN_SAMPLES, enabled: bool = HEDGE_ENABLED):
+        self.name = name
+        self.model = model
+        self.fallback = fallback or model
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # Latency of recent successful calls as the caller saw it, and whether each was hedged
+        self.latencies: Deque[float] = collections.deque(maxlen=window)
+        self.recent: Deque[bool] = collections.deque(maxlen=window)
+        self.counts = {"calls": 0, "hedged": 0, "hedge_wins": 0, "failed": 0, "deadline": 0}
+
+    def models(self) -> Tuple[str, str]:
+        return self.model, self.fallback
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging this call, or None when it must not be hedged."""
+        with self.lock:
+            if not self.enabled:
+                return None
+            # Cost bound: no hedge while recent calls were hedged more often than max_rate
+            if self.recent and sum(self.recent) / len(self.recent) >= self.max_rate:
+                return None
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self.latencies)
+        value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def _fallback(self, error: BaseException) -> bool:
+        # A failed primary is retried on the duplicate only within the hedge budget, and only when a
+        # second try can help: not for a missing key, a 4xx or an answer _usable rejected
+        return self.delay() is not None and classify(error) != IGNORED
+
+    def _done(self, hedged: bool, winner: Optional[int], latency: float = 0.0, outcome: str = "ok") -> None:
+        with self.lock:
+            self.counts["calls"] += 1
+            self.counts["hedged"] += int(hedged)
+            self.recent.append(hedged)
+            if winner is not None:
+                self.latencies.append(latency)
+                self.counts["hedge_wins"] += int(winner == 1)
+            elif outcome == "deadline":
+                self.counts["deadline"] += 1
+            else:
+                self.counts["failed"] += 1
+        if winner is not None:
+            outcome = "hedge_won" if winner == 1 else ("primary_won" if hedged else "ok")
+        count("planit_hedge_calls_total", op=self.name, outcome=outcome)
+
+    def _hedge(self, reason: str) -> None:
+        count("planit_hedges_total", op=self.name, reason=reason)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats: Dict[str, Any] = dict(self.counts)
+            ordered = sorted(self.latencies)
+        stats["hedge_rate"] = stats["hedged"] / stats["calls"] if stats["calls"] else 0.0
+        stats["win_rate"] = stats["hedge_wins"] / stats["hedged"] if stats["hedged"] else 0.0
+        stats["delay"] = self.delay()
+        stats["p50"] = ordered[len(ordered) // 2] if ordered else 0.0
+        return stats
+
+    # --- sync: attempts run in threads ---
+
+    def run(self, attempt: Callable[[str, threading.Event, float], T], deadline: float = GENERATE_DEADLINE) -> T:
+        """First successful attempt's result; TimeoutError once `deadline` seconds have passed."""
+        start = time.monotonic()
+        end = start + deadline
+        results: "queue.Queue[Tuple[int, Any, Optional[BaseException]]]" = queue.Queue()
+        cancels: List[threading.Event] = []
+        launched: List[float] = []
+
+        def launch(i: int) -> None:
+            cancel = threading.Event()
+            cancels.append(cancel)
+            launched.append(time.monotonic())
+            model = self.models()[i]
+
+            def body() -> None:
+                try:
+                    results.put((i, attempt(model, cancel, end - time.monotonic()), None))
+                except BaseException as e:
+                    results.put((i, None, e))
+
+            threading.Thread(target=body, name=f"hedge-{self.name}-{i}", daemon=True).start()
+
+        delay = self.delay()
+        launch(0)
+        errors: List[BaseException] = []
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    self._done(len(launched) > 1, None, outcome="deadline")
+                    raise TimeoutError(f"{self.name}: no answer within {deadline:.0f}s")
+                wait = end - now
+                if len(launched) == 1 and delay is not None:
+                    wait = min(wait, max(0.0, start + delay - now))
+                try:
+                    i, value, error = results.get(timeout=wait)
+                except queue.Empty:
+                    if len(launched) == 1 and delay is not None and time.monotonic() >= start + delay:
+                        self._hedge("slow")
+                        launch(1)
+                    continue
+                if error is None:
+                    self._done(len(launched) > 1, i, time.monotonic() - launched[0])
+                    if len(launched) > 1:
+                        record_span("model.hedge", time.monotonic() - launched[1])
+                    return value
+                errors.append(error)
+                if len(launched) == 1 and self._fallback(errors[-1]) and end - time.monotonic() > 0:
+                    # The primary failed before the hedge was due: the duplicate is the fallback
+                    self._hedge("error")
+                    launch(1)
+                    continue
+                if len(errors) == len(launched):
+                    self._done(len(launched) > 1, None)
+                    raise errors[0]
+        finally:
+            for cancel in cancels:
+                cancel.set()
+
+    def stream(self, open_stream: Callable[[str, float], Iterator[str]],
+               deadline: float = GENERATE_DEADLINE) -> Iterator[str]:
+        """Chunks of the first stream to produce one; the hedge is timed on time to first chunk."""
+        start = time.monotonic()
+        end = start + deadline
+        chunks: "queue.Queue[Tuple[int, Optional[str], Optional[BaseException], bool]]" = queue.Queue()
+        cancels: List[threading.Event] = []
+        launched: List[float] = []
+
+        def launch(i: int) -> None:
+            cancel = threading.Event()
+            cancels.append(cancel)
+            launched.append(time.monotonic())
+            model = self.models()[i]
+
+            def pump() -> None:
+                it = None
+                try:
+                    it = open_stream(model, end - time.monotonic())
+                    for chunk in it:
+                        if cancel.is_set():
+                            return
+                        chunks.put((i, chunk, None, False))
+                    chunks.put((i, None, None, True))
+                except BaseException as e:
+                    chunks.put((i, None, e, True))
+                finally:
+                    # Closing the generator ends the loser's HTTP stream
+                    close = getattr(it, "close", None)
+                    if cancel.is_set() and close is not None:
+                        close()
+
+            threading.Thread(target=pump, name=f"hedge-{self.name}-{i}", daemon=True).start()
+
+        delay = self.delay()
+        launch(0)
+        winner: Optional[int] = None
+        errors: List[BaseException] = []
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    if winner is None:
+                        self._done(len(launched) > 1, None, outcome="deadline")
+                    raise TimeoutError(f"{self.name}: no answer within {deadline:.0f}s")
+                wait = end - now
+                if winner is None and len(launched) == 1 and delay is not None:
+                    wait = min(wait, max(0.0, start + delay - now))
+                try:
+                    i, chunk, error, finished = chunks.get(timeout=wait)
+                except queue.Empty:
+                    if winner is None and len(launched) == 1 and delay is not None and \
+                            time.monotonic() >= start + delay:
+                        self._hedge("slow")
+                        launch(1)
+                    continue
+                if winner is not None and i != winner:
+                    continue
+                if error is not None:
+                    if winner is not None:
+                        raise error
+                    errors.append(error)
+                    if len(launched) == 1 and self._fallback(errors[-1]) and end - time.monotonic() > 0:
+                        self._hedge("error")
+                        launch(1)
+                        continue
+                    if len(errors) == len(launched):
+                        self._done(len(launched) > 1, None)
+                        raise errors[0]
+                    continue
+                if winner is None:
+                    # First chunk (or an empty stream's end) decides; the other stream is cancelled
+                    winner = i
+                    self._done(len(launched) > 1, i, time.monotonic() - launched[0])
+                    for j, cancel in enumerate(cancels):
+                        if j != i:
+                            cancel.set()
+                if finished:
+                    return
+                yield chunk
+        finally:
+            for cancel in cancels:
+                cancel.set()
+
+    # --- async: attempts are tasks, the loser is cancelled ---
+
+    async def arun(self, attempt: Callable[[str, float], Awaitable[T]], deadline: float = GENERATE_DEADLINE) -> T:
+        start = time.monotonic()
+        end = start + deadline
+        tasks: Dict["asyncio.Task[T]", int] = {}
+        launched: List[float] = []
+
+        def launch(i: int) -> None:
+            launched.append(time.monotonic())
+            tasks[asyncio.ensure_future(attempt(self.models()[i], end - time.monotonic()))] = i
+
+        delay = self.delay()
+        launch(0)
+        pending = set(tasks)
+        errors: List[BaseException] = []
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    self._done(len(launched) > 1, None, outcome="deadline")
+                    raise TimeoutError(f"{self.name}: no answer within {deadline:.0f}s")
+                wait = end - now
+                if len(launched) == 1 and delay is not None:
+                    wait = min(wait, max(0.0, start + delay - now))
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if len(launched) == 1 and delay is not None and time.monotonic() >= start + delay:
+                        self._hedge("slow")
+                        launch(1)
+                        pending = {t for t in tasks if not t.done()}
+                    continue
+                for task in done:
+                    i = tasks[task]
+                    if task.exception() is None:
+                        self._done(len(launched) > 1, i, time.monotonic() - launched[0])
+                        return task.result()
+                    errors.append(task.exception())
+                if len(launched) == 1 and self._fallback(errors[-1]) and end - time.monotonic() > 0:
+                    self._hedge("error")
+                    launch(1)
+                    pending = {t for t in tasks if not t.done()}
+                    continue
+                if not pending:
+                    self._done(len(launched) > 1, None)
+                    raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def astream(self, open_stream: Callable[[str, float], AsyncIterator[str]],
+                      deadline: float = GENERATE_DEADLINE) -> AsyncIterator[str]:
+        """Async `stream`: chunks of the first stream to produce one."""
+        start = time.monotonic()
+        end = start + deadline
+        chunks: "asyncio.Queue[Tuple[int, Optional[str], Optional[BaseException], bool]]" = asyncio.Queue()
+        tasks: List["asyncio.Task[None]"] = []
+        launched: List[float] = []
+
+        def launch(i: int) -> None:
+            launched.append(time.monotonic())
+            model = self.models()[i]
+
+            async def pump() -> None:
+                try:
+                    async for chunk in open_stream(model, end - time.monotonic()):
+                        await chunks.put((i, chunk, None, False))
+                    await chunks.put((i, None, None, True))
+                except Exception as e:
+                    await chunks.put((i, None, e, True))
+
+            tasks.append(asyncio.ensure_future(pump()))
+
+        delay = self.delay()
+        launch(0)
+        winner: Optional[int] = None
+        errors: List[BaseException] = []
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    if winner is None:
+                        self._done(len(launched) > 1, None, outcome="deadline")
+                    raise TimeoutError(f"{self.name}: no answer within {deadline:.0f}s")
+                wait = end - now
+                if winner is None and len(launched) == 1 and delay is not None:
+                    wait = min(wait, max(0.0, start + delay - now))
+                try:
+                    i, chunk, error, finished = await asyncio.wait_for(chunks.get(), wait)
+                except asyncio.TimeoutError:
+                    if winner is None and len(launched) == 1 and delay is not None and \
+                            time.monotonic() >= start + delay:
+                        self._hedge("slow")
+                        launch(1)
+                    continue
+                if winner is not None and i != winner:
+                    continue
+                if error is not None:
+                    if winner is not None:
+                        raise error
+                    errors.append(error)
+                    if len(launched) == 1 and self._fallback(errors[-1]) and end - time.monotonic() > 0:
+                        self._hedge("error")
+                        launch(1)
+                        continue
+                    if len(errors) == len(launched):
+                        self._done(len(launched) > 1, None)
+                        raise errors[0]
+                    continue
+                if winner is None:
+                    winner = i
+                    self._done(len(launched) > 1, i, time.monotonic() - launched[0])
+                    for j, task in enumerate(tasks):
+                        if j != i:
+                            task.cancel()
+                if finished:
+                    return
+                yield chunk
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def collect(stream: Iterator[str], cancel: threading.Event) -> str:
+    """Join a model stream, stopping (and closing it) as soon as `cancel` is set."""
+    parts = []
+    try:
+        for chunk in stream:
+            if cancel.is_set():
+                raise _Cancelled()
+            parts.append(chunk)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return "".join(parts)
+
+
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def hedger(name: str, model: str = DEFAULT_MODEL) -> Hedger:
+    """Shared policy for one operation; latencies and hedge rates are per operation."""
+    with _hedgers_lock:
+        if name not in _hedgers:
+            _hedgers[name] = Hedger(name, model)
+        return _hedgers[name]
+
+
+def set_hedger(h: Hedger) -> None:
+    with _hedgers_lock:
+        _hedgers[h.name] = h
+
+
+def hedge_stats() -> Dict[str, Dict[str, Any]]:
+    with _hedgers_lock:
+        hedgers = list(_hedgers.values())
+    return {h.name: h.stats() for h in hedgers}
+
+
+# --- simulation ---
+
+def simulate(h: Hedger, requests: int, clients: int, backend: Any, deadline: float) -> Dict[str, Any]:
+    """Plan-sized calls through `h` from `clients` threads; latency percentiles and failures."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def attempt(model: str, cancel: threading.Event, timeout: float) -> str:
+        return collect(backend.stream("Topic: simulated", model=model, timeout=timeout), cancel)
+
+    def call(i: int) -> None:
+        start = time.monotonic()
+        try:
+            h.run(attempt, deadline)
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        with lock:
+            latencies.append(time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(call, range(requests)))
+    latencies.sort()
+
+    def pct(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+
+    return {"ok": len(latencies), "errors": errors, "p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99),
+            "max": latencies[-1] if latencies else 0.0}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .backends import FakeBackend
+
+    parser = argparse.ArgumentParser(description="Compare tail latency with and without hedging on a fake backend.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="share of calls that are slow")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="how many times slower they are")
+    parser.add_argument("--fallback", default="", help="fallback model name (gets --fallback-latency)")
+    parser.add_argument("--fallback-latency", type=float, default=0.2)
+    parser.add_argument("--percentile", type=float, default=HEDGE_PERCENTILE)
+    parser.add_argument("--max-rate", type=float, default=HEDGE_MAX_RATE)
+    parser.add_argument("--deadline", type=float, default=GENERATE_DEADLINE)
+    args = parser.parse_args(argv)
+
+    backend = FakeBackend(latency=args.latency, jitter=args.latency / 5, output_tokens=40,
+                          slow_rate=args.slow_rate, slow_factor=args.slow_factor,
+                          model_latency={args.fallback: args.fallback_latency} if args.fallback else {})
+    runs = {
+        "no hedging": Hedger("off", "fake", enabled=False),
+        "hedged": Hedger("on", "fake", args.fallback, args.percentile, args.max_rate,
+                         initial_delay=args.latency * 2, min_samples=10),
+    }
+    for label, h in runs.items():
+        result = simulate(h, args.requests, args.clients, backend, args.deadline)
+        stats = h.stats()
+        errors = ", ".join(f"{k}: {v}" for k, v in result["errors"].items()) or "none"
+        print(f"{label:10s} ok {result['ok']:>4d}/{args.requests}  p50 {result['p50']:5.2f}s  p95 {result['p95']:5.2f}s"
+              f"  p99 {result['p99']:5.2f}s  max {result['max']:5.2f}s  hedge rate {stats['hedge_rate']:5.1%}"
+              f"  win rate {stats['win_rate']:5.1%}  errors: {errors}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
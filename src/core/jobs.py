@@ -0,0 +1,546 @@
+from __future__ import annotations
+import argparse
+import base64
+import hashlib
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from .budget import budget_stats, merge_budget_stats
+from .cache import lesson_cache
+from .config import JOBS_PATH, JOBS_WORKERS, JOBS_VISIBILITY, JOBS_MAX_ATTEMPTS, JOBS_POLL, JOBS_RETENTION
+from .export import MIME_TYPES, render
+from .generator import LessonPlan, LessonRequest, adapt_plan, generate_lesson_stream, regenerate_sections, request_key
+from .legacy import LEGACY_SECTIONS, generate_lesson_plan_stream, regenerate_lesson_sections
+from .library import record_demand
+from .metrics import trace
+from .repair import merge_parse_stats, parse_stats
+from .similar import SimilarPlan
+from .translate import markdown_sections, stream_markdown, stream_plan
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Interactive UI work jumps ahead of batch/background jobs
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BACKGROUND = 0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    reclaims INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created REAL NOT NULL,
+    available REAL NOT NULL,
+    lease_until REAL,
+    started REAL,
+    finished REAL,
+    trace TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(status, priority DESC, available, id);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(status, finished);
+"""
+
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    key: Optional[str] = None
+    priority: int
+    status: str
+    payload: Dict[str, Any]
+    progress: Optional[Any] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    attempts: int
+    max_attempts: int
+    created: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    # Stage breakdown recorded by the worker (core.metrics trace), for the UIs' debug panels
+    trace: Optional[Dict[str, Any]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+
+def payload_key(kind: str, payload: Dict[str, Any]) -> str:
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return f"{kind}:{hashlib.sha256(blob.encode('utf-8')).hexdigest()}"
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class JobQueue:
+    """Durable SQLite job queue shared by the UIs, the API and worker processes.
+
+    A claimed job is leased for `visibility` seconds and the worker renews the
+    lease while it runs; if the worker dies the lease lapses and the job is
+    handed to another worker (up to max_attempts). Jobs with an idempotency
+    key are enqueued once: enqueuing the same key again returns the existing
+    job, or requeues it if it had failed (or, with `rerun`, had finished).
+    """
+
+    def __init__(self, path: str = JOBS_PATH, visibility: float = JOBS_VISIBILITY):
+        self.path = os.path.abspath(path)
+        self.visibility = visibility
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Autocommit; claims use explicit BEGIN IMMEDIATE so two workers never take the same job
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        if "trace" not in {r[1] for r in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN trace TEXT")
+        self._lock = threading.Lock()
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Job]:
+        if row is None:
+            return None
+        (id_, kind, key, priority, status, payload, progress, result, error, attempts, max_attempts,
+         created, started, finished, trace_) = row
+        return Job(id=id_, kind=kind, key=key, priority=priority, status=status, payload=json.loads(payload),
+                   progress=json.loads(progress) if progress else None,
+                   result=json.loads(result) if result else None, error=error, attempts=attempts,
+                   max_attempts=max_attempts, created=created, started=started, finished=finished,
+                   trace=json.loads(trace_) if trace_ else None)
+
+    _COLUMNS = ("id, kind, key, priority, status, payload, progress, result, error, attempts, max_attempts,"
+                " created, started, finished, trace")
+
+    # --- producers ---
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], key: Optional[str] = None,
+                priority: int = PRIORITY_BACKGROUND, max_attempts: int = JOBS_MAX_ATTEMPTS,
+                rerun: bool = False) -> int:
+        """Job id for `key`; with `rerun` only a queued or running job is reused, a finished one runs again."""
+        now = time.time()
+        blob = json.dumps(payload, ensure_ascii=False)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT id, status, priority FROM jobs WHERE key = ?", (key,)).fetchone() \
+                    if key else None
+                if row is None:
+                    cur = self._db.execute(
+                        "INSERT INTO jobs (kind, key, priority, status, payload, max_attempts, created, available)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (kind, key, priority, QUEUED, blob, max_attempts, now, now))
+                    job_id = cur.lastrowid
+                else:
+                    job_id, status, current = row
+                    if status == FAILED or (rerun and status == DONE):
+                        self._db.execute(
+                            "UPDATE jobs SET status = ?, priority = ?, payload = ?, attempts = 0, error = NULL,"
+                            " progress = NULL, result = NULL, trace = NULL, created = ?, available = ?,"
+                            " started = NULL, finished = NULL WHERE id = ?", (QUEUED, priority, blob, now, now, job_id))
+                    elif status == QUEUED and priority > current:
+                        self._db.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, job_id))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def wait(self, job_id: int, timeout: Optional[float] = None, poll: float = JOBS_POLL) -> Optional[Job]:
+        """Poll until the job is done or failed (or `timeout` passes) and return it."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.done or (end is not None and time.monotonic() >= end):
+                return job
+            time.sleep(poll)
+
+    # --- workers ---
+    def claim(self, worker: str) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose worker stopped renewing the lease are visible again
+                for job_id, attempts, max_attempts in self._db.execute(
+                        "SELECT id, attempts, max_attempts FROM jobs WHERE status = ? AND lease_until < ?",
+                        (RUNNING, now)).fetchall():
+                    if attempts >= max_attempts:
+                        self._db.execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?",
+                                         (FAILED, "worker lost (visibility timeout)", now, job_id))
+                    else:
+                        self._db.execute("UPDATE jobs SET status = ?, available = ?, reclaims = reclaims + 1"
+                                         " WHERE id = ?", (QUEUED, now, job_id))
+                row = self._db.execute(
+                    f"SELECT {self._COLUMNS} FROM jobs WHERE status = ? AND available <= ?"
+                    " ORDER BY priority DESC, available, id LIMIT 1", (QUEUED, now)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_until = ?,"
+                        " started = COALESCE(started, ?) WHERE id = ?",
+                        (RUNNING, worker, now + self.visibility, now, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        job = self._row(row)
+        if job is not None:
+            job.status, job.attempts = RUNNING, job.attempts + 1
+        return job
+
+    def _update(self, job_id: int, worker: str, sql: str, args: tuple) -> bool:
+        # Only the worker holding the lease may touch a running job
+        with self._lock:
+            cur = self._db.execute(f"UPDATE jobs SET {sql} WHERE id = ? AND status = ? AND worker = ?",
+                                   args + (job_id, RUNNING, worker))
+        return cur.rowcount == 1
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        return self._update(job_id, worker, "lease_until = ?", (time.time() + self.visibility,))
+
+    def report(self, job_id: int, worker: str, progress: Any) -> bool:
+        return self._update(job_id, worker, "progress = ?, lease_until = ?",
+                            (json.dumps(progress, ensure_ascii=False), time.time() + self.visibility))
+
+    def complete(self, job_id: int, worker: str, result: Any, trace: Optional[Dict[str, Any]] = None) -> bool:
+        return self._update(job_id, worker, "status = ?, result = ?, trace = ?, finished = ?, lease_until = NULL",
+                            (DONE, json.dumps(result, ensure_ascii=False),
+                             json.dumps(trace, ensure_ascii=False) if trace else None, time.time()))
+
+    def fail(self, job_id: int, worker: str, error: str, attempts: int, max_attempts: int,
+             backoff: float = 2.0) -> bool:
+        now = time.time()
+        if attempts >= max_attempts:
+            return self._update(job_id, worker, "status = ?, error = ?, finished = ?, lease_until = NULL",
+                                (FAILED, error, now))
+        return self._update(job_id, worker, "status = ?, error = ?, available = ?, lease_until = NULL",
+                            (QUEUED, error, now + backoff * 2 ** (attempts - 1)))
+
+    def prune(self, older_than: float = JOBS_RETENTION) -> int:
+        with self._lock:
+            cur = self._db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                                   (DONE, FAILED, time.time() - older_than))
+        return cur.rowcount
+
+    # --- metrics ---
+
+    def stats(self, window: int = 500) -> Dict[str, float]:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            (oldest,) = self._db.execute("SELECT MIN(available) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+            (reclaims,) = self._db.execute("SELECT COALESCE(SUM(reclaims), 0) FROM jobs").fetchone()
+            recent = self._db.execute(
+                "SELECT started - created, finished - started FROM jobs WHERE status = ?"
+                " ORDER BY finished DESC LIMIT ?", (DONE, window)).fetchall()
+        waits = [r[0] for r in recent]
+        runs = [r[1] for r in recent]
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "reclaimed": reclaims,
+            "oldest_queued_age": max(0.0, now - oldest) if oldest else 0.0,
+            "wait_p50": _percentile(waits, 0.5),
+            "wait_p95": _percentile(waits, 0.95),
+            "run_p50": _percentile(runs, 0.5),
+            "run_p95": _percentile(runs, 0.95),
+        }
+
+
+# --- job kinds ---
+
+Progress = Callable[[Any], None]
+
+
+def _generate(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    data = LessonRequest(**payload["request"])
+    title, sections = "Lesson Plan", {}
+    for name, content in generate_lesson_stream(data):
+        if name == "title":
+            title = content
+        else:
+            sections[name] = content
+        progress({"title": title, "sections": sections})
+    return LessonPlan(title=title, sections=sections).model_dump()
+
+
+def _adapt(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    return adapt_plan(LessonRequest(**payload["request"]), SimilarPlan(**payload["match"])).model_dump()
+
+
+def _regenerate(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    plan = regenerate_sections(LessonRequest(**payload["request"]), LessonPlan(**payload["plan"]),
+                               payload["sections"], payload.get("feedback", ""))
+    return plan.model_dump()
+
+
+_LEGACY_KEYS = ("board", "grade", "subject", "topic", "objective")
+
+
+def _legacy_fields(payload: Dict[str, Any]) -> List[str]:
+    return [payload[k] for k in _LEGACY_KEYS]
+
+
+def _legacy_generate(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    sections: List[List[str]] = []
+
+    def on_section(heading: str, body: str) -> None:
+        sections.append([heading, body])
+        progress({"sections": sections})
+
+    text = generate_lesson_plan_stream(*_legacy_fields(payload), on_section)
+    if text.startswith("An error occurred"):
+        raise RuntimeError(text)
+    target = _legacy_target(payload.get("translate"))
+    if target:
+        text = _legacy_translate(text, target, progress)
+    return {"text": text}
+
+
+def _legacy_target(value: Any) -> str:
+    # Older payloads carry translate=True, from when Hindi was the only option
+    return "hi" if value is True else (value or "")
+
+
+def _legacy_translate(text: str, target: str, progress: Progress) -> str:
+    # Translated sections replace the streamed originals in the progress view as they finish
+    pieces = markdown_sections(text)
+    done: Dict[int, List[str]] = {}
+    # The section headings stay in English: parse_lesson_sections, regenerate and the quiz bank look for them
+    for i, translated in stream_markdown(text, target, keep=[h for _, h, _, _ in LEGACY_SECTIONS]):
+        pieces[i] = translated
+        heading, _, body = translated.partition("\n")
+        done[i] = [heading.lstrip("#").strip(), body.strip()]
+        progress({"sections": [done[k] for k in sorted(done)], "translating": target})
+    return "".join(pieces)
+
+
+def _legacy_regenerate(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    text = regenerate_lesson_sections(*_legacy_fields(payload), payload["plan_text"], payload["keys"],
+                                      payload.get("feedback", ""))
+    return {"text": text}
+
+
+def _translate(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    plan = payload["plan"]
+    title, sections = plan.get("title", "Lesson Plan"), {}
+    for name, content in stream_plan(plan, payload["target"]):
+        if name == "title":
+            title = content
+        else:
+            sections[name] = content
+        progress({"title": title, "sections": {k: sections[k] for k in plan["sections"] if k in sections}})
+    return LessonPlan(title=title, sections={k: sections[k] for k in plan["sections"] if k in sections}).model_dump()
+
+
+def _export(payload: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    fmt = payload["format"]
+    data = render(payload["plan"], fmt)
+    return {"format": fmt, "mime": MIME_TYPES[fmt], "data": base64.b64encode(data).decode("ascii")}
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any], Progress], Any]] = {
+    "generate": _generate,
+    "adapt": _adapt,
+    "regenerate": _regenerate,
+    "legacy_generate": _legacy_generate,
+    "legacy_regenerate": _legacy_regenerate,
+    "translate": _translate,
+    "export": _export,
+}
+
+
+# Job kinds that are a user asking for a new plan, and the plan library source they count under
+DEMAND_SOURCES = {"generate": "main", "legacy_generate": "legacy"}
+
+# Rewrites are asked for because the last answer was not good enough: a repeat while one is in
+# flight joins it, a repeat after it finished gets a fresh rewrite rather than the same text back
+RERUN_KINDS = {"regenerate", "legacy_regenerate"}
+
+
+def submit(queue: "JobQueue", kind: str, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE) -> int:
+    """Enqueue with an idempotency key: the LessonRequest's cache key for generate, else a payload hash.
+
+    Kinds in RERUN_KINDS collapse only onto a job still queued or running.
+    """
+    if kind == "generate":
+        key = f"generate:{request_key(LessonRequest(**payload['request']))}"
+    else:
+        key = payload_key(kind, payload)
+    if priority == PRIORITY_INTERACTIVE and kind in DEMAND_SOURCES:
+        # Every click counts, even when an identical job is already running or the plan is cached
+        request = payload["request"] if kind == "generate" else dict(zip(_LEGACY_KEYS, _legacy_fields(payload)))
+        record_demand(request, DEMAND_SOURCES[kind])
+    return queue.enqueue(kind, payload, key=key, priority=priority, rerun=kind in RERUN_KINDS)
+
+
+# --- workers ---
+
+def _counters() -> Dict[str, Dict[str, float]]:
+    # The counters behind the apps' Cache panel; generation happens here, not in the Streamlit process
+    return {"cache": lesson_cache().stats(), "parse": parse_stats(), "budget": budget_stats()}
+
+
+def _counter_deltas(before: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    after = _counters()
+    return {group: {k: v - before[group].get(k, 0) for k, v in counts.items() if v != before[group].get(k, 0)}
+            for group, counts in after.items()}
+
+
+def merge_counters(record: Optional[Dict[str, Any]]) -> None:
+    """Add the cache, parse and budget counts a worker recorded for one job to this process's stats."""
+    counters = (record or {}).get("counters", {})
+    lesson_cache().merge_stats(counters.get("cache", {}))
+    merge_parse_stats(counters.get("parse", {}))
+    merge_budget_stats(counters.get("budget", {}))
+
+
+def run_job(queue: JobQueue, job: Job, worker: str) -> None:
+    stop = threading.Event()
+
+    def renew() -> None:
+        # Keep the lease while the handler runs; a crashed process stops renewing
+        while not stop.wait(queue.visibility / 3):
+            queue.heartbeat(job.id, worker)
+
+    beat = threading.Thread(target=renew, daemon=True)
+    beat.start()
+    try:
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            raise ValueError(f"unknown job kind {job.kind!r}")
+        before = _counters()
+        with trace(job.kind, job=job.id) as spans:
+            result = handler(job.payload, lambda p: queue.report(job.id, worker, p))
+        record = spans.to_dict() if spans else {}
+        record["counters"] = _counter_deltas(before)
+        queue.complete(job.id, worker, result, record)
+    except Exception as e:
+        queue.fail(job.id, worker, f"{type(e).__name__}: {e}", job.attempts, job.max_attempts)
+    finally:
+        stop.set()
+        beat.join()
+
+
+def work(path: str, name: str, parent: Optional[int] = None, poll: float = JOBS_POLL) -> None:
+    """Claim and run jobs until the parent process goes away (or forever without one)."""
+    queue = JobQueue(path)
+    idle = 0
+    while parent is None or os.getppid() == parent:
+        job = queue.claim(name)
+        if job is None:
+            idle += 1
+            if idle % 600 == 0:
+                queue.prune()
+            time.sleep(poll)
+            continue
+        idle = 0
+        run_job(queue, job, name)
+
+
+def run_workers(path: str, processes: int = JOBS_WORKERS, parent: Optional[int] = None) -> None:
+    import multiprocessing
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    procs = [multiprocessing.Process(target=work, args=(path, f"{prefix}:{i}", os.getpid()), daemon=True)
+             for i in range(processes)]
+    for p in procs:
+        p.start()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.is_set() and (parent is None or os.getppid() == parent):
+            for i, p in enumerate(procs):
+                if not p.is_alive():
+                    # A crashed worker's job comes back after its visibility timeout; replace the worker
+                    procs[i] = multiprocessing.Process(target=work, args=(path, f"{prefix}:{i}", os.getpid()),
+                                                       daemon=True)
+                    procs[i].start()
+            stopping.wait(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+
+
+_queue: Optional[JobQueue] = None
+_pool: Optional[subprocess.Popen] = None
+_shared_lock = threading.Lock()
+
+
+def job_queue() -> JobQueue:
+    global _queue
+    with _shared_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+def ensure_workers(processes: int = JOBS_WORKERS) -> None:
+    """Start a worker pool tied to this process unless one is running. JOBS_WORKERS=0 means workers are external."""
+    global _pool
+    if processes <= 0:
+        return
+    with _shared_lock:
+        if _pool is not None and _pool.poll() is None:
+            return
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [SRC, env.get("PYTHONPATH")]))
+        # Same working directory as the app, so relative cache/library paths point at the same files
+        _pool = subprocess.Popen(
+            [sys.executable, "-m", "core.jobs", "worker", "--processes", str(processes),
+             "--db", os.path.abspath(JOBS_PATH), "--parent", str(os.getpid())],
+            env=env,
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run job workers or show queue metrics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="run a pool of worker processes")
+    worker.add_argument("--processes", type=int, default=max(1, JOBS_WORKERS))
+    worker.add_argument("--db", default=JOBS_PATH)
+    worker.add_argument("--parent", type=int, help="exit when this process id goes away")
+    stats = sub.add_parser("stats", help="print queue depth and latency")
+    stats.add_argument("--db", default=JOBS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        run_workers(args.db, args.processes, args.parent)
+        return 0
+    for name, value in JobQueue(args.db).stats().items():
+        print(f"{name:18s} {value:.3f}" if isinstance(value, float) else f"{name:18s} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+from __future__ import annotations
+import re
+from io import BytesIO
+from typing import Callable, Dict, Optional
+
+from .backends import get_backend
+from .budget import Budget, is_truncated, legacy_budget, length_guide, observe
+from .cache import cache_key, lesson_cache
+from .config import BUDGET_ENABLED, CACHE_ENABLED, GENERATE_DEADLINE, LIBRARY_ENABLED, QUIZ_ENABLED, QUIZ_ITEMS
+from .hedge import collect, hedger
+from .library import plan_library
+from .metrics import span, timed, trace
+from .quizbank import QuizDraw, harvest, merge_quiz, parse_quiz, plan_draw
+from .streaming import MarkdownSectionParser
+
+# Helpers behind lesson_planner.py (the 15-minute micro-lesson app), kept
+# free of Streamlit so batch tools and benchmarks can import them. The PDF
+# renderer and python-docx load on first export.
+
+LEGACY_MODEL = 'gemini-1.5-flash-latest'
+
+# (key, heading, regex, fallback text)
+LEGACY_SECTIONS = [
+    ("intro", "### 📝 Introduction", r'### 📝 Introduction.*?\n(.*?)(?=\n###|$)', "Could not parse Introduction."),
+    ("activity", "### 🎯 Main Activity", r'### 🎯 Main Activity.*?\n(.*?)(?=\n###|$)', "Could not parse Main Activity."),
+    ("conclusion", "### ✨ Conclusion", r'### ✨ Conclusion.*?\n(.*?)(?=\n###|$)', "Could not parse Conclusion."),
+    ("quiz", "### 📝 Quiz", r'### 📝 Quiz.*?\n(.*)', "No quiz generated."),
+]
+
+
+# Section names as the length guide shows them to the model
+_GUIDE_NAMES = {"intro": "Introduction", "activity": "Main Activity", "conclusion": "Conclusion", "quiz": "Quiz"}
+
+
+QUIZ_HEADING = "### 📝 Quiz"
+_QUIZ_FORMAT = ("Number the questions, put options a) to d) on their own lines"
+                " and end each question with 'Answer: <letter>'.")
+
+
+def lesson_budget(grade, subject, topic, keys=tuple(_GUIDE_NAMES), questions=QUIZ_ITEMS) -> Optional[Budget]:
+    return legacy_budget(grade, keys, f"{topic} {subject}", questions) if BUDGET_ENABLED else None
+
+
+def quiz_draw(grade, subject, topic) -> Optional[QuizDraw]:
+    """Questions for this topic and grade already in the quiz bank; the model is asked for the rest."""
+    return plan_draw(topic, grade, subject) if QUIZ_ENABLED else None
+
+
+def _questions(draw: Optional[QuizDraw]) -> int:
+    return draw.shortfall if draw else QUIZ_ITEMS
+
+
+def _quiz_prompt(draw: Optional[QuizDraw]) -> str:
+    n = _questions(draw)
+    if not n:
+        return "Do not write a quiz; its questions are added from the school's question bank."
+    return (f"Also, generate a short {n}-question multiple-choice quiz (with answers) related to the lesson"
+            f" at the end under '{QUIZ_HEADING}'. {_QUIZ_FORMAT}")
+
+
+def _with_bank(plan_text: str, draw: Optional[QuizDraw]) -> str:
+    # Bank questions go first in the quiz; a plan written without a quiz gets the section added
+    if not draw or not draw.items:
+        return plan_text
+    head, found, rest = plan_text.partition(QUIZ_HEADING)
+    body = rest.partition("\n")[2] if found else ""
+    return f"{head.rstrip()}\n\n{QUIZ_HEADING}\n{merge_quiz(body, draw.items)}".lstrip()
+
+
+def _length(budget: Optional[Budget]) -> str:
+    return length_guide(budget, _GUIDE_NAMES) if budget else ""
+
+
+def _observe(budget: Optional[Budget], text: str, output_tokens: int = 0, finish_reason=None,
+             cut_off: bool = False) -> None:
+    observe(budget, output_tokens or len(text) // 4, cut_off or is_truncated(text, finish_reason), LEGACY_MODEL)
+
+
+def _cut_off(text: str, draw: Optional[QuizDraw]) -> bool:
+    # Streams carry no finish reason: a plan that stops before its last section hit the output budget
+    last = QUIZ_HEADING if _questions(draw) else LEGACY_SECTIONS[2][1]
+    return last not in text
+
+
+def build_lesson_prompt(board, grade, subject, topic, objective, draw: Optional[QuizDraw] = None):
+    return f"""
+As an expert curriculum designer for the {board} board in India, create a 15-minute micro-lesson plan for {grade}, focusing on the subject {subject}.
+**Topic:** {topic}
+**Objective:** By the end of this lesson, students should be able to {objective}.
+Generate the output in simple Markdown. Use these exact headings for each section: '### 📝 Introduction', '### 🎯 Main Activity', and '### ✨ Conclusion'.
+Under each heading, provide a clear, concise, and actionable plan.
+
+{_quiz_prompt(draw)}
+{_length(lesson_budget(grade, subject, topic, questions=_questions(draw)))}
+"""
+
+
+def save_lesson_plan(board, grade, subject, topic, objective, plan_text):
+    # Queued for the plan library's background writer; returns immediately
+    if LIBRARY_ENABLED and plan_text and not plan_text.startswith("An error occurred"):
+        request = {"board": board, "grade": grade, "subject": subject, "topic": topic, "objective": objective}
+        plan_library().save(request, {"title": topic, "text": plan_text}, plan_text, source="legacy")
+    if QUIZ_ENABLED and plan_text and not plan_text.startswith("An error occurred"):
+        # New questions join the bank; ones drawn from it are already there and are skipped
+        harvest(parse_quiz(parse_lesson_sections(plan_text)["quiz"]), topic, grade, subject, board, source="legacy")
+
+
+def lesson_key(board, grade, subject, topic, objective) -> str:
+    # Shares the plan cache with the main app; the prompt's wording is part of the key
+    fields = {"board": board, "grade": grade, "subject": subject, "topic": topic, "objective": objective}
+    return cache_key(fields, LEGACY_MODEL, build_lesson_prompt("", "", "", "", ""))
+
+
+def _cached(key: str, use_cache: bool) -> Optional[str]:
+    hit = lesson_cache().get(key) if use_cache else None
+    return hit["text"] if hit else None
+
+
+def _usable(text):
+    # A hedged attempt only wins with at least one of the '###' sections in it
+    if not any(heading in text for _, heading, _, _ in LEGACY_SECTIONS):
+        raise ValueError("The model returned no lesson plan sections.")
+    return text
+
+
+def generate_lesson_plan(board, grade, subject, topic, objective, timeout=GENERATE_DEADLINE,
+                         use_cache=CACHE_ENABLED):
+    key = lesson_key(board, grade, subject, topic, objective)
+    cached = _cached(key, use_cache)
+    if cached is not None:
+        return cached
+    draw = quiz_draw(grade, subject, topic)
+    prompt = build_lesson_prompt(board, grade, subject, topic, objective, draw)
+    budget = lesson_budget(grade, subject, topic, questions=_questions(draw))
+
+    def attempt(model, cancel, remaining):
+        return _usable(collect(get_backend().stream(prompt, model=model, config=budget and budget.config(),
+                                                    timeout=remaining), cancel))
+
+    try:
+        with trace("legacy.generate"), span("model"):
+            plan_text = hedger("legacy", LEGACY_MODEL).run(attempt, timeout)
+        _observe(budget, plan_text, cut_off=_cut_off(plan_text, draw))
+        plan_text = _with_bank(plan_text, draw)
+        if use_cache:
+            lesson_cache().set(key, {"text": plan_text})
+        save_lesson_plan(board, grade, subject, topic, objective, plan_text)
+        return plan_text
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+
+def generate_lesson_plan_stream(board, grade, subject, topic, objective,
+                                on_section: Callable[[str, str], None], timeout=GENERATE_DEADLINE,
+                                use_cache=CACHE_ENABLED):
+    # Streams the plan, calling on_section(heading, body) as each '###' section completes
+    key = lesson_key(board, grade, subject, topic, objective)
+    cached = _cached(key, use_cache)
+    if cached is not None:
+        parser = MarkdownSectionParser()
+        for heading, body in parser.feed(cached) + parser.close():
+            on_section(heading, body)
+        return cached
+    draw = quiz_draw(grade, subject, topic)
+    prompt = build_lesson_prompt(board, grade, subject, topic, objective, draw)
+    budget = lesson_budget(grade, subject, topic, questions=_questions(draw))
+    parser = MarkdownSectionParser()
+    chunks = []
+    quiz_seen = []
+
+    def emit(heading, body):
+        if "Quiz" in heading and draw and draw.items:
+            quiz_seen.append(heading)
+            body = merge_quiz(body, draw.items)
+        on_section(heading, body)
+    try:
+        with trace("legacy.generate"), span("model.stream"):
+            for text in hedger("legacy.stream", LEGACY_MODEL).stream(
+                    lambda model, remaining: get_backend().stream(prompt, model=model,
+                                                                  config=budget and budget.config(),
+                                                                  timeout=remaining), timeout):
+                chunks.append(text)
+                for heading, body in parser.feed(text):
+                    emit(heading, body)
+            for heading, body in parser.close():
+                emit(heading, body)
+        plan_text = "".join(chunks)
+        _observe(budget, plan_text, cut_off=_cut_off(plan_text, draw))
+        if draw and draw.items and not quiz_seen:
+            emit(QUIZ_HEADING[4:], "")
+        plan_text = _with_bank(plan_text, draw)
+        if use_cache:
+            lesson_cache().set(key, {"text": plan_text})
+        save_lesson_plan(board, grade, subject, topic, objective, plan_text)
+        return plan_text
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+
+def build_section_prompt(board, grade, subject, topic, objective, plan_text, keys, feedback=""):
+    headings = [h for k, h, _, _ in LEGACY_SECTIONS if k in keys]
+    current = parse_lesson_sections(plan_text)
+    # Untouched sections go in as short context so the rewrite stays consistent
+    context = "\n".join(
+        f"{h[4:]}: {current[k][:240]}" for k, h, _, _ in LEGACY_SECTIONS if k not in keys
+    )
+    note = f"\nTeacher feedback on the previous version: {feedback}" if feedback else ""
+    return f"""
+As an expert curriculum designer for the {board} board in India, rewrite part of a 15-minute micro-lesson plan for {grade}, subject {subject}.
+**Topic:** {topic}
+**Objective:** By the end of this lesson, students should be able to {objective}.
+Rewrite only these sections, in simple Markdown, using these exact headings: {", ".join(repr(h) for h in headings)}.
+If the quiz is included, keep it to {QUIZ_ITEMS} multiple-choice questions with answers. {_QUIZ_FORMAT}
+{_length(lesson_budget(grade, subject, topic, keys))}
+The rest of the plan, for context (do not repeat it):
+{context}{note}
+"""
+
+
+def regenerate_lesson_sections(board, grade, subject, topic, objective, plan_text, keys, feedback=""):
+    """Re-request only `keys` (e.g. ["quiz"]) and splice them back into plan_text.
+
+    Raises ValueError when the response has none of them, as core.generator.regenerate_sections does.
+    """
+    prompt = build_section_prompt(board, grade, subject, topic, objective, plan_text, keys, feedback)
+    budget = lesson_budget(grade, subject, topic, keys)
+    with trace("legacy.regenerate"):
+        with span("model"):
+            response = get_backend().generate(prompt, model=LEGACY_MODEL, config=budget and budget.config(),
+                                              timeout=GENERATE_DEADLINE)
+        _observe(budget, response.text, response.output_tokens, response.finish_reason)
+        fresh = parse_lesson_sections(response.text)
+        if all(fresh[key] == fallback for key, _, _, fallback in LEGACY_SECTIONS if key in keys):
+            raise ValueError("The model returned none of the requested sections.")
+        current = parse_lesson_sections(plan_text)
+        parts = []
+        for key, heading, _, fallback in LEGACY_SECTIONS:
+            body = fresh[key] if key in keys and fresh[key] != fallback else current[key]
+            parts.append(f"{heading}\n{body}")
+        plan_text = "\n\n".join(parts)
+    save_lesson_plan(board, grade, subject, topic, objective, plan_text)
+    return plan_text
+
+
+@timed("legacy.sections")
+def parse_lesson_sections(plan_text: str) -> Dict[str, str]:
+    sections = {}
+    for key, _, pattern, fallback in LEGACY_SECTIONS:
+        match = re.search(pattern, plan_text, re.S)
+        sections[key] = match.group(1).strip() if match else fallback
+    return sections
+
+
+@timed("create_pdf")
+def create_pdf(text_content):
+    from .pdf import render_markdown
+
+    bio = BytesIO()
+    render_markdown(text_content, bio)
+    return bio.getvalue()
+
+
+@timed("create_docx")
+def create_docx(text_content):
+    from docx import Document
+
+    doc = Document()
+    # Unicode as written, so Hindi and Gujarati plans keep their text
+    for line in text_content.splitlines():
+        line = line.strip()
+        heading = re.match(r"(#{1,6})\s+(.*)", line)
+        if heading:
+            doc.add_heading(heading.group(2), level=min(len(heading.group(1)), 4))
+        elif re.match(r"[-*•]\s+", line):
+            doc.add_paragraph(line[1:].strip(), style="List Bullet")
+        elif line:
+            doc.add_paragraph(line)
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+LEGACY_EXPORTS = {"pdf": create_pdf, "docx": create_docx}
+
+
+def export_file(text_content: str, fmt: str) -> bytes:
+    """create_pdf/create_docx, rendered once per plan text: reruns of the app reuse the bytes."""
+    from .export import content_digest, memoized
+
+    make = LEGACY_EXPORTS[fmt]
+    return memoized(content_digest(text_content), f"legacy.{fmt}", lambda: make(text_content))
+
@@ -0,0 +1,350 @@
+from __future__ import annotations
+import argparse
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from .config import LIBRARY_ENABLED, LIBRARY_PATH, LIBRARY_BATCH, LIBRARY_LINGER
+
+logger = logging.getLogger(__name__)
+
+FACETS = ("board", "grade", "subject")
+
+# Indic vowel signs are Unicode marks; keeping M* as token characters stops them splitting words
+_TOKENIZE = "unicode61 remove_diacritics 2 categories 'L* N* Co M*'"
+# bm25 column weights for (title, topic, body)
+_WEIGHTS = (8.0, 4.0, 1.0)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    digest TEXT UNIQUE NOT NULL,
+    created REAL NOT NULL,
+    source TEXT NOT NULL,
+    board TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    title TEXT NOT NULL,
+    request TEXT NOT NULL,
+    plan TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plans_facets ON plans(board, grade, subject, id);
+CREATE INDEX IF NOT EXISTS plans_subject ON plans(subject, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5(title, topic, body, tokenize="{_TOKENIZE}");
+CREATE TABLE IF NOT EXISTS demand (
+    day TEXT NOT NULL,
+    key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    board TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    request TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (day, key)
+);
+"""
+
+
+class LibraryEntry(BaseModel):
+    id: int
+    created: float
+    source: str
+    board: str
+    grade: str
+    subject: str
+    topic: str
+    title: str
+    snippet: str = ""
+
+
+class Page(BaseModel):
+    items: List[LibraryEntry]
+    # Pass back as `after` (history: last id seen) or `offset` (search) for the next page; None at the end
+    next: Optional[int] = None
+
+
+def grade_label(grade: Any) -> str:
+    # 7, "7" and "7th Grade" all facet as "7"; Nursery/LKG/UKG stay as they are
+    m = re.match(r"\s*(\d+)", str(grade))
+    return m.group(1) if m else str(grade).strip()
+
+
+def match_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    words = [w for w in re.split(r"[\s\"'()*:^+-]+", text) if w]
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " AND ".join(terms)
+
+
+def demand_key(request: Dict[str, Any], source: str) -> str:
+    # Requests differing only in case or spacing count as the same request
+    fold = {k: " ".join(v.split()).casefold() if isinstance(v, str) else v for k, v in request.items()}
+    raw = json.dumps(fold, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{source}\n{raw}".encode("utf-8")).hexdigest()
+
+
+def _where(filters: Dict[str, Optional[str]], alias: str = "") -> Tuple[str, List[Any]]:
+    clauses, args = [], []
+    for name in FACETS + ("source",):
+        value = filters.get(name)
+        if value:
+            clauses.append(f"{alias}{name} = ?")
+            args.append(grade_label(value) if name == "grade" else value)
+    return " AND ".join(clauses), args
+
+
+def _entry(row: Sequence[Any], snippet: str = "") -> LibraryEntry:
+    return LibraryEntry(id=row[0], created=row[1], source=row[2], board=row[3], grade=row[4],
+                        subject=row[5], topic=row[6], title=row[7], snippet=snippet)
+
+
+_COLUMNS = "id, created, source, board, grade, subject, topic, title"
+
+
+class PlanLibrary:
+    """Every generated plan with its request metadata, searchable and paginated.
+
+    save() only enqueues; a background thread writes queued plans in one
+    transaction per batch, so the generate path never waits on the disk.
+    demand() counts requests per day the same way, cache hits included,
+    as the request history core.warm ranks.
+    Reads use their own connection (WAL lets them run alongside the writer).
+    History pages by id (keyset), so deep pages cost the same as the first.
+    """
+
+    def __init__(self, path: Optional[str] = LIBRARY_PATH, batch: int = LIBRARY_BATCH,
+                 linger: float = LIBRARY_LINGER):
+        self.batch = batch
+        self.linger = linger
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            target, uri = path, False
+        else:
+            # Shared in-memory database so the reader and writer connections see the same data
+            target, uri = f"file:library-{id(self)}?mode=memory&cache=shared", True
+        self._writer = sqlite3.connect(target, uri=uri, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.executescript(_SCHEMA)
+        self._writer.commit()
+        self._reader = sqlite3.connect(target, uri=uri, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+        self._queue: "queue.Queue[Optional[Tuple[Any, ...]]]" = queue.Queue()
+        self._stats = {"queued": 0, "written": 0, "duplicates": 0, "batches": 0, "errors": 0, "requests": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="plan-library-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- writes ---
+
+    def save(self, request: Dict[str, Any], plan: Dict[str, Any], body: str, source: str = "main") -> None:
+        """Queue a plan for storage; identical (request, plan) pairs are stored once."""
+        title = str(plan.get("title") or request.get("topic") or "Lesson Plan")
+        request_json = json.dumps(request, ensure_ascii=False, sort_keys=True)
+        plan_json = json.dumps(plan, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(f"{source}\n{request_json}\n{plan_json}\n{body}".encode("utf-8")).hexdigest()
+        row = (digest, time.time(), source, str(request.get("board", "")), grade_label(request.get("grade", "")),
+               str(request.get("subject", "")), str(request.get("topic", "")), title, request_json, plan_json, body)
+        with self._stats_lock:
+            self._stats["queued"] += 1
+        self._queue.put(("plans", row))
+
+    def demand(self, request: Dict[str, Any], source: str = "main") -> None:
+        """Queue one request for today's demand counts."""
+        row = (time.strftime("%Y-%m-%d"), demand_key(request, source), source, str(request.get("board", "")),
+               grade_label(request.get("grade", "")), str(request.get("subject", "")), str(request.get("topic", "")),
+               json.dumps(request, ensure_ascii=False, sort_keys=True))
+        self._queue.put(("demand", row))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            rows, done = [item], 1
+            deadline = time.monotonic() + self.linger
+            while len(rows) < self.batch:
+                try:
+                    rows.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    done += 1
+                except queue.Empty:
+                    break
+            stop = None in rows
+            try:
+                self._write([r for r in rows if r is not None])
+            finally:
+                for _ in range(done):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, items: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        if not items:
+            return
+        rows = [row for kind, row in items if kind == "plans"]
+        demand = [row for kind, row in items if kind == "demand"]
+        written = 0
+        try:
+            with self._writer:
+                self._writer.executemany(
+                    "INSERT INTO demand (day, key, source, board, grade, subject, topic, request, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1) ON CONFLICT(day, key) DO UPDATE SET hits = hits + 1", demand)
+                for row in rows:
+                    cur = self._writer.execute(
+                        "INSERT OR IGNORE INTO plans (digest, created, source, board, grade, subject, topic, title,"
+                        " request, plan) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row[:10])
+                    if cur.rowcount:
+                        self._writer.execute("INSERT INTO plans_fts (rowid, title, topic, body) VALUES (?, ?, ?, ?)",
+                                             (cur.lastrowid, row[7], row[6], row[10]))
+                        written += 1
+        except sqlite3.Error as e:
+            logger.error("plan library: dropped %d plans and %d requests: %s", len(rows), len(demand), e)
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            return
+        with self._stats_lock:
+            self._stats["written"] += written
+            self._stats["duplicates"] += len(rows) - written
+            self._stats["requests"] += len(demand)
+            self._stats["batches"] += 1
+
+    def flush(self) -> None:
+        """Block until every queued plan has been written."""
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    # --- reads ---
+
+    def _query(self, sql: str, args: Sequence[Any]) -> List[Tuple[Any, ...]]:
+        with self._read_lock:
+            return self._reader.execute(sql, args).fetchall()
+
+    def history(self, limit: int = 20, after: Optional[int] = None, **filters: Optional[str]) -> Page:
+        """Newest first; pass the previous page's `next` as `after` to continue."""
+        where, args = _where(filters)
+        if after is not None:
+            where = " AND ".join(filter(None, [where, "id < ?"]))
+            args.append(after)
+        rows = self._query(f"SELECT {_COLUMNS} FROM plans {'WHERE ' + where if where else ''}"
+                           " ORDER BY id DESC LIMIT ?", args + [limit + 1])
+        items = [_entry(r) for r in rows[:limit]]
+        return Page(items=items, next=items[-1].id if len(rows) > limit else None)
+
+    def search(self, text: str, limit: int = 20, offset: int = 0, **filters: Optional[str]) -> Page:
+        """bm25-ranked matches over title, topic and section text, optionally within facets."""
+        match = match_query(text)
+        if not match:
+            return self.history(limit, **filters)
+        where, args = _where(filters, "p.")
+        rows = self._query(
+            f"SELECT p.id, p.created, p.source, p.board, p.grade, p.subject, p.topic, p.title,"
+            f" snippet(plans_fts, 2, '**', '**', '…', 12)"
+            # CROSS JOIN pins the join order: FTS matches first, then the facet filter
+            f" FROM plans_fts CROSS JOIN plans p ON p.id = plans_fts.rowid"
+            f" WHERE plans_fts MATCH ? {'AND ' + where if where else ''}"
+            f" ORDER BY bm25(plans_fts, {', '.join(map(str, _WEIGHTS))}) LIMIT ? OFFSET ?",
+            [match] + args + [limit + 1, offset],
+        )
+        # Snippets come from Markdown; flatten them so they render as one plain line
+        items = [_entry(r[:8], " ".join(r[8].replace("#", "").split())) for r in rows[:limit]]
+        return Page(items=items, next=offset + limit if len(rows) > limit else None)
+
+    def facets(self, text: str = "", **filters: Optional[str]) -> Dict[str, List[Tuple[str, int]]]:
+        """Counts per board, grade and subject, each narrowed by the other selected facets (and source)."""
+        match = match_query(text)
+        out: Dict[str, List[Tuple[str, int]]] = {}
+        for name in FACETS:
+            where, args = _where({k: v for k, v in filters.items() if k != name}, "p.")
+            if match:
+                sql = (f"SELECT p.{name}, COUNT(*) FROM plans_fts CROSS JOIN plans p ON p.id = plans_fts.rowid"
+                       f" WHERE plans_fts MATCH ? {'AND ' + where if where else ''}")
+                args = [match] + args
+            else:
+                sql = f"SELECT p.{name}, COUNT(*) FROM plans p {'WHERE ' + where if where else ''}"
+            out[name] = [tuple(r) for r in self._query(sql + f" GROUP BY p.{name} ORDER BY COUNT(*) DESC", args)]
+        return out
+
+    def get(self, plan_id: int) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT request, plan, source FROM plans WHERE id = ?", (plan_id,))
+        if not rows:
+            return None
+        request, plan, source = rows[0]
+        return {"request": json.loads(request), "plan": json.loads(plan), "source": source}
+
+    def demand_since(self, day: str) -> List[Tuple[str, str, str, int]]:
+        """(day, source, request JSON, hits) for every request counted on or after `day` (YYYY-MM-DD)."""
+        return [tuple(r) for r in self._query(
+            "SELECT day, source, request, hits FROM demand WHERE day >= ?", (day,))]
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+
+_library: Optional[PlanLibrary] = None
+_library_lock = threading.Lock()
+
+
+def plan_library() -> PlanLibrary:
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = PlanLibrary()
+        return _library
+
+
+def record_demand(request: Dict[str, Any], source: str = "main") -> None:
+    """Count a user's plan request in the demand history; only queued, so it costs the caller nothing."""
+    if LIBRARY_ENABLED:
+        plan_library().demand(request, source)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Search the saved lesson-plan library.")
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--board")
+    parser.add_argument("--grade")
+    parser.add_argument("--subject")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--facets", action="store_true", help="print facet counts instead of plans")
+    args = parser.parse_args(argv)
+
+    library = plan_library()
+    filters = {"board": args.board, "grade": args.grade, "subject": args.subject}
+    start = time.perf_counter()
+    if args.facets:
+        for name, counts in library.facets(args.query, **filters).items():
+            print(f"{name}: " + ", ".join(f"{v} ({n})" for v, n in counts))
+    else:
+        for e in library.search(args.query, args.limit, **filters).items:
+            print(f"{e.id:>8}  {e.board:6s} {e.grade:>3s}  {e.subject[:20]:20s} {e.title}")
+            if e.snippet:
+                print(f"{'':10}{e.snippet}")
+    print(f"took {(time.perf_counter() - start) * 1e3:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import collections
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from .backends import BackendError, FakeBackend, LLMBackend, LLMResponse
+from .config import (
+    MODEL_CONCURRENCY,
+    MODEL_CONCURRENCY_MIN,
+    MODEL_CONCURRENCY_MAX,
+    MODEL_DEADLINE,
+    MODEL_RETRIES,
+    MODEL_BACKOFF,
+    MODEL_BACKOFF_MAX,
+)
+
+# Outcomes fed back into the limiter after each call
+OK = "ok"
+THROTTLED = "throttled"  # 429/503: the service asked us to slow down
+FAILED = "failed"  # other 5xx, timeouts, dropped connections
+IGNORED = "ignored"  # client errors and cancellations say nothing about capacity
+
+RETRYABLE = {408, 429, 500, 502, 503, 504}
+
+
+def classify(error: BaseException) -> str:
+    if isinstance(error, BackendError):
+        if error.status in (429, 503):
+            return THROTTLED
+        if error.status is None or error.status in RETRYABLE:
+            return FAILED
+        return IGNORED
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return FAILED
+    return IGNORED
+
+
+def backoff_delay(attempt: int, base: float = MODEL_BACKOFF, cap: float = MODEL_BACKOFF_MAX,
+                  retry_after: Optional[float] = None, rng: Optional[random.Random] = None) -> float:
+    """Full-jitter exponential backoff; a server's Retry-After is a floor, plus a little jitter
+    so clients told the same number of seconds do not all come back together."""
+    rng = rng or random
+    delay = rng.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, retry_after + rng.uniform(0, base))
+    return delay
+
+
+class _Waiter:
+    __slots__ = ("wake",)
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+
+
+class AdaptiveLimiter:
+    """AIMD limit on in-flight model calls, shared by threads and event loops.
+
+    Each success grows the limit by about one per window of `limit` calls; a
+    throttle or server error halves it, at most once per observed round trip
+    so one burst of 429s counts as one signal. Smoothed latency climbing past
+    `tolerance` times the best recent latency (the service queueing our
+    requests) trims it gently before the 429s start. Callers
+    over the limit queue in FIFO order and a freed slot is handed straight
+    to the oldest waiter.
+    """
+
+    def __init__(self, initial: int = MODEL_CONCURRENCY, min_limit: int = MODEL_CONCURRENCY_MIN,
+                 max_limit: int = MODEL_CONCURRENCY_MAX, backoff_ratio: float = 0.5,
+                 tolerance: float = 2.0, smoothing: float = 0.1):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.backoff_ratio = backoff_ratio
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.inflight = 0
+        self._baseline: Optional[float] = None  # best recent latency, drifting slowly upwards
+        self._latency: Optional[float] = None  # smoothed latency
+        self._last_decrease = 0.0
+        self._waiters: Deque[_Waiter] = collections.deque()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "ok": 0, "throttled": 0, "failed": 0, "decreases": 0,
+                       "queued": 0, "timeouts": 0, "peak_inflight": 0}
+
+    # --- slots ---
+
+    def _grant(self) -> None:
+        # Caller holds the lock
+        while self._waiters and self.inflight < int(self.limit):
+            self.inflight += 1
+            self._waiters.popleft().wake()
+        self._stats["peak_inflight"] = max(self._stats["peak_inflight"], self.inflight)
+
+    def _enter(self, waiter_factory: Callable[[], _Waiter]) -> Optional[_Waiter]:
+        with self._lock:
+            self._stats["calls"] += 1
+            if self.inflight < int(self.limit) and not self._waiters:
+                self.inflight += 1
+                self._stats["peak_inflight"] = max(self._stats["peak_inflight"], self.inflight)
+                return None
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            self._stats["queued"] += 1
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Drop a waiter that gave up; False if a slot was granted to it in the meantime."""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return False
+            self._stats["timeouts"] += 1
+            return True
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        event = threading.Event()
+        waiter = self._enter(lambda: _Waiter(event.set))
+        if waiter is None or event.wait(timeout):
+            return True
+        return not self._abandon(waiter)
+
+    async def aacquire(self, timeout: Optional[float] = None) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake() -> None:
+            # Releases can come from any thread
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(lambda: _Waiter(wake))
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except (TimeoutError, asyncio.TimeoutError):
+            # Granted just as we gave up: keep the slot
+            return not self._abandon(waiter)
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release(0.0, IGNORED)
+            raise
+
+    # --- feedback ---
+
+    def release(self, latency: float, outcome: str = OK) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.inflight -= 1
+            if outcome == OK:
+                self._stats["ok"] += 1
+                self._observe(latency)
+                if self._baseline and self._latency > self._baseline * self.tolerance:
+                    self._decrease(now, 0.9)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif outcome in (THROTTLED, FAILED):
+                self._stats[outcome] += 1
+                self._decrease(now, self.backoff_ratio)
+            self._grant()
+
+    def _observe(self, latency: float) -> None:
+        if self._latency is None:
+            self._latency = self._baseline = latency
+            return
+        self._latency += (latency - self._latency) * self.smoothing
+        if latency < self._baseline:
+            self._baseline = latency
+        else:
+            self._baseline += (latency - self._baseline) * self.smoothing / 10
+
+    def _decrease(self, now: float, ratio: float) -> None:
+        # Calls already in flight when we backed off report the same congestion; count it once
+        if now - self._last_decrease < (self._latency or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * ratio)
+        self._stats["decreases"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats.update(limit=int(self.limit), inflight=self.inflight, waiting=len(self._waiters),
+                         latency=round(self._latency or 0.0, 3), baseline=round(self._baseline or 0.0, 3))
+        return stats
+
+
+class ResilientBackend:
+    """Wraps a backend with the adaptive limiter and deadline-bounded retries.
+
+    `timeout` on every method is the total budget for the call, including
+    time spent queued for a slot and backing off between attempts; each
+    attempt gets whatever is left. A retry that could not finish before the
+    deadline is not attempted. Streams are retried only until the first
+    chunk has been yielded.
+    """
+
+    def __init__(self, inner: LLMBackend, limiter: Optional[AdaptiveLimiter] = None,
+                 deadline: float = MODEL_DEADLINE, retries: int = MODEL_RETRIES,
+                 backoff: float = MODEL_BACKOFF, max_backoff: float = MODEL_BACKOFF_MAX):
+        self.inner = inner
+        self.name = inner.name
+        self.limiter = limiter or AdaptiveLimiter()
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._retried = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # Backend-specific attributes (FakeBackend.calls, ...) pass through
+        return getattr(self.inner, name)
+
+    def _remaining(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("model call deadline exceeded")
+        return remaining
+
+    def _retry_delay(self, error: BaseException, outcome: str, attempt: int, deadline: float) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up and re-raise."""
+        if outcome == IGNORED or attempt >= self.retries:
+            return None
+        delay = backoff_delay(attempt, self.backoff, self.max_backoff, getattr(error, "retry_after", None))
+        if time.monotonic() + delay >= deadline:
+            return None
+        with self._lock:
+            self._retried += 1
+        return delay
+
+    def generate(self, prompt, *, model=None, config=None, timeout=None) -> LLMResponse:
+        deadline = time.monotonic() + (timeout or self.deadline)
+        attempt = 0
+        while True:
+            if not self.limiter.acquire(self._remaining(deadline)):
+                raise TimeoutError("model call deadline exceeded waiting for a free slot")
+            start = time.monotonic()
+            try:
+                resp = self.inner.generate(prompt, model=model, config=config, timeout=self._remaining(deadline))
+            except BaseException as e:
+                outcome = classify(e) if isinstance(e, Exception) else IGNORED
+                self.limiter.release(time.monotonic() - start, outcome)
+                delay = self._retry_delay(e, outcome, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.limiter.release(time.monotonic() - start, OK)
+            return resp
+
+    def stream(self, prompt, *, model=None, config=None, timeout=None) -> Iterator[str]:
+        deadline = time.monotonic() + (timeout or self.deadline)
+        attempt = 0
+        while True:
+            if not self.limiter.acquire(self._remaining(deadline)):
+                raise TimeoutError("model call deadline exceeded waiting for a free slot")
+            start = time.monotonic()
+            started = False
+            outcome = IGNORED
+            try:
+                for chunk in self.inner.stream(prompt, model=model, config=config,
+                                               timeout=self._remaining(deadline)):
+                    started = True
+                    yield chunk
+                outcome = OK
+            except Exception as e:
+                outcome = classify(e)
+                delay = None if started else self._retry_delay(e, outcome, attempt, deadline)
+                if delay is None:
+                    raise
+            finally:
+                self.limiter.release(time.monotonic() - start, outcome)
+            if outcome == OK:
+                return
+            time.sleep(delay)
+            attempt += 1
+
+    async def agenerate(self, prompt, *, model=None, config=None, timeout=None) -> LLMResponse:
+        deadline = time.monotonic() + (timeout or self.deadline)
+        attempt = 0
+        while True:
+            if not await self.limiter.aacquire(self._remaining(deadline)):
+                raise TimeoutError("model call deadline exceeded waiting for a free slot")
+            start = time.monotonic()
+            try:
+                resp = await self.inner.agenerate(prompt, model=model, config=config,
+                                                  timeout=self._remaining(deadline))
+            except BaseException as e:
+                outcome = classify(e) if isinstance(e, Exception) else IGNORED
+                self.limiter.release(time.monotonic() - start, outcome)
+                delay = self._retry_delay(e, outcome, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.limiter.release(time.monotonic() - start, OK)
+            return resp
+
+    async def astream(self, prompt, *, model=None, config=None, timeout=None) -> AsyncIterator[str]:
+        deadline = time.monotonic() + (timeout or self.deadline)
+        attempt = 0
+        while True:
+            if not await self.limiter.aacquire(self._remaining(deadline)):
+                raise TimeoutError("model call deadline exceeded waiting for a free slot")
+            start = time.monotonic()
+            started = False
+            outcome = IGNORED
+            try:
+                async for chunk in self.inner.astream(prompt, model=model, config=config,
+                                                      timeout=self._remaining(deadline)):
+                    started = True
+                    yield chunk
+                outcome = OK
+            except Exception as e:
+                outcome = classify(e)
+                delay = None if started else self._retry_delay(e, outcome, attempt, deadline)
+                if delay is None:
+                    raise
+            finally:
+                self.limiter.release(time.monotonic() - start, outcome)
+            if outcome == OK:
+                return
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.limiter.stats()
+        with self._lock:
+            stats["retries"] = self._retried
+        return stats
+
+
+def simulate(requests: int, clients: int, backend: LLMBackend, deadline: float) -> Dict[str, Any]:
+    """Fire `requests` generate calls from `clients` threads; success rate, throughput and latency."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def call(i: int) -> None:
+        start = time.monotonic()
+        try:
+            backend.generate(f"Topic: simulated {i}", timeout=deadline)
+        except Exception as e:
+            key = f"{type(e).__name__} {getattr(e, 'status', '') or ''}".strip()
+            with lock:
+                errors[key] = errors.get(key, 0) + 1
+            return
+        with lock:
+            latencies.append(time.monotonic() - start)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(call, range(requests)))
+    elapsed = time.monotonic() - start
+    latencies.sort()
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare adaptive concurrency against unbounded retries on a throttling fake backend.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=64, help="threads calling the model at once")
+    parser.add_argument("--capacity", type=int, default=8, help="concurrent calls the fake serves before 429s")
+    parser.add_argument("--rps", type=float, default=0.0, help="fake requests-per-second quota (0 = none)")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--deadline", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    def fake() -> FakeBackend:
+        return FakeBackend(latency=args.latency, jitter=args.latency / 5, output_tokens=40,
+                           capacity=args.capacity, rps=args.rps, retry_after=args.retry_after)
+
+    runs = {
+        # Same retry policy, but every client may call at once
+        "retries only": ResilientBackend(fake(), AdaptiveLimiter(args.clients, args.clients, args.clients),
+                                         deadline=args.deadline),
+        "adaptive": ResilientBackend(fake(), AdaptiveLimiter(), deadline=args.deadline),
+    }
+    for label, backend in runs.items():
+        result = simulate(args.requests, args.clients, backend, args.deadline)
+        stats = backend.stats()
+        errors = ", ".join(f"{k}: {v}" for k, v in result["errors"].items()) or "none"
+        print(f"{label:13s} ok {result['ok']:>4d}/{args.requests}  {result['throughput']:6.1f} req/s"
+              f"  p50 {result['p50']:5.2f}s  p95 {result['p95']:5.2f}s  429/503 {stats['throttled']:>4d}"
+              f"  retries {stats['retries']:>4d}  limit {stats['limit']:>3d}  errors: {errors}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,450 @@
+from __future__ import annotations
+import argparse
+import bisect
+import collections
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from .config import METRICS_ENABLED, TRACE_PATH, METRICS_RECENT
+
+# Stage timings in seconds: from a 1 ms regex pass to a minute-long model call
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = METRICS_ENABLED
+_trace_path = TRACE_PATH
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc: Any) -> bool:
+        return False
+
+
+_NOOP = _Noop()
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counters and histograms keyed by (metric name, label tuple), rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def total(self, name: str, **labels: str) -> float:
+        """Sum of a counter over every label set that includes `labels`."""
+        want = set(labels.items())
+        with self._lock:
+            return sum(v for (n, have), v in self._counters.items() if n == name and want <= set(have))
+
+    def histograms(self, name: str) -> List[Tuple[Dict[str, str], List[int], float, int]]:
+        """(labels, bucket counts, sum, count) for every label set of one histogram."""
+        with self._lock:
+            return [(dict(labels), list(h.counts), h.sum, h.count)
+                    for (n, labels), h in self._histograms.items() if n == name]
+
+    def render(self) -> str:
+        def fmt(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+            parts = [f'{k}="{_escape(v)}"' for k, v in labels] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda kv: kv[0])
+            hists = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                kind, text = self._help.get(name, ("counter", ""))
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} counter"]
+            lines.append(f"{name}{fmt(labels)} {value:g}")
+        for (name, labels), counts, total, count in hists:
+            if name not in seen:
+                seen.add(name)
+                kind, text = self._help.get(name, ("histogram", ""))
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} histogram"]
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                le = f'le="{bound:g}"'
+                lines.append(f"{name}_bucket{fmt(labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{fmt(labels, le)} {count}")
+            lines.append(f"{name}_sum{fmt(labels)} {total:.6f}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+REGISTRY.describe("planit_stage_seconds", "histogram", "Time spent in each pipeline stage.")
+REGISTRY.describe("planit_request_seconds", "histogram", "End-to-end time per request, by operation.")
+REGISTRY.describe("planit_requests_total", "counter", "Requests by operation and outcome.")
+REGISTRY.describe("planit_tokens_total", "counter", "Model tokens by model and kind (prompt/output).")
+
+
+class Trace:
+    """One request's stage spans and token counts."""
+
+    __slots__ = ("id", "name", "started", "clock", "spans", "tokens", "attrs", "status", "duration")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []  # (stage, offset, seconds)
+        self.tokens = {"prompt": 0, "output": 0}
+        self.attrs = attrs
+        self.status = "ok"
+        self.duration = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "started": self.started, "duration": round(self.duration, 6),
+                "status": self.status, "spans": [[s, round(o, 6), round(d, 6)] for s, o, d in self.spans],
+                "tokens": dict(self.tokens), "attrs": self.attrs}
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("planit_trace", default=None)
+_recent: Deque[Dict[str, Any]] = collections.deque(maxlen=METRICS_RECENT)
+_recent_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def configure(enabled: Optional[bool] = None, trace_path: Optional[str] = None) -> None:
+    global _enabled, _trace_path
+    if enabled is not None:
+        _enabled = enabled
+    if trace_path is not None:
+        _trace_path = trace_path
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> bool:
+        end = time.perf_counter()
+        elapsed = end - self.start
+        REGISTRY.observe("planit_stage_seconds", elapsed, stage=self.name)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans.append((self.name, self.start - trace.clock, elapsed))
+        return False
+
+
+def span(name: str):
+    """Time a stage: `with span("to_pdf"): ...`. A shared no-op when metrics are off."""
+    return _Span(name) if _enabled else _NOOP
+
+
+def record_span(name: str, seconds: float) -> None:
+    """Record a stage timed by hand, e.g. a generator's own time between yields."""
+    if not _enabled:
+        return
+    REGISTRY.observe("planit_stage_seconds", seconds, stage=name)
+    trace = _current.get()
+    if trace is not None:
+        trace.spans.append((name, time.perf_counter() - seconds - trace.clock, seconds))
+
+
+def timed(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name: str, value: float = 1.0, **labels: str) -> None:
+    """Bump a counter in the shared registry (a no-op when metrics are off)."""
+    if _enabled:
+        REGISTRY.inc(name, value, **labels)
+
+
+def record_tokens(model: str, prompt: int, output: int) -> None:
+    if not _enabled:
+        return
+    if prompt:
+        REGISTRY.inc("planit_tokens_total", prompt, model=model, kind="prompt")
+    if output:
+        REGISTRY.inc("planit_tokens_total", output, model=model, kind="output")
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.setdefault("model", model)
+        trace.tokens["prompt"] += prompt
+        trace.tokens["output"] += output
+
+
+@contextmanager
+def trace(name: str, **attrs: Any) -> Iterator[Optional[Trace]]:
+    """Collect the spans of one request. Nested calls join the outer trace as a span."""
+    if not _enabled:
+        yield None
+        return
+    outer = _current.get()
+    if outer is not None:
+        with _Span(name):
+            yield outer
+        return
+    current = Trace(name, attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        current.duration = time.perf_counter() - current.clock
+        _finish(current.to_dict(), write=True)
+
+
+def _finish(record: Dict[str, Any], write: bool) -> None:
+    REGISTRY.observe("planit_request_seconds", record["duration"], operation=record["name"])
+    REGISTRY.inc("planit_requests_total", operation=record["name"], status=record["status"])
+    with _recent_lock:
+        _recent.append(record)
+    if write and _trace_path:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with _log_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(_trace_path)), exist_ok=True)
+            with open(_trace_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def merge(record: Dict[str, Any], write: bool = False) -> None:
+    """Fold a trace recorded in another process (a job worker) into this one's metrics and recent list."""
+    # Without "spans" the worker ran with metrics off and only sent its counters (core.jobs.merge_counters)
+    if not _enabled or not record or "spans" not in record:
+        return
+    for stage, _, seconds in record.get("spans", []):
+        REGISTRY.observe("planit_stage_seconds", seconds, stage=stage)
+    tokens = record.get("tokens", {})
+    model = record.get("attrs", {}).get("model", "")
+    for kind in ("prompt", "output"):
+        if tokens.get(kind):
+            REGISTRY.inc("planit_tokens_total", tokens[kind], model=model, kind=kind)
+    _finish(record, write)
+
+
+def recent(limit: int = METRICS_RECENT) -> List[Dict[str, Any]]:
+    """The last `limit` traces in this process, newest first."""
+    with _recent_lock:
+        return list(_recent)[-limit:][::-1]
+
+
+def breakdown(record: Dict[str, Any]) -> Dict[str, float]:
+    """Milliseconds per stage for one trace; repeated stages are summed."""
+    out: Dict[str, float] = {}
+    for stage, _, seconds in record.get("spans", []):
+        out[stage] = out.get(stage, 0.0) + seconds * 1e3
+    return out
+
+
+def debug_rows(limit: int = 10) -> List[Dict[str, Any]]:
+    """Recent traces flattened for a table: one row per request, one column per stage (ms)."""
+    rows = []
+    for record in recent(limit):
+        row: Dict[str, Any] = {
+            "time": time.strftime("%H:%M:%S", time.localtime(record["started"])),
+            "request": record["name"],
+            "status": record["status"],
+            "total ms": round(record["duration"] * 1e3, 1),
+            "tokens in": record.get("tokens", {}).get("prompt", 0),
+            "tokens out": record.get("tokens", {}).get("output", 0),
+        }
+        row.update({stage: round(ms, 1) for stage, ms in breakdown(record).items()})
+        rows.append(row)
+    return rows
+
+
+def stage_summary() -> List[Dict[str, Any]]:
+    """Count, mean and bucket-estimated p95 per stage since start-up, including spans outside any trace."""
+    stages = [(labels["stage"], counts, total, count)
+              for labels, counts, total, count in REGISTRY.histograms("planit_stage_seconds")]
+    rows = []
+    for stage, counts, total, count in sorted(stages, key=lambda s: -s[2]):
+        target, cumulative, p95 = 0.95 * count, 0, float("inf")
+        for bound, n in zip(BUCKETS, counts):
+            cumulative += n
+            if cumulative >= target:
+                p95 = bound
+                break
+        rows.append({"stage": stage, "count": count, "mean ms": round(total / count * 1e3, 2),
+                     "p95 ms ≤": p95 * 1e3})
+    return rows
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# --- CLI: serve or summarize a trace log written by any number of processes ---
+
+def _follow(path: str, stop: threading.Event) -> None:
+    position = 0
+    while not stop.is_set():
+        try:
+            with open(path, encoding="utf-8") as f:
+                f.seek(position)
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        break
+                    position += len(line.encode("utf-8"))
+                    try:
+                        merge(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        stop.wait(1.0)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(path: str) -> str:
+    stages: Dict[str, List[float]] = {}
+    tokens = {"prompt": 0, "output": 0}
+    count = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            count += 1
+            stages.setdefault(f"[{record['name']}]", []).append(record["duration"] * 1e3)
+            for stage, ms in breakdown(record).items():
+                stages.setdefault(stage, []).append(ms)
+            for kind in tokens:
+                tokens[kind] += record.get("tokens", {}).get(kind, 0)
+    lines = [f"{'stage':28s} {'n':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'max ms':>9s}"]
+    for stage, values in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+        lines.append(f"{stage:28s} {len(values):6d} {_percentile(values, 0.5):9.1f}"
+                     f" {_percentile(values, 0.95):9.1f} {max(values):9.1f}")
+    lines.append(f"\n{count} traces, {tokens['prompt']} prompt tokens, {tokens['output']} output tokens")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-stage latency from the JSON-lines trace log.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="print p50/p95 per stage")
+    report.add_argument("--trace", default=TRACE_PATH)
+    serve = sub.add_parser("serve", help="serve /metrics in Prometheus text format, fed from the trace log")
+    serve.add_argument("--trace", default=TRACE_PATH)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args(argv)
+
+    if not args.trace:
+        print("no trace log: set TRACE_PATH or pass --trace", file=sys.stderr)
+        return 2
+    if args.command == "report":
+        try:
+            print(summarize(args.trace))
+        except FileNotFoundError:
+            print(f"{args.trace}: not found", file=sys.stderr)
+            return 1
+        return 0
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    configure(enabled=True, trace_path="")
+    stop = threading.Event()
+    threading.Thread(target=_follow, args=(args.trace, stop), daemon=True).start()
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"serving http://{args.host}:{args.port}/metrics from {args.trace}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
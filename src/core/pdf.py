@@ -0,0 +1,530 @@
+from __future__ import annotations
+import argparse
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import reportlab
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, shapeStr, uharfbuzz
+from reportlab.pdfgen import canvas
+
+from .config import PDF_FONT_DIRS
+from .metrics import REGISTRY, count
+from .utils import to_markdown
+
+# Unicode PDF rendering on the reportlab canvas. Text is split into script runs,
+# each drawn in an embedded TrueType font (reportlab subsets the glyphs actually
+# used); Gujarati and Devanagari runs are shaped with HarfBuzz when uharfbuzz is
+# installed. core.export and core.legacy import this module on first PDF export.
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 40
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+
+# Candidate files per (script, bold), first found wins; reportlab's bundled Vera keeps Latin always available
+FONT_FILES = {
+    ("latin", False): ("NotoSans-Regular.ttf", "DejaVuSans.ttf", "Vera.ttf"),
+    ("latin", True): ("NotoSans-Bold.ttf", "DejaVuSans-Bold.ttf", "VeraBd.ttf"),
+    ("gujarati", False): ("NotoSansGujarati-Regular.ttf", "NotoSerifGujarati-Regular.ttf", "Lohit-Gujarati.ttf", "shruti.ttf"),
+    ("gujarati", True): ("NotoSansGujarati-Bold.ttf", "NotoSerifGujarati-Bold.ttf", "shrutib.ttf"),
+    ("devanagari", False): ("NotoSansDevanagari-Regular.ttf", "NotoSerifDevanagari-Regular.ttf", "Lohit-Devanagari.ttf",
+                              "mangal.ttf"),
+    ("devanagari", True): ("NotoSansDevanagari-Bold.ttf", "NotoSerifDevanagari-Bold.ttf", "mangalb.ttf"),
+}
+
+SYSTEM_FONT_DIRS = (
+    "/usr/share/fonts", "/usr/local/share/fonts", os.path.expanduser("~/.fonts"),
+    os.path.expanduser("~/.local/share/fonts"), "/Library/Fonts", "/System/Library/Fonts",
+    os.path.join(os.environ.get("WINDIR", "C:\\Windows"), "Fonts"),
+    os.path.join(os.path.dirname(reportlab.__file__), "fonts"),
+)
+
+# Scripts that need shaping (conjuncts, matras, reordering); everything else is drawn glyph by glyph
+COMPLEX_SCRIPTS = {"gujarati", "devanagari"}
+
+# (size, leading, space before, space after) per heading level; body text below
+HEADINGS = {1: (16, 22, 0, 6), 2: (13, 18, 8, 3), 3: (12, 16, 6, 2)}
+BODY_SIZE, BODY_LEADING = 11, 15
+BULLET_INDENT = 14
+CELL_PADDING = 4
+
+REGISTRY.describe("planit_pdf_pages_total", "counter", "PDF pages rendered.")
+
+
+def script_of(ch: str) -> Optional[str]:
+    """Script for letters and marks that pick a font; None for neutral characters (spaces, digits, punctuation)."""
+    o = ord(ch)
+    if 0x0A80 <= o <= 0x0AFF:
+        return "gujarati"
+    # The dandas (U+0964/5) are shared by Gujarati text and stay neutral
+    if 0x0900 <= o <= 0x0963 or 0x0966 <= o <= 0x097F or 0xA8E0 <= o <= 0xA8FF:
+        return "devanagari"
+    if ch.isalpha():
+        return "latin"
+    return None
+
+
+# --- fonts: found and registered once per process ---
+
+class _Fonts:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names: Optional[Dict[Tuple[str, bool], str]] = None
+        self.paths: Dict[str, str] = {}
+        self.cover: Dict[str, Any] = {}
+        self.script: Dict[str, str] = {}
+        self.missing: List[str] = []
+
+
+_fonts = _Fonts()
+
+
+def _index(dirs: Sequence[str]) -> Dict[str, str]:
+    # Lower-cased file name -> path; earlier directories win
+    found: Dict[str, str] = {}
+    for root in dirs:
+        if not root or not os.path.isdir(root):
+            continue
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if name.lower().endswith(".ttf"):
+                    found.setdefault(name.lower(), os.path.join(dirpath, name))
+    return found
+
+
+def _register() -> None:
+    index = _index([d for d in PDF_FONT_DIRS.split(os.pathsep)] + list(SYSTEM_FONT_DIRS))
+    names: Dict[Tuple[str, bool], str] = {}
+    for (script, bold), files in FONT_FILES.items():
+        path = next((index[f.lower()] for f in files if f.lower() in index), None)
+        if path is None:
+            continue
+        name = f"PlanIt-{script}-{'Bold' if bold else 'Regular'}"
+        font = TTFont(name, path)
+        pdfmetrics.registerFont(font)
+        names[(script, bold)] = name
+        _fonts.paths[name] = path
+        _fonts.cover[name] = font.face.charToGlyph
+        _fonts.script[name] = script
+    for script in ("latin", "gujarati", "devanagari"):
+        # Bold falls back to the regular face; a script with no font at all falls back to Latin
+        names.setdefault((script, False), names[("latin", False)])
+        names.setdefault((script, True), names[(script, False)])
+        if names[(script, False)] == names[("latin", False)] and script != "latin":
+            _fonts.missing.append(script)
+    _fonts.names = names
+
+
+def fonts() -> Dict[Tuple[str, bool], str]:
+    """(script, bold) -> registered reportlab font name."""
+    if _fonts.names is None:
+        with _fonts.lock:
+            if _fonts.names is None:
+                _register()
+    return _fonts.names
+
+
+class MissingFontError(RuntimeError):
+    """The text uses a script no installed font covers; its PDF would come out with that text missing."""
+
+
+def check_fonts(text: str) -> None:
+    """Raise MissingFontError if `text` has letters in a script with no font, rather than drop them silently."""
+    fonts()
+    if not _fonts.missing:
+        return
+    used = {script_of(ch) for ch in set(text)}
+    missing = [script for script in _fonts.missing if script in used]
+    if missing:
+        wanted = ", ".join(FONT_FILES[(script, False)][0] for script in missing)
+        raise MissingFontError(f"no {' or '.join(missing)} font installed, so this plan cannot be exported as PDF; "
+                               f"add {wanted} (free from Google Noto, or apt install fonts-noto-core) "
+                               f"to {PDF_FONT_DIRS} or a system font folder")
+
+
+def _font_for(ch: str, script: Optional[str], current: Optional[str], bold: bool) -> Optional[str]:
+    names = fonts()
+    o = ord(ch)
+    if script is None:
+        # Neutral characters stay in the surrounding run when its font has them
+        if current is not None and o in _fonts.cover[current]:
+            return current
+        script = "latin"
+    name = names[(script, bold)]
+    if o in _fonts.cover[name]:
+        return name
+    for other in (names[("latin", bold)], names[("gujarati", bold)], names[("devanagari", bold)]):
+        if o in _fonts.cover[other]:
+            return other
+    # No font has it (emoji in legacy headings, for one): dropped rather than drawn as a box
+    return None
+
+
+# --- measuring: memoized per word, so bulk exports shape and measure each distinct word once ---
+
+@functools.lru_cache(maxsize=65536)
+def _piece(text: str, font: str, size: float) -> Tuple[str, float]:
+    """A single-font run as drawable text (shaped for complex scripts) and its width in points."""
+    if uharfbuzz is not None and _fonts.script.get(font) in COMPLEX_SCRIPTS:
+        shaped = shapeStr(text, font, size, force=True)
+        return shaped, sum(g.x_advance for g in shaped.__shapeData__) * size / 1000
+    return text, pdfmetrics.stringWidth(text, font, size)
+
+
+Piece = Tuple[str, str, float]  # (drawable text, font, width)
+
+
+@functools.lru_cache(maxsize=65536)
+def _word(word: str, bold: bool, size: float) -> Tuple[Tuple[Piece, ...], float]:
+    pieces: List[Piece] = []
+    run, font = "", None
+    for ch in word:
+        f = _font_for(ch, script_of(ch), font, bold)
+        if f is None:
+            continue
+        if f != font and run:
+            pieces.append(_measure(run, font, size))
+            run = ""
+        run += ch
+        font = f
+    if run:
+        pieces.append(_measure(run, font, size))
+    return tuple(pieces), sum(p[2] for p in pieces)
+
+
+def _measure(run: str, font: str, size: float) -> Piece:
+    text, width = _piece(run, font, size)
+    return text, font, width
+
+
+def _split_word(word: str, bold: bool, size: float, width: float) -> List[str]:
+    # Breaks an over-long word between grapheme clusters: never before a combining mark,
+    # or after a virama/ZWJ, so conjuncts stay whole
+    parts, start = [], 0
+    for i in range(1, len(word)):
+        ch, prev = word[i], word[i - 1]
+        if unicodedata.category(ch).startswith("M") or prev in "\u0acd\u094d\u200d" or ch in "\u200c\u200d":
+            continue
+        if _word(word[start:i + 1], bold, size)[1] > width and i > start:
+            parts.append(word[start:i])
+            start = i
+    parts.append(word[start:])
+    return parts
+
+
+# --- inline Markdown ---
+
+_INLINE_LINK = re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)")
+_EMPHASIS = re.compile(r"(?<![\w*])[*_](?=\S)([^*_]+?)(?<=\S)[*_](?![\w*])")
+
+
+def _inline(text: str) -> List[Tuple[str, bool]]:
+    """Spans of (text, bold): **strong** and __strong__ are bold, links keep their URL, other markup is dropped."""
+    text = _INLINE_LINK.sub(r"\1 (\2)", text).replace("`", "")
+    text = _EMPHASIS.sub(r"\1", text)
+    spans, bold = [], False
+    for i, part in enumerate(re.split(r"\*\*|__", text)):
+        if i:
+            bold = not bold
+        if part:
+            spans.append((part, bold))
+    return spans
+
+
+Word = Tuple[Tuple[Piece, ...], float]
+
+
+def _words(spans: Sequence[Tuple[str, bool]], size: float, bold: bool = False) -> List[Tuple[bool, str, bool, Word]]:
+    """(space before, text, bold, measured word); text touching across bold/plain spans stays one word."""
+    out: List[Tuple[bool, str, bool, Word]] = []
+    space = True
+    for text, strong in spans:
+        for m in re.finditer(r"\S+|\s+", text):
+            token = m.group(0)
+            if token.isspace():
+                space = True
+                continue
+            word = _word(token, strong or bold, size)
+            if out and not space:
+                before, prev, prev_bold, (pieces, width) = out[-1]
+                out[-1] = (before, prev + token, prev_bold, (pieces + word[0], width + word[1]))
+            else:
+                out.append((space, token, strong or bold, word))
+            space = False
+    return out
+
+
+def _natural(spans: Sequence[Tuple[str, bool]], size: float, bold: bool = False) -> float:
+    # Width of the text on one unbroken line
+    lines = wrap(spans, size, float("inf"), bold)
+    return lines[0][-1][0] + lines[0][-1][1][2] if lines else 0.0
+
+
+Line = List[Tuple[float, Piece]]  # (x offset, piece)
+
+
+def wrap(spans: Sequence[Tuple[str, bool]], size: float, width: float, bold: bool = False) -> List[Line]:
+    """Greedy line breaking on measured word widths; a word wider than the line is split across lines.
+
+    Words are joined by a space in the font of the text before them, and runs in the same font
+    are merged, so a line is drawn with as few text operators as it has font changes.
+    """
+    lines: List[Line] = []
+    line: Line = []
+    x = 0.0
+    for space, text, strong, word in _words(spans, size, bold):
+        parts = [word]
+        if word[1] > width + 0.01 and len(text) > 1:
+            parts = [_word(part, strong, size) for part in _split_word(text, strong, size, width)]
+        for i, (pieces, w) in enumerate(parts):
+            if not pieces:
+                continue
+            gap = _piece(" ", line[-1][1][1], size) if line and space and not i else ("", 0.0)
+            # A hair of tolerance so text measured to fit a column exactly is not wrapped by rounding
+            if line and (i or x + gap[1] + w > width + 0.01):
+                lines.append(line)
+                line, x, gap = [], 0.0, ("", 0.0)
+            first, rest = pieces[0], pieces[1:]
+            if line and line[-1][1][1] == first[1]:
+                start, (prev, font, prev_w) = line[-1]
+                line[-1] = (start, (prev + gap[0] + first[0], font, prev_w + gap[1] + first[2]))
+            else:
+                line.append((x + gap[1], first))
+            x += gap[1] + first[2]
+            for piece in rest:
+                line.append((x, piece))
+                x += piece[2]
+    if line:
+        lines.append(line)
+    return lines
+
+
+# --- block Markdown ---
+
+_TABLE_RULE = re.compile(r"^\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_BULLET = re.compile(r"^(\s*)([-*+•]|\d{1,3}[.)])\s+(.*)$")
+
+
+def blocks(markdown: str) -> Iterator[Tuple[Any, ...]]:
+    """("heading", level, text), ("bullet", depth, marker, text), ("table", rows), ("text", text) or ("gap",)."""
+    table: List[List[str]] = []
+    for raw in markdown.splitlines():
+        line = raw.rstrip()
+        if line.lstrip().startswith("|"):
+            if not _TABLE_RULE.match(line.strip()):
+                table.append([c.strip() for c in line.strip().strip("|").split("|")])
+            continue
+        if table:
+            yield ("table", table)
+            table = []
+        if not line.strip():
+            yield ("gap",)
+        elif re.match(r"^\s*([-*_])(\s*\1){2,}\s*$", line):
+            yield ("gap",)
+        elif m := re.match(r"^\s*(#{1,6})\s+(.*?)\s*#*$", line):
+            yield ("heading", min(3, len(m.group(1))), m.group(2))
+        elif m := _BULLET.match(line):
+            marker, text = m.group(2), m.group(3)
+            if marker in "-*+•":
+                # List items the model numbered itself ("- 1. ...") keep just the number
+                numbered = re.match(r"(\d{1,3}[.)])\s+(.*)$", text)
+                marker, text = numbered.groups() if numbered else ("•", text)
+            yield ("bullet", len(m.group(1).expandtabs(4)) // 2, marker, text)
+        else:
+            yield ("text", line.strip())
+    if table:
+        yield ("table", table)
+
+
+# --- drawing ---
+
+class _Writer:
+    def __init__(self, stream: BinaryIO, title: str = ""):
+        self.canvas = canvas.Canvas(stream, pagesize=A4, pageCompression=1)
+        if title:
+            self.canvas.setTitle(title)
+        self.pages = 0
+        self.text = None
+        self.font: Tuple[str, float] = ("", 0.0)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def _page(self) -> None:
+        if self.text is not None:
+            self.canvas.drawText(self.text)
+            self.canvas.showPage()
+        self.text = self.canvas.beginText()
+        self.font = ("", 0.0)
+        self.pages += 1
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def room(self, height: float) -> None:
+        if self.text is None or self.y - height < MARGIN:
+            self._page()
+
+    def skip(self, height: float) -> None:
+        # Vertical space, never carried over to the top of a new page
+        self.y = max(MARGIN, self.y - height)
+
+    def draw(self, line: Line, x0: float, y: float, size: float) -> None:
+        t = self.text
+        for dx, (text, font, _) in line:
+            if self.font != (font, size):
+                t.setFont(font, size)
+                self.font = (font, size)
+            t.setTextOrigin(x0 + dx, y)
+            t.textOut(text)
+
+    def lines(self, lines: List[Line], x0: float, size: float, leading: float) -> None:
+        for line in lines:
+            self.room(leading)
+            self.draw(line, x0, self.y - size, size)
+            self.y -= leading
+
+    def close(self) -> int:
+        if self.text is None:
+            self._page()
+        self.canvas.drawText(self.text)
+        self.canvas.save()
+        return self.pages
+
+
+def _table(w: _Writer, rows: List[List[str]]) -> None:
+    ncols = max(len(r) for r in rows)
+    rows = [r + [""] * (ncols - len(r)) for r in rows]
+    cells = [[_inline(c) for c in r] for r in rows]
+    pad = 2 * CELL_PADDING
+    natural = [max(_natural(cells[i][j], BODY_SIZE, i == 0) for i in range(len(rows))) + pad for j in range(ncols)]
+    if sum(natural) <= TEXT_WIDTH:
+        widths = natural
+    else:
+        # Narrow columns keep their natural width; the rest share what is left in proportion
+        fair = TEXT_WIDTH / ncols
+        fixed = [n for n in natural if n <= fair]
+        share = (TEXT_WIDTH - sum(fixed)) / (sum(natural) - sum(fixed))
+        widths = [n if n <= fair else n * share for n in natural]
+    header: Optional[Tuple[List[List[Line]], float]] = None
+    for i, row in enumerate(cells):
+        wrapped = [wrap(cell, BODY_SIZE, widths[j] - pad, bold=i == 0) for j, cell in enumerate(row)]
+        height = max(1, max(len(c) for c in wrapped)) * BODY_LEADING + pad
+        pages = w.pages
+        w.room(height)
+        if header is not None and w.pages != pages:
+            # Repeat the header row at the top of each continuation page
+            _row(w, *header, widths)
+        _row(w, wrapped, height, widths)
+        if i == 0:
+            header = (wrapped, height)
+    w.skip(6)
+
+
+def _row(w: _Writer, wrapped: List[List[Line]], height: float, widths: List[float]) -> None:
+    x = MARGIN
+    c = w.canvas
+    c.setLineWidth(0.5)
+    for j, lines in enumerate(wrapped):
+        c.rect(x, w.y - height, widths[j], height)
+        y = w.y - CELL_PADDING
+        for line in lines:
+            w.draw(line, x + CELL_PADDING, y - BODY_SIZE, BODY_SIZE)
+            y -= BODY_LEADING
+        x += widths[j]
+    w.y -= height
+
+
+def render_markdown(markdown: str, stream: BinaryIO, title: str = "") -> int:
+    """Draw Markdown (headings, bullets, numbered lists, tables, **bold**) as A4 pages; returns the page count.
+
+    Raises MissingFontError before drawing anything if a script in the text has no font.
+    """
+    check_fonts(title + markdown)
+    w = _Writer(stream, title)
+    for block in blocks(markdown):
+        kind = block[0]
+        if kind == "gap":
+            w.skip(BODY_LEADING / 3)
+        elif kind == "heading":
+            size, leading, before, after = HEADINGS[block[1]]
+            lines = wrap(_inline(block[2]), size, TEXT_WIDTH, bold=True)
+            # Keep a heading with the first line below it
+            w.room(len(lines) * leading + before + BODY_LEADING)
+            if w.y < PAGE_HEIGHT - MARGIN:
+                w.skip(before)
+            w.lines(lines, MARGIN, size, leading)
+            w.skip(after)
+        elif kind == "bullet":
+            _, depth, marker, text = block
+            indent = MARGIN + depth * BULLET_INDENT
+            mark = wrap([(marker, False)], BODY_SIZE, TEXT_WIDTH)[0]
+            hang = max(BULLET_INDENT, mark[-1][0] + mark[-1][1][2] + 4)
+            lines = wrap(_inline(text), BODY_SIZE, TEXT_WIDTH - (indent - MARGIN) - hang)
+            w.room(BODY_LEADING)
+            w.draw(mark, indent, w.y - BODY_SIZE, BODY_SIZE)
+            w.lines(lines or [[]], indent + hang, BODY_SIZE, BODY_LEADING)
+        elif kind == "table":
+            _table(w, block[1])
+        else:
+            w.lines(wrap(_inline(block[1]), BODY_SIZE, TEXT_WIDTH), MARGIN, BODY_SIZE, BODY_LEADING)
+    pages = w.close()
+    count("planit_pdf_pages_total", pages)
+    return pages
+
+
+def write_plan(plan: Dict[str, Any], stream: BinaryIO) -> int:
+    return render_markdown(to_markdown(plan), stream, plan.get("title", "Lesson Plan"))
+
+
+def page_count(data: bytes) -> int:
+    return len(re.findall(rb"/Type /Page\b(?!s)", data))
+
+
+# --- CLI ---
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Render lesson plans to PDF and report throughput.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("fonts", help="show which font file each script uses")
+    p = sub.add_parser("render", help="render plans from a JSONL file (plans or core.batch results)")
+    p.add_argument("--input", required=True)
+    p.add_argument("--out", help="write the first plan's PDF here")
+    p.add_argument("--repeat", type=int, default=1, help="render every plan this many times")
+    args = parser.parse_args(argv)
+
+    names = fonts()
+    if args.command == "fonts":
+        for (script, bold), name in sorted(names.items()):
+            print(f"{script:10s} {'bold' if bold else 'regular':8s} {_fonts.paths[name]}")
+        print(f"shaping: {'uharfbuzz' if uharfbuzz is not None else 'off (pip install uharfbuzz)'}")
+        for script in _fonts.missing:
+            print(f"missing: {script}", file=sys.stderr)
+        return 1 if _fonts.missing else 0
+
+    from io import BytesIO
+    from .export import _read_plans
+
+    plans = list(_read_plans(args.input))
+    if not plans:
+        print("no plans in input", file=sys.stderr)
+        return 1
+    if args.out:
+        with open(args.out, "wb") as f:
+            write_plan(plans[0], f)
+    pages, start = 0, time.perf_counter()
+    for _ in range(args.repeat):
+        for plan in plans:
+            pages += write_plan(plan, BytesIO())
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"plans": len(plans) * args.repeat, "pages": pages, "seconds": round(elapsed, 3),
+                      "pages_per_sec": round(pages / elapsed, 1) if elapsed else None}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from .config import QUIZ_BANK_PATH, QUIZ_ITEMS
+from .curriculum import BLOOMS_LEVELS
+from .library import grade_label
+from .metrics import REGISTRY, count
+
+# Multiple-choice questions from generated quizzes, reused in later plans for the
+# same topic and grade so the model only writes the questions the bank lacks.
+
+REGISTRY.describe("planit_quiz_items_total", "counter", "Quiz items by source: bank (reused) or model (asked for).")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    digest TEXT UNIQUE NOT NULL,
+    created REAL NOT NULL,
+    source TEXT NOT NULL,
+    board TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    topic_key TEXT NOT NULL,
+    bloom TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    options TEXT NOT NULL,
+    answer INTEGER NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0,
+    retired INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_lookup ON items(subject, grade, topic_key, bloom, retired, uses);
+"""
+
+LETTERS = "abcdefgh"
+
+# Verbs that mark a question's Bloom level, checked from the top of the taxonomy down
+_BLOOM_VERBS = {
+    "Create": r"design|create|invent|compose|construct|propose|plan a|devise",
+    "Evaluate": r"justify|evaluate|judge|assess|which is the best|most appropriate|critique|defend",
+    "Analyze": r"compare|contrast|differentiate|distinguish|analy[sz]e|classify|not (?:an? )?(?:example|related)"
+               r"|odd one|relationship|cause",
+    "Apply": r"calculate|solve|apply|use|find|compute|how many|how much|predict|what will|demonstrate",
+    "Understand": r"explain|describe|why|summari[sz]e|interpret|best describes|meaning|means|example",
+    "Remember": r"define|what is|name|list|identify|recall|which of|who|when|where",
+}
+
+_QUESTION = re.compile(r"^\s*(?:[-*]\s*)?(?:\*\*)?(?:Q(?:uestion)?\s*)?(\d{1,2})[.):]\s*(?:\*\*)?\s*(.+)$", re.I)
+_OPTION = re.compile(r"^\s*(?:[-*]\s*)?\(?([A-Ha-h])[.)]\s+(.+)$")
+_INLINE_OPTION = re.compile(r"(?:^|\s)\(?([A-Ha-h])[.)]\s+")
+_ANSWER = re.compile(r"(?:correct\s+)?answer\s*[:\-–]\s*\**\s*\(?([A-Ha-h])\b[).]?", re.I)
+_KEY_HEADING = re.compile(r"^[#*\s]*answer(?:s|\s+key)\b[\s:*]*", re.I)
+_ANSWER_KEY = re.compile(r"\b(\d{1,2})\s*[.):\-–]?\s*\(?([A-Ha-h])\)?(?=[\s,;.]|$)")
+
+
+class QuizItem(BaseModel):
+    stem: str
+    options: List[str]
+    # Index into options
+    answer: int
+    topic: str = ""
+    grade: str = ""
+    subject: str = ""
+    board: str = ""
+    bloom: str = BLOOMS_LEVELS[0]
+    id: Optional[int] = None
+
+    def markdown(self, number: int) -> str:
+        options = "\n".join(f"   {LETTERS[i]}) {o}" for i, o in enumerate(self.options))
+        return f"{number}. {self.stem}\n{options}\n   Answer: {LETTERS[self.answer]}"
+
+    def line(self) -> str:
+        """One-line form for JSON plans, e.g. an Assessment bullet: 'Stem? A) … B) … Answer: B'."""
+        options = " ".join(f"{LETTERS[i].upper()}) {o}" for i, o in enumerate(self.options))
+        return f"{self.stem} {options} Answer: {LETTERS[self.answer].upper()}"
+
+
+class QuizDraw(BaseModel):
+    """Bank items for one plan and how many more questions the model should write."""
+    items: List[QuizItem]
+    wanted: int
+
+    @property
+    def shortfall(self) -> int:
+        return max(0, self.wanted - len(self.items))
+
+
+def topic_key(topic: str) -> str:
+    # "Photosynthesis", " photosynthesis. " and "PHOTOSYNTHESIS" share a key
+    return " ".join(re.findall(r"\w+", str(topic).casefold()))
+
+
+def bloom_of(stem: str, default: str = BLOOMS_LEVELS[0]) -> str:
+    """The Bloom level a question's wording points at, or `default` when nothing matches."""
+    text = stem.casefold()
+    for level, verbs in _BLOOM_VERBS.items():
+        if re.search(rf"\b(?:{verbs})", text):
+            return level
+    return default if default in BLOOMS_LEVELS else BLOOMS_LEVELS[0]
+
+
+def _clean(text: str) -> str:
+    return " ".join(text.replace("**", "").replace("__", "").split()).strip(" -*")
+
+
+def _good(stem: str, options: Sequence[str], answer: Optional[int]) -> bool:
+    # Only complete, unambiguous questions go in the bank
+    if answer is None or not 3 <= len(options) <= 6 or not 0 <= answer < len(options):
+        return False
+    if len(stem) < 8 or any(not o for o in options):
+        return False
+    return len({o.casefold() for o in options}) == len(options)
+
+
+def _split_inline(text: str) -> Tuple[str, List[str]]:
+    """'Stem? A) one B) two C) three' -> ('Stem?', ['one', 'two', 'three']); option letters must run a, b, c..."""
+    run: List[re.Match] = []
+    for m in _INLINE_OPTION.finditer(text):
+        if len(run) < len(LETTERS) and m.group(1).lower() == LETTERS[len(run)]:
+            run.append(m)
+    if len(run) < 2:
+        return text, []
+    ends = [m.start() for m in run[1:]] + [len(text)]
+    return text[:run[0].start()], [_clean(text[m.end():end]) for m, end in zip(run, ends)]
+
+
+def parse_quiz(text: str) -> List[QuizItem]:
+    """Multiple-choice questions in a generated quiz, as bank-ready items without metadata.
+
+    Reads the usual Markdown layouts: numbered questions with options on their
+    own lines or inline, and answers given after each question ("Answer: b")
+    or in an answer key at the end ("1-b, 2-c"). Questions missing options or
+    an answer are left out.
+    """
+    questions: List[Dict[str, Any]] = []
+    key: Dict[int, int] = {}
+    in_key = False
+    for raw in (text or "").splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        heading = _KEY_HEADING.match(line)
+        if heading:
+            in_key, line = True, line[heading.end():]
+        if in_key:
+            for number, letter in _ANSWER_KEY.findall(line):
+                key[int(number)] = LETTERS.index(letter.lower())
+            continue
+        answer = _ANSWER.search(line)
+        option = _OPTION.match(line)
+        question = _QUESTION.match(line)
+        if answer and questions and not question:
+            questions[-1]["answer"] = LETTERS.index(answer.group(1).lower())
+        elif option and questions and not question:
+            questions[-1]["options"].append(_clean(option.group(2)))
+        elif question:
+            body = question.group(2)
+            inline = _ANSWER.search(body)
+            if inline:
+                body = body[:inline.start()]
+            stem, options = _split_inline(body)
+            questions.append({"number": int(question.group(1)), "stem": _clean(stem), "options": options,
+                              "answer": LETTERS.index(inline.group(1).lower()) if inline else None})
+    items = []
+    for q in questions:
+        answer = q["answer"] if q["answer"] is not None else key.get(q["number"])
+        if _good(q["stem"], q["options"], answer):
+            items.append(QuizItem(stem=q["stem"], options=q["options"], answer=answer))
+    return items
+
+
+def parse_lines(lines: Iterable[Any]) -> List[QuizItem]:
+    """MCQs in one-line bullets (a JSON plan's Assessment list), as written by QuizItem.line()."""
+    items = []
+    for line in lines:
+        if not isinstance(line, str):
+            continue
+        text = re.sub(r"^\s*(?:Q(?:uestion)?\s*)?\d{1,2}[.):]\s*", "", line, flags=re.I)
+        answer = _ANSWER.search(text)
+        if not answer:
+            continue
+        stem, options = _split_inline(text[:answer.start()])
+        index = LETTERS.index(answer.group(1).lower())
+        if _good(_clean(stem), options, index):
+            items.append(QuizItem(stem=_clean(stem), options=options, answer=index))
+    return items
+
+
+def merge_quiz(body: str, items: Sequence[QuizItem]) -> str:
+    """Bank items as questions 1..k, then the model's own questions renumbered after them."""
+    k = len(items)
+    shift = lambda m: f"{m.group(1)}{int(m.group(2)) + k}{m.group(3)}"
+    lines, in_key = [], False
+    for line in (body or "").strip().splitlines():
+        in_key = in_key or bool(_KEY_HEADING.match(line.strip()))
+        if in_key:
+            line = re.sub(r"(\b)(\d{1,2})(\s*[.):\-–]?\s*\(?[A-Ha-h]\)?(?=[\s,;.]|$))", shift, line)
+        elif _QUESTION.match(line):
+            line = re.sub(r"^(\s*(?:[-*]\s*)?(?:\*\*)?(?:Q(?:uestion)?\s*)?)(\d{1,2})([.):])", shift, line, flags=re.I)
+        lines.append(line)
+    return "\n\n".join([item.markdown(i) for i, item in enumerate(items, 1)] + ["\n".join(lines)]).strip()
+
+
+def _digest(item: QuizItem) -> str:
+    # The same question on the same topic and grade is stored once, however its options were ordered
+    text = "\n".join([topic_key(item.topic), item.grade, item.subject.casefold(), item.stem.casefold()]
+                     + sorted(o.casefold() for o in item.options))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+_COLUMNS = "id, board, grade, subject, topic, bloom, stem, options, answer"
+
+
+def _item(row: Sequence[Any]) -> QuizItem:
+    return QuizItem(id=row[0], board=row[1], grade=row[2], subject=row[3], topic=row[4], bloom=row[5],
+                    stem=row[6], options=json.loads(row[7]), answer=row[8])
+
+
+class QuizBank:
+    """Reusable quiz items indexed by subject, grade, topic and Bloom level.
+
+    Lookups are one indexed range scan per request. draw() hands out the
+    least-used items first, so repeat plans on a topic rotate through the
+    bank instead of always showing the same questions.
+    """
+
+    def __init__(self, path: Optional[str] = QUIZ_BANK_PATH):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._stats = {"draws": 0, "drawn": 0, "full": 0, "added": 0, "duplicates": 0}
+
+    def add(self, items: Iterable[QuizItem], source: str = "main") -> int:
+        """Store items (with their topic, grade and subject set); returns how many were new."""
+        rows = []
+        for item in items:
+            item = item.model_copy(update={"grade": grade_label(item.grade)})
+            rows.append((_digest(item), time.time(), source, item.board, item.grade, item.subject, item.topic,
+                         topic_key(item.topic), item.bloom, item.stem, json.dumps(item.options, ensure_ascii=False),
+                         item.answer))
+        if not rows:
+            return 0
+        with self._lock:
+            before = self._db.total_changes
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO items (digest, created, source, board, grade, subject, topic, topic_key,"
+                    " bloom, stem, options, answer) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            added = self._db.total_changes - before
+            self._stats["added"] += added
+            self._stats["duplicates"] += len(rows) - added
+        return added
+
+    def draw(self, topic: str, grade: Any, subject: str, n: int = QUIZ_ITEMS,
+             bloom: Optional[str] = None, exclude: Sequence[int] = ()) -> List[QuizItem]:
+        """Up to `n` items for this topic, grade and subject, least used first.
+
+        With `bloom`, items at that level come first, then the adjacent levels;
+        items two or more levels away are not used.
+        """
+        args: List[Any] = [subject, grade_label(grade), topic_key(topic)]
+        where = "subject = ? AND grade = ? AND topic_key = ? AND retired = 0"
+        order = "uses, id"
+        if bloom in BLOOMS_LEVELS:
+            i = BLOOMS_LEVELS.index(bloom)
+            near = BLOOMS_LEVELS[max(0, i - 1):i + 2]
+            where += f" AND bloom IN ({','.join('?' * len(near))})"
+            args += near
+            order = "bloom != ?, uses, id"
+        if exclude:
+            where += f" AND id NOT IN ({','.join('?' * len(exclude))})"
+            args += list(exclude)
+        with self._lock:
+            rows = self._db.execute(f"SELECT {_COLUMNS} FROM items WHERE {where} ORDER BY {order} LIMIT ?",
+                                    args + ([bloom] if bloom in BLOOMS_LEVELS else []) + [n]).fetchall()
+            if rows:
+                with self._db:
+                    self._db.executemany("UPDATE items SET uses = uses + 1 WHERE id = ?", [(r[0],) for r in rows])
+            self._stats["draws"] += 1
+            self._stats["drawn"] += len(rows)
+            self._stats["full"] += len(rows) >= n
+        return [_item(r) for r in rows]
+
+    def retire(self, ids: Iterable[int]) -> None:
+        """Keep items out of future draws, e.g. after a teacher reports one as wrong."""
+        with self._lock, self._db:
+            self._db.executemany("UPDATE items SET retired = 1 WHERE id = ?", [(i,) for i in ids])
+
+    def counts(self, subject: Optional[str] = None, grade: Any = None) -> List[Tuple[str, str, str, str, int]]:
+        """(subject, grade, topic, bloom, items) for every indexed group, largest first."""
+        where, args = "retired = 0", []
+        if subject:
+            where, args = where + " AND subject = ?", args + [subject]
+        if grade:
+            where, args = where + " AND grade = ?", args + [grade_label(grade)]
+        with self._lock:
+            return [tuple(r) for r in self._db.execute(
+                f"SELECT subject, grade, MIN(topic), bloom, COUNT(*) FROM items WHERE {where}"
+                " GROUP BY subject, grade, topic_key, bloom ORDER BY COUNT(*) DESC", args).fetchall()]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["items"] = self._db.execute("SELECT COUNT(*) FROM items WHERE retired = 0").fetchone()[0]
+        return stats
+
+
+_bank: Optional[QuizBank] = None
+_bank_lock = threading.Lock()
+
+
+def quiz_bank() -> QuizBank:
+    global _bank
+    with _bank_lock:
+        if _bank is None:
+            _bank = QuizBank()
+        return _bank
+
+
+def plan_draw(topic: str, grade: Any, subject: str, bloom: Optional[str] = None, n: int = QUIZ_ITEMS) -> QuizDraw:
+    items = quiz_bank().draw(topic, grade, subject, n, bloom)
+    count("planit_quiz_items_total", len(items), source="bank")
+    count("planit_quiz_items_total", max(0, n - len(items)), source="model")
+    return QuizDraw(items=items, wanted=n)
+
+
+def harvest(items: List[QuizItem], topic: str, grade: Any, subject: str, board: str = "",
+            bloom: Optional[str] = None, source: str = "main") -> int:
+    """Tag parsed items with the request and their Bloom level and add them to the bank."""
+    tagged = [item.model_copy(update={"topic": topic, "grade": grade_label(grade), "subject": subject,
+                                      "board": board, "bloom": bloom_of(item.stem, bloom or BLOOMS_LEVELS[0])})
+              for item in items]
+    return quiz_bank().add(tagged, source)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect the quiz item bank.")
+    parser.add_argument("topic", nargs="?", default="")
+    parser.add_argument("--grade")
+    parser.add_argument("--subject")
+    parser.add_argument("--bloom", choices=BLOOMS_LEVELS)
+    parser.add_argument("--limit", type=int, default=QUIZ_ITEMS)
+    args = parser.parse_args(argv)
+
+    bank = quiz_bank()
+    start = time.perf_counter()
+    if args.topic and args.grade and args.subject:
+        for i, item in enumerate(bank.draw(args.topic, args.grade, args.subject, args.limit, args.bloom), 1):
+            print(f"[{item.bloom}] {item.markdown(i)}")
+    else:
+        for subject, grade, topic, bloom, n in bank.counts(args.subject, args.grade)[:args.limit * 10]:
+            print(f"{n:>6}  {subject[:20]:20s} {grade:>3s}  {bloom:10s} {topic}")
+    print(f"took {(time.perf_counter() - start) * 1e3:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
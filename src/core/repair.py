@@ -0,0 +1,221 @@
+from __future__ import annotations
+import difflib
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .utils import SECTION_ORDER
+
+# Common near-miss section names seen in model output
+SECTION_ALIASES = {
+    "overview": "Unit Overview",
+    "unit summary": "Unit Overview",
+    "learning objectives": "Learning Outcomes",
+    "objectives": "Learning Outcomes",
+    "outcomes": "Learning Outcomes",
+    "prior knowledge": "Prerequisites",
+    "pre-requisites": "Prerequisites",
+    "materials needed": "Materials",
+    "resources": "Materials",
+    "teaching materials": "Materials",
+    "procedure": "Lesson Flow",
+    "lesson procedure": "Lesson Flow",
+    "activities": "Lesson Flow",
+    "lesson plan": "Lesson Flow",
+    "differentiated instruction": "Differentiation",
+    "assessment and evaluation": "Assessment",
+    "evaluation": "Assessment",
+    "homework": "Homework/Extensions",
+    "extensions": "Homework/Extensions",
+    "homework and extensions": "Homework/Extensions",
+    "homework & extensions": "Homework/Extensions",
+    "extension activities": "Homework/Extensions",
+    "resources and references": "References",
+    "bibliography": "References",
+}
+
+_CANONICAL = {s.casefold(): s for s in SECTION_ORDER}
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"parsed": 0, "clean": 0, "repaired": 0, "section_retries": 0,
+                       "sections_refetched": 0, "rescued": 0, "failed": 0}
+
+    def add(self, **deltas: int) -> None:
+        with self.lock:
+            for k, v in deltas.items():
+                self.counts[k] += v
+
+
+_stats = _Stats()
+
+
+def parse_stats() -> Dict[str, float]:
+    with _stats.lock:
+        stats: Dict[str, float] = dict(_stats.counts)
+    total = stats["parsed"] or 1
+    stats["repair_rate"] = stats["repaired"] / total
+    stats["retry_rate"] = stats["section_retries"] / total
+    # Every plan salvaged from defective or partial output is a full generation we did not repeat
+    stats["calls_saved"] = stats["rescued"]
+    return stats
+
+
+def merge_parse_stats(deltas: Dict[str, float]) -> None:
+    """Add counts recorded by another process (a job worker) to this one's."""
+    with _stats.lock:
+        for k, v in deltas.items():
+            if k in _stats.counts:
+                _stats.counts[k] += v
+
+
+def record_retry(sections: int) -> None:
+    _stats.add(section_retries=1, sections_refetched=sections)
+
+
+def extract_object(text: str) -> Tuple[Optional[str], bool]:
+    """Return the first balanced {...} in `text` (closing it if truncated) and whether it was truncated."""
+    start = text.find("{")
+    if start < 0:
+        return None, False
+    stack: List[str] = []
+    quote: Optional[str] = None
+    escape = False
+    prev = ""
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == quote:
+                quote = None
+            continue
+        if not ch.isspace():
+            before, prev = prev, ch
+        if ch in "\"'":
+            # A single quote is only a string delimiter where JSON syntax expects a value or key
+            if ch == '"' or before in "{[,:":
+                quote = ch
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[start:i + 1], False
+    # Truncated: close the open string and containers
+    tail = text[start:]
+    if quote:
+        tail += quote
+    tail = re.sub(r",\s*$", "", tail.rstrip())
+    tail = re.sub(r'[{,]\s*"[^"]*"\s*:?\s*$', lambda m: m.group(0)[0] if m.group(0)[0] == "{" else "", tail)
+    return tail + "".join(reversed(stack)), True
+
+
+def _requote(text: str) -> str:
+    # 'key': 'value'  ->  "key": "value"  (only single-quoted tokens, escapes inner double quotes)
+    def swap(m: re.Match) -> str:
+        inner = m.group(2).replace('\\"', '"').replace('"', '\\"').replace("\\'", "'")
+        return m.group(1) + '"' + inner + '"'
+    return re.sub(r"([{\[,:]\s*)'((?:[^'\\]|\\.)*)'", swap, text)
+
+
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _fix_syntax(code: str) -> str:
+    # Trailing commas, and Python literals where a value goes (after ':', '[' or ',')
+    code = re.sub(r",(\s*[}\]])", r"\1", code)
+    return re.sub(r"([:\[,]\s*)(True|False|None)\b", lambda m: m.group(1) + _LITERALS[m.group(2)], code)
+
+
+def _outside_strings(text: str, fix: Callable[[str], str]) -> str:
+    """Apply `fix` to the text between double-quoted strings only, so string contents stay as written."""
+    out, pos = [], 0
+    for m in _STRING.finditer(text):
+        out.append(fix(text[pos:m.start()]))
+        out.append(m.group(0))
+        pos = m.end()
+    out.append(fix(text[pos:]))
+    return "".join(out)
+
+
+def repair_json(text: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Parse model output as a JSON object, repairing common defects. Returns (payload, repaired)."""
+    cleaned = re.sub(r"^```(json)?|```$", "", (text or "").strip(), flags=re.MULTILINE).strip()
+    try:
+        payload = json.loads(cleaned)
+        if isinstance(payload, dict):
+            return payload, False
+    except ValueError:
+        pass
+
+    candidate, _ = extract_object(cleaned)
+    if candidate is None:
+        return None, True
+    fixed = _outside_strings(_requote(candidate), _fix_syntax)
+    # Quoting bare keys can touch string contents, so it is the last resort
+    bare = re.sub(r"([{,]\s*)([A-Za-z_][\w /&-]*?)(\s*:)", r'\1"\2"\3', fixed)
+    for attempt in (candidate, fixed, bare):
+        try:
+            payload = json.loads(attempt, strict=False)
+            if isinstance(payload, dict):
+                return payload, True
+        except ValueError:
+            continue
+    return None, True
+
+
+def canonical_section(name: str) -> Optional[str]:
+    key = re.sub(r"[^\w/& -]", "", name).strip().casefold()
+    if key in _CANONICAL:
+        return _CANONICAL[key]
+    if key in SECTION_ALIASES:
+        return SECTION_ALIASES[key]
+    match = difflib.get_close_matches(key, list(_CANONICAL) + list(SECTION_ALIASES), n=1, cutoff=0.75)
+    if match:
+        return _CANONICAL.get(match[0]) or SECTION_ALIASES[match[0]]
+    return None
+
+
+def normalize_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    sections = payload.get("sections")
+    if not isinstance(sections, dict):
+        # Sections sometimes come back at the top level
+        sections = {k: v for k, v in payload.items() if k != "title"}
+    out: Dict[str, Any] = {}
+    for name, content in sections.items():
+        target = canonical_section(str(name)) or str(name)
+        if not content:
+            continue
+        if target in out and target != name:
+            # Two near-misses folded into one section: keep both
+            existing = out[target] if isinstance(out[target], list) else [out[target]]
+            out[target] = existing + (content if isinstance(content, list) else [content])
+        else:
+            out[target] = content
+    title = payload.get("title")
+    return {"title": str(title) if title else "Lesson Plan", "sections": out}
+
+
+def missing_sections(sections: Dict[str, Any]) -> List[str]:
+    return [s for s in SECTION_ORDER if not sections.get(s)]
+
+
+def salvage(text: str) -> Tuple[Dict[str, Any], List[str]]:
+    """Best-effort plan payload from raw output plus the SECTION_ORDER sections still missing."""
+    payload, repaired = repair_json(text)
+    if payload is None:
+        _stats.add(parsed=1, failed=1)
+        return {"title": "Lesson Plan", "sections": {}}, list(SECTION_ORDER)
+    normalized = normalize_payload(payload)
+    missing = missing_sections(normalized["sections"])
+    rescued = bool(normalized["sections"]) and (repaired or bool(missing))
+    _stats.add(parsed=1, repaired=int(repaired), clean=int(not repaired), rescued=int(rescued))
+    return normalized, missing
@@ -0,0 +1,181 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+from .config import SIMILAR_PATH, SIMILARITY_THRESHOLD
+
+# 64 MinHash values in 16 LSH bands of 4: pairs with Jaccard ~0.5 share a
+# band about half the time, ~0.7 almost always, ~0.3 rarely
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 31) - 1
+
+# Fields that only change some sections; a near-duplicate differing in them can be reused as a seed
+DELTA_FIELDS = ("topic", "duration", "pedagogy", "bloom", "learning_objectives", "constraints")
+
+_STOPWORDS = {"a", "an", "and", "the", "of", "in", "on", "to", "for", "with", "its", "their", "by", "at", "from"}
+
+
+class SimilarPlan(BaseModel):
+    score: float
+    request: Dict[str, Any]
+    plan: Dict[str, Any]
+    differs: List[str]
+
+
+def _fold(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        value = " ".join(map(str, value))
+    return " ".join(str(value or "").casefold().split())
+
+
+def shingles(request: Dict[str, Any]) -> Set[str]:
+    """Character trigrams of the content words of topic and objectives.
+
+    Trigrams keep "photosynthesis" close to "photosynthesis in plants" and
+    tolerate plurals and typos that whole-word sets would miss.
+    """
+    text = _fold(request.get("topic")) + " " + _fold(request.get("learning_objectives"))
+    out: Set[str] = set()
+    for word in re.findall(r"\w+", text):
+        if word in _STOPWORDS:
+            continue
+        padded = f" {word} "
+        out.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return out
+
+
+def block(request: Dict[str, Any]) -> str:
+    # Only plans for the same board, grade and subject are ever candidates
+    return "|".join((_fold(request.get("board")), str(request.get("grade", "")), _fold(request.get("subject"))))
+
+
+def _h64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=True)
+
+
+class SimilarityIndex:
+    """MinHash/LSH index of generated (request, plan) pairs, persisted in SQLite.
+
+    Each plan is stored with its MinHash signature and one row per LSH band
+    in an indexed bucket table, so a lookup is BANDS indexed probes plus a
+    comparison against the few plans that collide, regardless of library size.
+    """
+
+    def __init__(self, path: Optional[str] = SIMILAR_PATH, seed: int = 1):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "candidates": 0, "added": 0}
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plans ("
+            " id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, request TEXT NOT NULL,"
+            " plan TEXT NOT NULL, signature BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, plan_id INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets(bucket)")
+        self._db.commit()
+
+    def signature(self, request: Dict[str, Any]):
+        import numpy as np
+
+        grams = shingles(request)
+        if not grams:
+            return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+        x = np.array([_h64(g.encode("utf-8")) & 0xFFFFFFFF for g in grams], dtype=np.uint64)
+        # (a*x + b) mod p for every permutation and shingle; a, x < 2**32 so it fits in uint64
+        return ((np.outer(self._a, x) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _buckets(self, request: Dict[str, Any], sig) -> List[int]:
+        prefix = block(request).encode("utf-8")
+        return [_h64(prefix + bytes([band]) + sig[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+    def add(self, key: str, request: Dict[str, Any], plan: Dict[str, Any]) -> None:
+        sig = self.signature(request)
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO plans (key, request, plan, signature, created) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(request, ensure_ascii=False), json.dumps(plan, ensure_ascii=False),
+                 sig.tobytes(), time.time()),
+            )
+            if cur.rowcount:
+                self._db.executemany("INSERT INTO buckets (bucket, plan_id) VALUES (?, ?)",
+                                     [(b, cur.lastrowid) for b in self._buckets(request, sig)])
+                self._stats["added"] += 1
+            self._db.commit()
+
+    def find(self, request: Dict[str, Any], threshold: float = SIMILARITY_THRESHOLD, limit: int = 3,
+             exclude: Optional[str] = None) -> List[SimilarPlan]:
+        """Stored plans whose estimated Jaccard similarity to `request` is at least `threshold`, best first."""
+        import numpy as np
+
+        sig = self.signature(request)
+        buckets = self._buckets(request, sig)
+        with self._lock:
+            self._stats["lookups"] += 1
+            rows = self._db.execute(
+                "SELECT id, key, request, plan, signature FROM plans WHERE id IN"
+                f" (SELECT plan_id FROM buckets WHERE bucket IN ({','.join('?' * len(buckets))}))",
+                buckets,
+            ).fetchall()
+            self._stats["candidates"] += len(rows)
+
+        scored = []
+        for _, key, req_json, plan_json, blob in rows:
+            if key == exclude:
+                continue
+            score = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == sig))
+            if score >= threshold:
+                scored.append((score, req_json, plan_json))
+        scored.sort(key=lambda s: -s[0])
+
+        out = []
+        for score, req_json, plan_json in scored[:limit]:
+            stored = json.loads(req_json)
+            differs = [f for f in DELTA_FIELDS if _fold(stored.get(f)) != _fold(request.get(f))]
+            out.append(SimilarPlan(score=score, request=stored, plan=json.loads(plan_json), differs=differs))
+        if out:
+            with self._lock:
+                self._stats["hits"] += 1
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            (stats["plans"],) = self._db.execute("SELECT COUNT(*) FROM plans").fetchone()
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM buckets")
+            self._db.execute("DELETE FROM plans")
+            self._db.commit()
+
+
+_index: Optional[SimilarityIndex] = None
+_index_lock = threading.Lock()
+
+
+def similar_index() -> SimilarityIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex()
+        return _index
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT = os.path.dirname(SRC)
+
+# Streamlit entry points; their core.* imports run on every cold start
+UI_SCRIPTS = (os.path.join(SRC, "app", "main.py"), os.path.join(ROOT, "lesson_planner.py"))
+
+# Loaded on first generate/export only; none of these may appear in a cold UI import
+DEFERRED = ("google.generativeai", "google.ai", "docx", "reportlab", "uharfbuzz", "PIL", "numpy")
+
+# Milliseconds for the core.* imports of both UIs together, excluding Streamlit itself
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "150"))
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def ui_imports(scripts: Sequence[str] = UI_SCRIPTS) -> List[str]:
+    """The core.* modules the UI scripts import at top level, in first-seen order."""
+    modules: List[str] = []
+    for path in scripts:
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), path)
+        for node in tree.body:
+            names = []
+            if isinstance(node, ast.ImportFrom) and node.module:
+                names = [node.module]
+            elif isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            for name in names:
+                if name.startswith("core.") and name not in modules:
+                    modules.append(name)
+    return modules
+
+
+def _importtime(code: str) -> List[Tuple[str, int, int, int]]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=SRC, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def profile(modules: Sequence[str]) -> Tuple[List[Tuple[str, int, int, int]], float]:
+    """Import `modules` in a fresh interpreter under -X importtime.
+
+    Returns ((module, self_us, cumulative_us, depth) rows, total ms), leaving
+    out what the bare interpreter (site, .pth hooks) imports before our code.
+    """
+    startup = {r[0] for r in _importtime("pass")}
+    rows = [r for r in _importtime("; ".join(f"import {m}" for m in modules)) if r[0] not in startup]
+    total = sum(cum for _, _, cum, depth in rows if depth == 0) / 1e3
+    return rows, total
+
+
+def deferred_loaded(rows: Sequence[Tuple[str, int, int, int]], deferred: Sequence[str] = DEFERRED) -> List[str]:
+    names = {r[0] for r in rows}
+    return [d for d in deferred if d in names]
+
+
+def report(rows: Sequence[Tuple[str, int, int, int]], top: int) -> str:
+    # Group by top-level package so a slow dependency shows up as one line
+    packages: Dict[str, int] = {}
+    for name, self_us, _, _ in rows:
+        pkg = name.split(".")[0]
+        packages[pkg] = packages.get(pkg, 0) + self_us
+    lines = [f"{'module':48s} {'self ms':>9s} {'cum ms':>9s}"]
+    for name, self_us, cum, depth in sorted(rows, key=lambda r: -r[2])[:top]:
+        lines.append(f"{'  ' * depth + name:48s} {self_us / 1e3:9.2f} {cum / 1e3:9.2f}")
+    lines.append("")
+    lines.append(f"{'package':48s} {'self ms':>9s}")
+    for pkg, self_us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+        lines.append(f"{pkg:48s} {self_us / 1e3:9.2f}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Profile cold-start imports and check the UI import budget.")
+    parser.add_argument("modules", nargs="*", help="modules to import (default: the UIs' core.* imports)")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 if over --budget-ms or if a deferred dependency was imported")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3, help="runs for --check; the fastest counts")
+    args = parser.parse_args(argv)
+
+    modules = args.modules or ui_imports()
+    runs = [profile(modules) for _ in range(args.repeat if args.check else 1)]
+    rows, total = min(runs, key=lambda r: r[1])
+    print(report(rows, args.top))
+    print(f"\ncold import of {', '.join(modules)}: {total:.1f} ms")
+    if not args.check:
+        return 0
+
+    failures = []
+    if total > args.budget_ms:
+        failures.append(f"{total:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    loaded = deferred_loaded(rows)
+    if loaded:
+        failures.append(f"loaded at start-up instead of on first use: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if not failures:
+        print(f"OK: within {args.budget_ms:.0f} ms, no deferred dependencies loaded")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+_KEY = re.compile(r'^\s*"((?:[^"\\]|\\.)*)"\s*:', re.S)
+
+
+class JSONSectionParser:
+    """Incrementally scans a streamed `{"title": ..., "sections": {...}}` object.
+
+    `feed()` returns every top-level member and every member of `sections`
+    whose value has been fully received, so callers can render a section
+    as soon as its closing comma or brace arrives.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.starts: dict[int, int] = {}
+        self.in_sections = False
+
+    def _member(self, start: int, end: int) -> List[Tuple[str, Any]]:
+        text = self.buf[start:end].strip()
+        if not text:
+            return []
+        try:
+            obj = json.loads("{" + text + "}")
+        except ValueError:
+            return []
+        return [(k, v) for k, v in obj.items()]
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        out: List[Tuple[str, Any]] = []
+        self.buf += chunk
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if self.depth == 0 and ch != "{":
+                continue  # code fences / preamble before the object
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+                if ch == "{" and self.depth == 1:
+                    self.starts[1] = i + 1
+                elif ch == "{" and self.depth == 2:
+                    m = _KEY.match(buf[self.starts[1]:i])
+                    if m and m.group(1) == "sections":
+                        self.in_sections = True
+                        self.starts[2] = i + 1
+            elif ch == ",":
+                if self.depth == 1:
+                    out += self._root(self.starts[1], i)
+                    self.starts[1] = i + 1
+                elif self.depth == 2 and self.in_sections:
+                    out += self._member(self.starts[2], i)
+                    self.starts[2] = i + 1
+            elif ch in "}]":
+                if ch == "}" and self.depth == 2 and self.in_sections:
+                    out += self._member(self.starts[2], i)
+                    self.in_sections = False
+                elif ch == "}" and self.depth == 1:
+                    out += self._root(self.starts[1], i)
+                self.depth -= 1
+        self.pos = len(buf)
+        return out
+
+    def _root(self, start: int, end: int) -> List[Tuple[str, Any]]:
+        # `sections` itself was already emitted member by member
+        return [(k, v) for k, v in self._member(start, end) if k != "sections"]
+
+
+class MarkdownSectionParser:
+    """Splits streamed Markdown on `### ` headings, emitting each section once the next begins."""
+
+    def __init__(self, marker: str = "### "):
+        self.marker = marker
+        self.buf = ""
+        self.heading: Optional[str] = None
+        self.body: List[str] = []
+
+    def _flush(self) -> List[Tuple[str, str]]:
+        if self.heading is None:
+            return []
+        section = (self.heading, "\n".join(self.body).strip())
+        self.heading, self.body = None, []
+        return [section]
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        out: List[Tuple[str, str]] = []
+        self.buf += chunk
+        *lines, self.buf = self.buf.split("\n")
+        for line in lines:
+            if line.startswith(self.marker):
+                out += self._flush()
+                self.heading = line[len(self.marker):].strip()
+            elif self.heading is not None:
+                self.body.append(line)
+        return out
+
+    def close(self) -> List[Tuple[str, str]]:
+        out = self.feed("\n")
+        return out + self._flush()
@@ -0,0 +1,510 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Protocol, Sequence, Tuple, Union
+
+from .backends import get_backend
+from .config import (
+    TRANSLATE_BACKEND,
+    TRANSLATE_MODEL,
+    TRANSLATE_CONCURRENCY,
+    TRANSLATE_BATCH,
+    TRANSLATE_BATCH_CHARS,
+    TRANSLATION_MEMORY_PATH,
+    TRANSLATION_MEMORY_ITEMS,
+    FAKE_TRANSLATE_LATENCY,
+    FAKE_SEED,
+)
+from .metrics import REGISTRY, count
+from .utils import SECTION_ORDER
+
+# Plans are cut into segments (sentences, list items, table cells, headings) with their
+# Markdown kept aside; segments already in the translation memory are reused, the rest
+# go to the translator in batches that run concurrently.
+
+LANGUAGES = {"en": "English", "hi": "Hindi", "gu": "Gujarati"}
+
+REGISTRY.describe("planit_translation_segments_total", "counter",
+                  "Translated segments by source (memory or translator).")
+
+TRANSLATE_PROMPT = """
+Translate each segment of a school lesson plan from {source} into {target}.
+Keep Markdown markers, numbers, units, formulas and proper nouns unchanged. Use the vocabulary of {target}-medium school textbooks.
+Return only a JSON array with exactly {n} strings, the translations in the same order.
+
+Segments:
+{segments}
+"""
+
+
+class Translator(Protocol):
+    # Part of the translation memory key, so output from one translator never stands in for another's
+    name: str
+
+    def translate(self, texts: Sequence[str], source: str, target: str) -> List[str]: ...
+
+
+def _parse_array(text: str, n: int) -> Optional[List[str]]:
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return None
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != n:
+        return None
+    return [str(item) for item in items]
+
+
+class ModelTranslator:
+    """Translates through the LLM backend: one call per batch, answered as a JSON array."""
+
+    def __init__(self, backend: Any = None, model: str = TRANSLATE_MODEL):
+        self.backend = backend
+        self.model = model
+        self.name = f"model:{model}"
+
+    def translate(self, texts: Sequence[str], source: str, target: str) -> List[str]:
+        prompt = TRANSLATE_PROMPT.format(source=LANGUAGES.get(source, source), target=LANGUAGES.get(target, target),
+                                         n=len(texts), segments=json.dumps(list(texts), ensure_ascii=False, indent=0))
+        response = (self.backend or get_backend()).generate(prompt, model=self.model, timeout=60)
+        out = _parse_array(response.text, len(texts))
+        if out is not None:
+            return out
+        if len(texts) == 1:
+            raise ValueError("translator did not return a JSON array")
+        # A dropped or merged segment loses the alignment: halve the batch and try again
+        mid = len(texts) // 2
+        return self.translate(texts[:mid], source, target) + self.translate(texts[mid:], source, target)
+
+
+# Letters the fake builds its pseudo-words from, so exports exercise the real script
+_FAKE_SCRIPTS = {
+    "hi": ("कखगघचछजझटठडढणतथदधनपफबभमयरलवशषसह", "ािीुूेैोौ"),
+    "gu": ("કખગઘચછજઝટઠડઢણતથદધનપફબભમયરલવશષસહ", "ાિીુૂેૈોૌ"),
+}
+
+
+class FakeTranslator:
+    """Offline stand-in: deterministic pseudo-words in the target script after a simulated delay.
+
+    Markup, digits and punctuation pass through, so the output has the shape of a
+    real translation for the UIs, exporters and benchmarks.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = FAKE_TRANSLATE_LATENCY, jitter: float = 0.1, seed: int = FAKE_SEED):
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def _word(self, word: str, target: str) -> str:
+        consonants, signs = _FAKE_SCRIPTS.get(target, _FAKE_SCRIPTS["hi"])
+        digest = hashlib.sha256(f"{self.seed}:{target}:{word.lower()}".encode("utf-8")).digest()
+        syllables = max(1, (len(word) + 1) // 3)
+        return "".join(consonants[digest[2 * i] % len(consonants)] +
+                       (signs[digest[2 * i + 1] % (len(signs) + 1) - 1] if digest[2 * i + 1] % (len(signs) + 1) else "")
+                       for i in range(syllables))
+
+    def translate(self, texts: Sequence[str], source: str, target: str) -> List[str]:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        # Longer batches take longer, like output tokens from a model
+        time.sleep(delay * (0.5 + min(1.0, sum(map(len, texts)) / 2000)))
+        if source == target:
+            return list(texts)
+        return [re.sub(r"[A-Za-z]+", lambda m: self._word(m.group(0), target), t) for t in texts]
+
+
+_translator: Optional[Translator] = None
+_translator_lock = threading.Lock()
+
+
+def get_translator() -> Translator:
+    global _translator
+    with _translator_lock:
+        if _translator is None:
+            _translator = FakeTranslator() if TRANSLATE_BACKEND == "fake" else ModelTranslator()
+        return _translator
+
+
+def set_translator(translator: Translator) -> None:
+    global _translator
+    with _translator_lock:
+        _translator = translator
+
+
+# --- translation memory ---
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+class TranslationMemory:
+    """Exact-match segment memory: an LRU in front of SQLite, shared by every plan and process."""
+
+    def __init__(self, path: Optional[str] = TRANSLATION_MEMORY_PATH, max_memory: int = TRANSLATION_MEMORY_ITEMS):
+        self.max_memory = max_memory
+        self._memory: "OrderedDict[Tuple[str, str, str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stored": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                " translator TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, text TEXT NOT NULL,"
+                " translation TEXT NOT NULL, hits INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, used REAL NOT NULL,"
+                " PRIMARY KEY (translator, source, target, text))"
+            )
+            self._db.commit()
+
+    def _remember(self, key: Tuple[str, str, str, str], translation: str) -> None:
+        self._memory[key] = translation
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def get_many(self, translator: str, source: str, target: str, texts: Sequence[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        rest = []
+        with self._lock:
+            for text in texts:
+                key = (translator, source, target, normalize(text))
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[text] = self._memory[key]
+                else:
+                    rest.append(text)
+            if rest and self._db is not None:
+                by_norm: Dict[str, List[str]] = {}
+                for text in rest:
+                    by_norm.setdefault(normalize(text), []).append(text)
+                norms = list(by_norm)
+                now = time.time()
+                for i in range(0, len(norms), 500):
+                    chunk = norms[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    args = (translator, source, target, *chunk)
+                    rows = self._db.execute(
+                        "SELECT text, translation FROM segments WHERE translator = ? AND source = ? AND target = ?"
+                        f" AND text IN ({marks})", args).fetchall()
+                    for norm, translation in rows:
+                        self._remember((translator, source, target, norm), translation)
+                        for text in by_norm[norm]:
+                            found[text] = translation
+                    if rows:
+                        self._db.executemany(
+                            "UPDATE segments SET hits = hits + 1, used = ? WHERE translator = ? AND source = ?"
+                            " AND target = ? AND text = ?", [(now, translator, source, target, n) for n, _ in rows])
+                self._db.commit()
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(texts) - len(found)
+        return found
+
+    def put_many(self, translator: str, source: str, target: str, pairs: Dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            for text, translation in pairs.items():
+                self._remember((translator, source, target, normalize(text)), translation)
+            self._stats["stored"] += len(pairs)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO segments (translator, source, target, text, translation, created, used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(translator, source, target, normalize(t), tr, now, now) for t, tr in pairs.items()])
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+            if self._db is not None:
+                (stats["stored_total"],) = self._db.execute("SELECT COUNT(*) FROM segments").fetchone()
+        looked_up = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / looked_up if looked_up else 0.0
+        return stats
+
+
+_memory: Optional[TranslationMemory] = None
+_memory_lock = threading.Lock()
+
+
+def translation_memory() -> TranslationMemory:
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory()
+        return _memory
+
+
+# --- segmentation ---
+
+# Structure kept verbatim in front of a line: indent, heading hashes, quote, list/option markers, emoji
+_LINE_PREFIX = re.compile(r"^(\s*(?:#{1,6}\s+|>\s*|[-*+•]\s+|\d{1,3}[.)]\s+|[A-Da-d][.)]\s+)*[^\w\s*_`\[]*\s*)")
+# Inline markup and text that must not be translated
+_PROTECTED = re.compile(r"(\*\*|__|`[^`]*`|https?://\S+|\[|\]\([^)]*\))")
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
+_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+
+Template = List[Union[str, int]]  # literal text, or an index into the segment list
+
+
+def _split_text(text: str, parts: Template, segments: List[str]) -> None:
+    for piece in _PROTECTED.split(text):
+        if not piece:
+            continue
+        if _PROTECTED.fullmatch(piece):
+            parts.append(piece)
+            continue
+        # Sentences are the unit of reuse: a stock sentence hits the memory even inside a new paragraph
+        pos = 0
+        for m in _SENTENCE_END.finditer(piece):
+            _add_segment(piece[pos:m.start()], parts, segments)
+            parts.append(m.group(0))
+            pos = m.end()
+        _add_segment(piece[pos:], parts, segments)
+
+
+def _add_segment(text: str, parts: Template, segments: List[str]) -> None:
+    core = text.strip()
+    if not any(c.isalpha() for c in core):
+        parts.append(text)
+        return
+    lead, trail = text[:len(text) - len(text.lstrip())], text[len(text.rstrip()):]
+    if lead:
+        parts.append(lead)
+    parts.append(len(segments))
+    segments.append(core)
+    if trail:
+        parts.append(trail)
+
+
+def segment(text: str) -> Tuple[Template, List[str]]:
+    """Split Markdown into a template and the segments to translate; `render` puts it back together."""
+    parts: Template = []
+    segments: List[str] = []
+    for line in text.splitlines(keepends=True):
+        body = line.rstrip("\r\n")
+        end = line[len(body):]
+        if body.lstrip().startswith("|") and not _TABLE_RULE.match(body):
+            for i, cell in enumerate(body.split("|")):
+                if i:
+                    parts.append("|")
+                _split_text(cell, parts, segments)
+        elif body.strip() and not _TABLE_RULE.match(body):
+            prefix = _LINE_PREFIX.match(body).group(1)
+            if prefix:
+                parts.append(prefix)
+            _split_text(body[len(prefix):], parts, segments)
+        else:
+            parts.append(body)
+        if end:
+            parts.append(end)
+    return parts, segments
+
+
+def render(parts: Template, translations: Sequence[str]) -> str:
+    return "".join(translations[p] if isinstance(p, int) else p for p in parts)
+
+
+# --- pipeline ---
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"segments": 0, "from_memory": 0, "translated": 0, "calls": 0, "seconds": 0.0}
+
+    def add(self, **deltas: float) -> None:
+        with self.lock:
+            for k, v in deltas.items():
+                self.counts[k] += v
+
+
+_stats = _Stats()
+
+
+def translate_stats() -> Dict[str, Any]:
+    with _stats.lock:
+        stats: Dict[str, Any] = dict(_stats.counts)
+    stats["memory_rate"] = stats["from_memory"] / stats["segments"] if stats["segments"] else 0.0
+    return stats
+
+
+def _batches(texts: Sequence[str], size: int, chars: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    used = 0
+    for text in texts:
+        if batch and (len(batch) >= size or used + len(text) > chars):
+            yield batch
+            batch, used = [], 0
+        batch.append(text)
+        used += len(text)
+    if batch:
+        yield batch
+
+
+def stream_sections(sections: Sequence[Tuple[str, Sequence[str]]], target: str, source: str = "en",
+                    translator: Optional[Translator] = None, memory: Optional[TranslationMemory] = None,
+                    concurrency: int = TRANSLATE_CONCURRENCY) -> Iterator[Tuple[str, List[str]]]:
+    """Translate named sections (each a list of Markdown texts), yielding each one as soon as it is complete.
+
+    Segments are deduplicated across all sections, looked up in the translation memory, and the
+    rest are sent in batches, earlier sections first, with up to `concurrency` calls in flight.
+    """
+    translator = translator or get_translator()
+    memory = memory or translation_memory()
+    if source == target:
+        yield from ((name, list(texts)) for name, texts in sections)
+        return
+
+    templates = []
+    needs: List[set] = []
+    unique: Dict[str, None] = {}
+    for name, texts in sections:
+        split = [segment(t) for t in texts]
+        templates.append((name, split))
+        wanted = {s for _, segs in split for s in segs}
+        needs.append(wanted)
+        for _, segs in split:
+            unique.update(dict.fromkeys(segs))
+
+    done = memory.get_many(translator.name, source, target, list(unique))
+    missing = [s for s in unique if s not in done]
+    _stats.add(segments=len(unique), from_memory=len(done), translated=len(missing))
+    count("planit_translation_segments_total", len(done), source="memory")
+    count("planit_translation_segments_total", len(missing), source="translator")
+
+    pending = list(range(len(templates)))
+
+    def ready() -> Iterator[Tuple[str, List[str]]]:
+        for i in list(pending):
+            if needs[i].issubset(done):
+                pending.remove(i)
+                name, split = templates[i]
+                yield name, [render(parts, [done[s] for s in segs]) for parts, segs in split]
+
+    yield from ready()
+    if not missing:
+        return
+
+    def run(batch: List[str]) -> Dict[str, str]:
+        start = time.perf_counter()
+        pairs = dict(zip(batch, translator.translate(batch, source, target)))
+        _stats.add(calls=1, seconds=time.perf_counter() - start)
+        # Stored from the worker thread, so a batch finishing after the caller gave up is not wasted
+        memory.put_many(translator.name, source, target, pairs)
+        return pairs
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="translate")
+    try:
+        futures: set[Future] = {pool.submit(run, b) for b in _batches(missing, TRANSLATE_BATCH, TRANSLATE_BATCH_CHARS)}
+        while futures:
+            finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done.update(future.result())
+            yield from ready()
+    finally:
+        # Also runs when the caller stops early or a batch fails: queued batches are dropped
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def translate_text(text: str, target: str, source: str = "en") -> str:
+    return next(iter(stream_sections([("text", [text])], target, source)))[1][0]
+
+
+def markdown_sections(text: str) -> List[str]:
+    """Cut Markdown before each heading line; joining the pieces gives back the text."""
+    cuts = [m.start() for m in re.finditer(r"(?m)^#{1,6}\s", text) if m.start()]
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def stream_markdown(text: str, target: str, source: str = "en",
+                    keep: Sequence[str] = ()) -> Iterator[Tuple[int, str]]:
+    """(index into markdown_sections(text), translated piece), each heading's section as it finishes.
+
+    Heading lines starting with one of `keep` stay as they are, so parsers that look for them still match.
+    """
+    pieces = markdown_sections(text)
+    heads = []
+    for piece in pieces:
+        line = piece.split("\n", 1)[0]
+        kept = bool(keep) and line.strip().startswith(tuple(keep))
+        heads.append(piece[:len(line) + 1] if kept else "")
+    units = [(str(i), [p[len(h):]]) for i, (p, h) in enumerate(zip(pieces, heads))]
+    for name, (translated,) in stream_sections(units, target, source):
+        yield int(name), heads[int(name)] + translated
+
+
+def stream_plan(plan: Dict[str, Any], target: str, source: str = "en") -> Iterator[Tuple[str, Any]]:
+    """("title", text) and then (section, content) for a plan dict, in the order they finish."""
+    sections = plan.get("sections", {})
+    units: List[Tuple[str, Sequence[str]]] = [("title", [plan.get("title", "Lesson Plan")])]
+    for name in SECTION_ORDER + [s for s in sections if s not in SECTION_ORDER]:
+        content = sections.get(name)
+        if content:
+            units.append((name, [str(c) for c in content] if isinstance(content, list) else [str(content)]))
+    for name, texts in stream_sections(units, target, source):
+        if name == "title":
+            yield name, texts[0]
+        else:
+            yield name, texts if isinstance(sections[name], list) else texts[0]
+
+
+def translate_plan(plan: Dict[str, Any], target: str, source: str = "en") -> Dict[str, Any]:
+    title, out = plan.get("title", "Lesson Plan"), {}
+    for name, content in stream_plan(plan, target, source):
+        if name == "title":
+            title = content
+        else:
+            out[name] = content
+    # Keep the plan's section order, not the order translations finished in
+    return {"title": title, "sections": {k: out[k] for k in plan.get("sections", {}) if k in out}}
+
+
+# --- CLI ---
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Translate a Markdown lesson plan (or '-' for stdin).")
+    parser.add_argument("input")
+    parser.add_argument("--target", required=True, choices=[k for k in LANGUAGES if k != "en"])
+    parser.add_argument("--source", default="en")
+    args = parser.parse_args(argv)
+
+    if args.input == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+    start = time.perf_counter()
+    pieces = markdown_sections(text)
+    for i, translated in stream_markdown(text, args.target, args.source):
+        pieces[i] = translated
+    sys.stdout.write("".join(pieces))
+    stats = translate_stats()
+    stats["elapsed"] = round(time.perf_counter() - start, 3)
+    stats["memory"] = translation_memory().stats()
+    print(json.dumps(stats), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 from __future__ import annotations
 from typing import Dict, Any
 
+from .metrics import timed
+
 SECTION_ORDER = [
     "Unit Overview",
     "Learning Outcomes",
@@ -13,16 +15,22 @@ SECTION_ORDER = [
     "References",
 ]
 
+def section_to_markdown(section: str, content: Any) -> str:
+    lines = [f"## {section}\n"]
+    if isinstance(content, list):
+        for item in content:
+            lines.append(f"- {item}")
+    else:
+        lines.append(str(content))
+    return "\n".join(lines)
+
+
+@timed("to_markdown")
 def to_markdown(plan: Dict[str, Any]) -> str:
     lines = [f"# {plan.get('title','Lesson Plan')}\n"]
     for section in SECTION_ORDER:
         content = plan.get("sections", {}).get(section)
         if content:
-            lines.append(f"## {section}\n")
-            if isinstance(content, list):
-                for item in content:
-                    lines.append(f"- {item}")
-            else:
-                lines.append(str(content))
+            lines.append(section_to_markdown(section, content))
             lines.append("")
     return "\n".join(lines).strip()
\ No newline at end of file
@@ -0,0 +1,322 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from . import metrics
+from .batch import TokenBucket
+from .cache import lesson_cache
+from .catalog import CurriculumIndex, get_index
+from .config import (CACHE_ENABLED, WARM_CONCURRENCY, WARM_DAYS, WARM_FORMATS, WARM_HALF_LIFE, WARM_MAX_COST,
+                     WARM_MAX_TOKENS, WARM_MIN_HITS, WARM_PRICE_OUTPUT, WARM_PRICE_PROMPT, WARM_RATE, WARM_SYLLABUS,
+                     WARM_TOP, WARM_VARIANTS, WARM_WINDOW)
+from .export import content_digest, export_bytes, is_exported, prune_exports
+from .generator import LessonRequest, generate_lesson, request_key
+from .legacy import export_file, generate_lesson_plan, lesson_key
+from .library import demand_key, grade_label, plan_library
+
+# Pre-generates the most requested plans and their exports during off-peak
+# hours, so the same requests at peak time are answered from the plan cache
+# and the export files instead of the model. Meant to run from cron:
+#   0 1 * * *  cd src && python -m core.warm
+
+# Tokens per plan assumed until the first plans report what they really used
+_FIRST_ESTIMATE = 2500
+
+
+class WarmItem(BaseModel):
+    source: str
+    request: Dict[str, Any]
+    # Demand weighted by recency; 0 for syllabus topics nobody has asked for yet
+    score: float
+    hits: int
+
+
+class WarmResult(BaseModel):
+    item: WarmItem
+    # "warmed" (plan and exports are now ready), "ready" (they already were) or "failed"
+    status: str
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+
+def _fold(text: Any) -> str:
+    return " ".join(str(text or "").split()).casefold()
+
+
+def on_syllabus(index: CurriculumIndex, source: str, request: Dict[str, Any]) -> bool:
+    """True when the board offers the subject: BOARDS/SUBJECTS for the main app, LESSON_DATA for the micro-lesson."""
+    board, subject = request.get("board", ""), request.get("subject", "")
+    if source == "main":
+        return subject in index.subjects(board)
+    band = index.band_for_grade(str(request.get("grade", "")))
+    if not band:
+        return False
+    return any(subject in index.subjects(board, band, stream) for stream in [""] + index.streams(board, band))
+
+
+def rank(rows: Iterable[Tuple[str, str, str, int]], today: Optional[date] = None, half_life: float = WARM_HALF_LIFE,
+         top: int = WARM_TOP, variants: int = WARM_VARIANTS, min_hits: int = WARM_MIN_HITS,
+         syllabus: int = WARM_SYLLABUS, index: Optional[CurriculumIndex] = None) -> List[WarmItem]:
+    """The requests worth warming, best first, from demand rows (day, source, request JSON, hits).
+
+    Requests are grouped by source, board, grade, subject and topic. Groups
+    are ranked by demand, halving in weight every `half_life` days, and each
+    contributes its `variants` most requested variants (duration, Bloom
+    level, objective, ...) with at least `min_hits` requests. Requests for
+    subjects the board does not offer are left out.
+    """
+    today = today or date.today()
+    index = index or get_index()
+    groups: Dict[Tuple[str, ...], Dict[str, List[Any]]] = defaultdict(dict)
+    for day, source, raw, hits in rows:
+        request = json.loads(raw)
+        if not on_syllabus(index, source, request):
+            continue
+        weight = hits * 0.5 ** (max(0, (today - date.fromisoformat(day)).days) / half_life)
+        group = (source, str(request.get("board", "")), grade_label(request.get("grade", "")),
+                 str(request.get("subject", "")), _fold(request.get("topic")))
+        entry = groups[group].setdefault(demand_key(request, source), [0.0, 0, request])
+        entry[0] += weight
+        entry[1] += hits
+
+    items: List[WarmItem] = []
+    for group, entries in sorted(groups.items(), key=lambda kv: -sum(e[0] for e in kv[1].values())):
+        for score, hits, request in sorted(entries.values(), key=lambda e: -e[0])[:variants]:
+            if hits >= min_hits:
+                items.append(WarmItem(source=group[0], request=request, score=round(score, 3), hits=hits))
+    items = items[:top]
+    if syllabus:
+        items += syllabus_items(items, index, syllabus)[:max(0, top - len(items))]
+    return items
+
+
+def syllabus_items(items: Sequence[WarmItem], index: CurriculumIndex, per_block: int) -> List[WarmItem]:
+    """Up to `per_block` more syllabus topics for each requested main-app board/grade/subject.
+
+    Each takes the settings of that block's most requested plan, without
+    its topic-specific objectives. Micro-lessons need a teacher's own
+    objective, so they are only warmed from demand.
+    """
+    seen = {(i.request.get("board"), grade_label(i.request.get("grade", "")), i.request.get("subject"),
+             _fold(i.request.get("topic"))) for i in items}
+    blocks: Dict[Tuple[str, str, str], WarmItem] = {}
+    for item in items:
+        if item.source == "main":
+            blocks.setdefault((item.request["board"], grade_label(item.request["grade"]), item.request["subject"]),
+                              item)
+    out: List[WarmItem] = []
+    for (board, grade, subject), template in blocks.items():
+        added = 0
+        for topic in index.topics_for(board, subject):
+            if added >= per_block:
+                break
+            if (board, grade, subject, _fold(topic)) in seen:
+                continue
+            request = dict(template.request, topic=topic, learning_objectives=[])
+            out.append(WarmItem(source="main", request=request, score=0.0, hits=0))
+            added += 1
+    return out
+
+
+def in_window(spec: str, now: Optional[datetime] = None) -> bool:
+    """Whether `now` (local time) falls in "HH:MM-HH:MM"; the window may wrap midnight. Empty means always."""
+    if not spec.strip():
+        return True
+    start, _, end = spec.partition("-")
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    lo, hi = (int(t.split(":")[0]) * 60 + int(t.split(":")[1] or 0) for t in (start.strip(), end.strip()))
+    return lo <= minute < hi if lo <= hi else minute >= lo or minute < hi
+
+
+class Meter:
+    """Tokens and cost spent by this process's model calls since the meter was created."""
+
+    def __init__(self, price_prompt: float = WARM_PRICE_PROMPT, price_output: float = WARM_PRICE_OUTPUT):
+        # Token counts come from the metrics registry, so it has to be on even when the apps run without it
+        metrics.configure(enabled=True)
+        self.price_prompt = price_prompt
+        self.price_output = price_output
+        self._start = self._read()
+
+    @staticmethod
+    def _read() -> Tuple[float, float]:
+        return (metrics.REGISTRY.total("planit_tokens_total", kind="prompt"),
+                metrics.REGISTRY.total("planit_tokens_total", kind="output"))
+
+    def used(self) -> Tuple[int, float]:
+        """(tokens, USD) so far."""
+        prompt, output = (now - start for now, start in zip(self._read(), self._start))
+        return int(prompt + output), (prompt * self.price_prompt + output * self.price_output) / 1e6
+
+
+def _exports_ready(item: WarmItem, formats: Sequence[str]) -> bool:
+    if item.source == "legacy":
+        hit = lesson_cache().get(lesson_key(*(item.request[k] for k in ("board", "grade", "subject", "topic",
+                                                                          "objective"))))
+        return hit is not None and all(is_exported(content_digest(hit["text"]), f"legacy.{f}") for f in formats)
+    hit = lesson_cache().get(request_key(LessonRequest(**item.request)))
+    return hit is not None and all(is_exported(content_digest(hit), f) for f in formats)
+
+
+def warm_one(item: WarmItem, formats: Sequence[str]) -> WarmResult:
+    """Generate (or fetch from the cache) one plan and render its exports the way the apps will ask for them."""
+    start = time.monotonic()
+    try:
+        if item.source == "legacy":
+            r = item.request
+            text = generate_lesson_plan(r["board"], r["grade"], r["subject"], r["topic"], r["objective"])
+            if text.startswith("An error occurred"):
+                raise RuntimeError(text)
+            for fmt in formats:
+                export_file(text, fmt)
+        else:
+            plan = generate_lesson(LessonRequest(**item.request), use_cache=True).model_dump()
+            for fmt in formats:
+                export_bytes(plan, fmt)
+    except Exception as e:
+        return WarmResult(item=item, status="failed", elapsed=time.monotonic() - start,
+                          error=f"{type(e).__name__}: {e}")
+    return WarmResult(item=item, status="warmed", elapsed=time.monotonic() - start)
+
+
+class Warmer:
+    """Warms items in rank order until they run out, the budget would be exceeded or the window closes.
+
+    Before each plan starts, the tokens and cost already spent plus an
+    estimate for the plans in flight and the next one must stay within the
+    limits. The estimate is the mean use per plan so far, so a run stops
+    one plan early rather than one plan late.
+    """
+
+    def __init__(self, max_tokens: int = WARM_MAX_TOKENS, max_cost: float = WARM_MAX_COST,
+                 rate: float = WARM_RATE, concurrency: int = WARM_CONCURRENCY,
+                 formats: Sequence[str] = tuple(WARM_FORMATS.split(",")), window: str = WARM_WINDOW,
+                 meter: Optional[Meter] = None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.rate = rate
+        self.concurrency = concurrency
+        self.formats = [f.strip() for f in formats if f.strip()]
+        self.window = window
+        self.meter = meter or Meter()
+        self.counts = {"warmed": 0, "ready": 0, "failed": 0}
+        # Why the run ended early, if it did
+        self.stopped = ""
+
+    def _estimate(self) -> Tuple[float, float]:
+        tokens, cost = self.meter.used()
+        done = self.counts["warmed"] + self.counts["failed"]
+        if not done or not tokens:
+            per_cost = (_FIRST_ESTIMATE * self.meter.price_output) / 1e6
+            return _FIRST_ESTIMATE, per_cost
+        return tokens / done, cost / done
+
+    def _over(self, inflight: int) -> str:
+        if not in_window(self.window):
+            return f"outside the off-peak window {self.window}"
+        tokens, cost = self.meter.used()
+        per_tokens, per_cost = self._estimate()
+        if self.max_tokens and tokens + per_tokens * (inflight + 1) > self.max_tokens:
+            return f"token budget ({tokens} of {self.max_tokens} used)"
+        if self.max_cost and cost + per_cost * (inflight + 1) > self.max_cost:
+            return f"cost budget (${cost:.4f} of ${self.max_cost:.2f} used)"
+        return ""
+
+    def run(self, items: Iterable[WarmItem]) -> Iterator[WarmResult]:
+        """Yield a result per item as it completes; items already warm are reported without a model call."""
+        bucket = TokenBucket(self.rate, 1.0)
+        pending: Dict[Future, WarmItem] = {}
+        queue = iter(items)
+        exhausted = False
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="warm") as pool:
+            while True:
+                while not exhausted and not self.stopped and len(pending) < self.concurrency:
+                    item = next(queue, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    if _exports_ready(item, self.formats):
+                        self.counts["ready"] += 1
+                        yield WarmResult(item=item, status="ready")
+                        continue
+                    self.stopped = self._over(len(pending))
+                    if self.stopped:
+                        break
+                    bucket.acquire()
+                    pending[pool.submit(warm_one, item, self.formats)] = item
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    result = future.result()
+                    self.counts[result.status] += 1
+                    yield result
+
+
+def _describe(item: WarmItem) -> str:
+    r = item.request
+    extra = r.get("objective") if item.source == "legacy" else f"{r.get('duration')}, {r.get('bloom')}"
+    return f"{item.source:6s} {r.get('board', '')} {grade_label(r.get('grade', ''))} {r.get('subject', '')}: " \
+           f"{r.get('topic', '')} ({extra})"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate the most requested plans and their exports.")
+    parser.add_argument("--days", type=int, default=WARM_DAYS, help="days of request history to rank")
+    parser.add_argument("--top", type=int, default=WARM_TOP)
+    parser.add_argument("--syllabus", type=int, default=WARM_SYLLABUS,
+                        help="also warm this many syllabus topics per requested board/grade/subject")
+    parser.add_argument("--max-tokens", type=int, default=WARM_MAX_TOKENS, help="0 = no token limit")
+    parser.add_argument("--max-cost", type=float, default=WARM_MAX_COST, help="USD; 0 = no cost limit")
+    parser.add_argument("--rate", type=float, default=WARM_RATE, help="plans started per second")
+    parser.add_argument("--concurrency", type=int, default=WARM_CONCURRENCY)
+    parser.add_argument("--formats", default=WARM_FORMATS)
+    parser.add_argument("--window", default=WARM_WINDOW, help='off-peak hours, e.g. "01:00-05:00"')
+    parser.add_argument("--now", action="store_true", help="ignore the off-peak window")
+    parser.add_argument("--dry-run", action="store_true", help="print the ranking without generating anything")
+    args = parser.parse_args(argv)
+
+    if not CACHE_ENABLED and not args.dry_run:
+        print("warm: the plan cache is off (CACHE_ENABLED=0), so warmed plans would not be reused", file=sys.stderr)
+        return 2
+    since = (date.today() - timedelta(days=args.days)).isoformat()
+    items = rank(plan_library().demand_since(since), top=args.top, syllabus=args.syllabus)
+    if args.dry_run:
+        for i, item in enumerate(items, 1):
+            print(f"{i:>4}  {item.score:8.2f} {item.hits:>6}  {_describe(item)}")
+        print(f"{len(items)} plans to warm from requests since {since}", file=sys.stderr)
+        return 0
+
+    window = "" if args.now else args.window
+    if not in_window(window):
+        print(f"warm: outside the off-peak window {window}; use --now to run anyway", file=sys.stderr)
+        return 0
+    warmer = Warmer(args.max_tokens, args.max_cost, args.rate, args.concurrency, args.formats.split(","), window)
+    start = time.monotonic()
+    for result in warmer.run(items):
+        if result.status == "failed":
+            print(f"failed  {_describe(result.item)}: {result.error}", file=sys.stderr)
+        elif result.status == "warmed":
+            print(f"warmed  {_describe(result.item)} in {result.elapsed:.1f}s", file=sys.stderr)
+    pruned = prune_exports()
+    tokens, cost = warmer.meter.used()
+    c = warmer.counts
+    print(f"done in {time.monotonic() - start:.0f}s: {c['warmed']} warmed, {c['ready']} already warm, "
+          f"{c['failed']} failed; {tokens} tokens (~${cost:.4f})"
+          + (f"; {pruned} old export files removed" if pruned else "")
+          + (f"; stopped early: {warmer.stopped}" if warmer.stopped else ""), file=sys.stderr)
+    return 1 if c["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# Offline and in-memory: the fake backend, no model delay, no SQLite files under .cache/.
+# Set before core.config is imported, which reads the environment once.
+os.environ.update({
+    "LLM_BACKEND": "fake",
+    "FAKE_LATENCY": "0",
+    "FAKE_JITTER": "0",
+    "CACHE_PATH": "",
+    "LIBRARY_PATH": "",
+    "SIMILAR_PATH": "",
+    "QUIZ_BANK_PATH": "",
+    "TRANSLATION_MEMORY_PATH": "",
+    "EXPORT_CACHE_PATH": "",
+    "TRACE_PATH": "",
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
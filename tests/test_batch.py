@@ -0,0 +1,29 @@
+import io
+import zipfile
+
+from core.batch import BatchResult, LegacyPlan, LegacyRequest, generate_legacy, generate_lessons_batch, legacy_requests
+from core.cache import lesson_cache
+from core.export import write_zip
+from core.legacy import lesson_key
+
+
+def test_legacy_rows_are_micro_lessons_under_the_apps_key():
+    requests = [r for r in legacy_requests({"*": ["Light"]}) if r.board == "CBSE" and r.subject == "Science"][:2]
+    assert requests and all(isinstance(r, LegacyRequest) for r in requests)
+    assert requests[0].grade.endswith("Grade") and "Light" in requests[0].objective
+
+    results = list(generate_lessons_batch(requests, rate=0, generate=generate_legacy))
+    assert all(r.ok for r in results)
+    for result in results:
+        req = result.request
+        assert result.key == lesson_key(req.board, req.grade, req.subject, req.topic, req.objective)
+        assert lesson_cache().get(result.key)["text"] == result.plan.text
+        assert "### 🎯 Main Activity" in result.plan.text
+        # Rows read back from the JSONL keep their kind
+        row = BatchResult.model_validate_json(result.model_dump_json())
+        assert isinstance(row.request, LegacyRequest) and isinstance(row.plan, LegacyPlan)
+
+    buf = io.BytesIO()
+    write_zip([r.plan.model_dump() for r in results], buf, ["md", "docx"])
+    with zipfile.ZipFile(buf) as zf:
+        assert b"### " in zf.read("Light.md")
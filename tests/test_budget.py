@@ -0,0 +1,48 @@
+import pytest
+
+from core.backends import get_backend
+from core.budget import budget_stats, is_truncated
+from core.generator import (LessonRequest, build_prompt, generate_lesson, generate_lesson_stream, regenerate_sections,
+                            request_budget)
+from core.legacy import generate_lesson_plan, regenerate_lesson_sections
+from core.utils import SECTION_ORDER
+
+
+def _request(**kw):
+    fields = dict(board="CBSE", grade=7, subject="Science", topic="Light", duration="45 minutes",
+                  pedagogy="Inquiry", bloom="Apply")
+    return LessonRequest(**{**fields, **kw})
+
+
+@pytest.mark.parametrize("duration", ["10 minutes", "45 minutes", "2 hours"])
+@pytest.mark.parametrize("grade", [1, 12])
+@pytest.mark.parametrize("topic", ["Light", "Newton's three laws of motion and their everyday applications"])
+def test_fake_plan_fits_its_budget(duration, grade, topic):
+    data = _request(duration=duration, grade=grade, topic=topic)
+    response = get_backend().generate(build_prompt(data), config=request_budget(data, questions=5).config())
+    assert not is_truncated(response.text, response.finish_reason)
+
+
+@pytest.mark.parametrize("names", [["References"], ["Homework/Extensions"], ["Assessment", "Lesson Flow"]])
+def test_fake_regenerate_is_not_truncated(names):
+    data = _request(topic=f"Sound {names[0]}")
+    plan = generate_lesson(data, use_cache=False)
+    before = budget_stats()["truncated"]
+    updated = regenerate_sections(data, plan, names)
+    assert budget_stats()["truncated"] == before
+    assert all(updated.sections[n] for n in names)
+
+
+def test_fake_stream_has_every_section():
+    names = [name for name, _ in generate_lesson_stream(_request(topic="Magnetism"), use_cache=False)]
+    assert names[0] == "title"
+    assert set(SECTION_ORDER) <= set(names)
+
+
+def test_fake_micro_lesson_is_not_truncated():
+    before = budget_stats()["truncated"]
+    text = generate_lesson_plan("CBSE", "7th Grade", "Science", "Light", "explain reflection", use_cache=False)
+    rewritten = regenerate_lesson_sections("CBSE", "7th Grade", "Science", "Light", "explain reflection", text,
+                                           ["conclusion", "quiz"])
+    assert rewritten != text
+    assert budget_stats()["truncated"] == before
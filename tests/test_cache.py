@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from core.cache import LessonCache
+
+
+def test_concurrent_misses_compute_once():
+    cache = LessonCache(path=None)
+    calls = []
+    start = threading.Barrier(8)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"title": "Fractions"}
+
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(cache.get_or_compute("k", compute))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"title": "Fractions"}] * 8
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] + stats["hits"] == 7
+
+
+def test_miss_racing_a_finished_leader_does_not_recompute(monkeypatch):
+    # The leader stored the value and retired its flight between this caller's miss and its lock
+    cache = LessonCache(path=None)
+    cache.set("k", {"title": "Fractions"})
+    monkeypatch.setattr(cache, "get", lambda key: None)
+    assert cache.get_or_compute("k", lambda: pytest.fail("recomputed")) == {"title": "Fractions"}
+    assert cache.stats()["misses"] == 0
+
+
+def test_followers_see_the_leaders_error():
+    cache = LessonCache(path=None)
+    entered, release = threading.Event(), threading.Event()
+
+    def compute():
+        entered.set()
+        release.wait()
+        raise ValueError("model down")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute("k", compute)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    entered.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    while cache.stats()["coalesced"] == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2 and cache.stats()["errors"] == 1
+    # A failure is not cached
+    assert cache.get_or_compute("k", lambda: {"title": "Retry"}) == {"title": "Retry"}
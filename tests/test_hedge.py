@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from core.backends import BackendError, FakeBackend
+from core.hedge import Hedger
+
+PROMPT = "Topic: Fractions"
+
+
+@pytest.fixture
+def fake():
+    # The primary model has a slow tail; the fallback answers quickly
+    return FakeBackend(latency=0.01, jitter=0, model_latency={"primary": 0.5, "fast": 0.01})
+
+
+def _hedger(**kwargs):
+    options = dict(model="primary", fallback="fast", initial_delay=0.05, max_rate=1.0, enabled=True)
+    return Hedger("test", **dict(options, **kwargs))
+
+
+def test_slow_primary_is_hedged(fake):
+    h = _hedger()
+    start = time.monotonic()
+    resp = h.run(lambda model, cancel, remaining: fake.generate(PROMPT, model=model, timeout=remaining), 5)
+    assert resp.text and time.monotonic() - start < 0.4
+    stats = h.stats()
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_hedges_stop_at_the_budget(fake):
+    h = _hedger(max_rate=0.5)
+
+    def attempt(model, cancel, remaining):
+        return fake.generate(PROMPT, model=model, timeout=remaining)
+
+    h.run(attempt, 5)
+    # Every recent call was hedged, so the next one waits for the primary
+    assert h.delay() is None
+    start = time.monotonic()
+    h.run(attempt, 5)
+    assert time.monotonic() - start >= 0.5
+    assert h.stats()["hedged"] == 1
+
+
+def test_transient_error_falls_back_at_once(fake):
+    h = _hedger(initial_delay=10)
+
+    def attempt(model, cancel, remaining):
+        if model == "primary":
+            raise BackendError("overloaded", status=503)
+        return fake.generate(PROMPT, model=model, timeout=remaining)
+
+    start = time.monotonic()
+    assert h.run(attempt, 5).text
+    assert time.monotonic() - start < 1
+
+
+def test_client_error_is_not_retried():
+    h = _hedger(initial_delay=10)
+    models = []
+
+    def attempt(model, cancel, remaining):
+        models.append(model)
+        raise BackendError("bad request", status=400)
+
+    with pytest.raises(BackendError):
+        h.run(attempt, 5)
+    assert models == ["primary"] and h.stats()["failed"] == 1
+
+
+def test_deadline(fake):
+    h = _hedger(enabled=False)
+    with pytest.raises(TimeoutError):
+        h.run(lambda model, cancel, remaining: fake.generate(PROMPT, model=model, timeout=remaining), 0.1)
+    assert h.stats()["deadline"] == 1
+
+
+def test_arun_hedges_and_falls_back(fake):
+    h = _hedger()
+
+    async def slow(model, remaining):
+        return await fake.agenerate(PROMPT, model=model, timeout=remaining)
+
+    async def failing(model, remaining):
+        if model == "primary":
+            raise BackendError("overloaded", status=503)
+        return await fake.agenerate(PROMPT, model=model, timeout=remaining)
+
+    start = time.monotonic()
+    assert asyncio.run(h.arun(slow, 5)).text
+    assert time.monotonic() - start < 0.4
+    assert asyncio.run(_hedger(initial_delay=10).arun(failing, 5)).text
+    assert h.stats()["hedge_wins"] == 1
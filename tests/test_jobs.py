@@ -0,0 +1,100 @@
+import time
+
+from core.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, run_job, submit
+
+PLAN = {"title": "Light", "sections": {"Unit Overview": ["Reflection."]}}
+REQUEST = {"board": "CBSE", "grade": 7, "subject": "Science", "topic": "Light", "duration": "45 min",
+           "pedagogy": "Inquiry-based", "bloom": "Apply"}
+
+
+def _finish(queue, job_id, result):
+    job = queue.claim("w1")
+    assert job.id == job_id
+    assert queue.complete(job.id, "w1", result)
+
+
+def test_duplicate_generate_reuses_the_finished_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    first = submit(queue, "generate", {"request": REQUEST})
+    _finish(queue, first, PLAN)
+    assert submit(queue, "generate", {"request": REQUEST}) == first
+    assert queue.get(first).status == DONE
+
+
+def test_repeated_rewrite_runs_again_once_finished(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    payload = {"request": REQUEST, "plan": PLAN, "sections": ["Assessment"], "feedback": ""}
+    first = submit(queue, "regenerate", payload)
+    # While it is queued, a second click joins it
+    assert submit(queue, "regenerate", payload) == first
+    assert queue.stats()["queued"] == 1
+    _finish(queue, first, PLAN)
+
+    again = submit(queue, "regenerate", payload)
+    job = queue.get(again)
+    assert job.status == QUEUED and job.result is None and job.attempts == 0
+
+
+def test_claim_takes_the_highest_priority_job_once(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    low = queue.enqueue("export", {"n": 1}, priority=0)
+    high = queue.enqueue("export", {"n": 2}, priority=10)
+    job = queue.claim("w1")
+    assert (job.id, job.status, job.attempts) == (high, RUNNING, 1)
+    assert queue.claim("w2").id == low
+    assert queue.claim("w3") is None
+
+
+def test_failed_attempts_retry_then_fail(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue("export", {}, max_attempts=2)
+    job = queue.claim("w1")
+    assert queue.fail(job.id, "w1", "boom", job.attempts, job.max_attempts, backoff=0)
+    assert queue.get(job_id).status == QUEUED
+    job = queue.claim("w1")
+    assert job.attempts == 2
+    assert queue.fail(job.id, "w1", "boom again", job.attempts, job.max_attempts, backoff=0)
+    assert (queue.get(job_id).status, queue.get(job_id).error) == (FAILED, "boom again")
+
+
+def test_retry_waits_for_its_backoff(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    queue.enqueue("export", {})
+    job = queue.claim("w1")
+    queue.fail(job.id, "w1", "boom", job.attempts, job.max_attempts, backoff=60)
+    assert queue.claim("w1") is None
+
+
+def test_lapsed_lease_goes_to_another_worker(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), visibility=0.05)
+    job_id = queue.enqueue("export", {}, max_attempts=2)
+    assert queue.claim("w1").id == job_id
+    time.sleep(0.1)
+    job = queue.claim("w2")
+    assert (job.id, job.attempts) == (job_id, 2)
+    # The first worker lost the lease: its heartbeat and result are refused
+    assert not queue.heartbeat(job_id, "w1")
+    assert not queue.complete(job_id, "w1", {"stale": True})
+    assert queue.heartbeat(job_id, "w2")
+    time.sleep(0.1)
+    # Out of attempts: a second lapse fails the job
+    assert queue.claim("w3") is None
+    assert queue.get(job_id).status == FAILED
+
+
+def test_run_job_generates_with_the_fake_backend(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = submit(queue, "generate", {"request": REQUEST})
+    run_job(queue, queue.claim("w1"), "w1")
+    job = queue.get(job_id)
+    assert job.status == DONE
+    assert job.result["title"] and "Assessment" in job.result["sections"]
+    assert job.trace["counters"]
+
+
+def test_run_job_records_handler_errors(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue("no-such-kind", {}, max_attempts=1)
+    run_job(queue, queue.claim("w1"), "w1")
+    job = queue.get(job_id)
+    assert job.status == FAILED and "unknown job kind" in job.error
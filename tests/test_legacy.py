@@ -0,0 +1,33 @@
+import pytest
+
+from core.backends import FakeBackend, get_backend, set_backend
+from core.legacy import generate_lesson_plan, parse_lesson_sections, regenerate_lesson_sections
+
+FIELDS = ("CBSE", "7th Grade", "Science", "Light", "explain reflection")
+
+
+class NoSections(FakeBackend):
+    def render(self, prompt, rng):
+        return "Here is a better quiz for your class."
+
+
+@pytest.fixture
+def no_sections_backend():
+    previous = get_backend()
+    set_backend(NoSections(latency=0, jitter=0))
+    yield
+    set_backend(previous)
+
+
+def test_rewrite_replaces_only_the_requested_section():
+    text = generate_lesson_plan(*FIELDS, use_cache=False)
+    rewritten = regenerate_lesson_sections(*FIELDS, text, ["conclusion"], "shorter")
+    before, after = parse_lesson_sections(text), parse_lesson_sections(rewritten)
+    assert after["intro"] == before["intro"] and after["activity"] == before["activity"]
+    assert after["conclusion"] != before["conclusion"]
+
+
+def test_rewrite_with_none_of_the_sections_raises(no_sections_backend):
+    text = "### 📝 Introduction\nHook.\n\n### 🎯 Main Activity\nDemo.\n\n### ✨ Conclusion\nRecap."
+    with pytest.raises(ValueError, match="none of the requested sections"):
+        regenerate_lesson_sections(*FIELDS, text, ["quiz"])
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from core.backends import FakeBackend
+from core.limiter import FAILED, IGNORED, OK, THROTTLED, AdaptiveLimiter, ResilientBackend, classify
+
+
+def test_classify():
+    assert classify(asyncio.TimeoutError()) == FAILED
+    assert classify(TimeoutError()) == FAILED
+    assert classify(ValueError()) == IGNORED
+
+
+def test_limit_grows_on_success_and_halves_on_throttle():
+    limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=16)
+    for _ in range(40):
+        assert limiter.acquire(0)
+        limiter.release(0.0, OK)
+    grown = limiter.stats()["limit"]
+    assert grown > 4
+
+    assert limiter.acquire(0)
+    limiter.release(0.0, THROTTLED)
+    assert limiter.stats()["limit"] == grown // 2
+    # A burst of 429s from calls already in flight is one signal
+    assert limiter.acquire(0)
+    limiter.release(0.0, THROTTLED)
+    assert limiter.stats()["decreases"] == 1
+
+
+def test_aacquire_timeout_gives_up_its_place():
+    limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+    assert limiter.acquire(0)
+    assert asyncio.run(limiter.aacquire(0.05)) is False
+    stats = limiter.stats()
+    assert (stats["inflight"], stats["waiting"], stats["timeouts"]) == (1, 0, 1)
+    limiter.release(0.0, OK)
+    assert limiter.stats()["inflight"] == 0
+
+
+def test_queued_call_times_out_against_fake_backend():
+    limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+    backend = ResilientBackend(FakeBackend(latency=0.3, jitter=0), limiter, retries=0)
+
+    async def run():
+        slow = asyncio.ensure_future(backend.agenerate("Topic: Fractions", timeout=5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(TimeoutError):
+            await backend.agenerate("Topic: Decimals", timeout=0.1)
+        await slow
+
+    asyncio.run(run())
+    stats = limiter.stats()
+    assert (stats["inflight"], stats["waiting"], stats["timeouts"]) == (0, 0, 1)
+
+
+def test_limiter_backs_off_a_throttling_fake_backend():
+    limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=8)
+    fake = FakeBackend(latency=0.05, jitter=0, capacity=2, retry_after=0.01)
+    backend = ResilientBackend(fake, limiter, retries=20, backoff=0.02, max_backoff=0.1)
+
+    async def run():
+        return await asyncio.gather(*(backend.agenerate(f"Topic: Topic {i}", timeout=10) for i in range(8)))
+
+    assert len(asyncio.run(run())) == 8
+    assert fake.throttled > 0
+    stats = limiter.stats()
+    assert stats["decreases"] >= 1 and stats["limit"] < 8
+    assert (stats["inflight"], stats["waiting"]) == (0, 0)
@@ -0,0 +1,27 @@
+from io import BytesIO
+
+import pytest
+
+from core import pdf
+
+PLAN = {"title": "Lesson Plan: Fractions", "sections": {"Unit Overview": ["Compare and order fractions."]}}
+
+
+@pytest.fixture
+def no_gujarati_font(monkeypatch):
+    pdf.fonts()
+    monkeypatch.setattr(pdf._fonts, "missing", ["gujarati"])
+
+
+def test_latin_plan_renders(no_gujarati_font):
+    buf = BytesIO()
+    assert pdf.write_plan(PLAN, buf) >= 1
+    assert pdf.page_count(buf.getvalue()) >= 1
+
+
+def test_script_without_font_fails_instead_of_dropping_text(no_gujarati_font):
+    plan = {"title": "પાઠ યોજના", "sections": {"Unit Overview": ["અપૂર્ણાંકની તુલના કરો."]}}
+    with pytest.raises(pdf.MissingFontError, match="gujarati"):
+        pdf.write_plan(plan, BytesIO())
+    # Devanagari has a font here, so only the missing script fails
+    pdf.check_fonts("भिन्नों की तुलना")
@@ -0,0 +1,40 @@
+from core.repair import repair_json, salvage
+
+
+def test_valid_json_is_not_repaired():
+    assert repair_json('{"Materials": ["Chalk"]}') == ({"Materials": ["Chalk"]}, False)
+
+
+def test_trailing_comma_keeps_string_contents():
+    payload, repaired = repair_json('{"Materials": "None needed. True story.", "Assessment": "Quiz",}')
+    assert repaired
+    assert payload == {"Materials": "None needed. True story.", "Assessment": "Quiz"}
+
+
+def test_python_literals_in_value_position():
+    payload, _ = repair_json("{'a': True, 'b': [None, False,], 'c': 'x, }',}")
+    assert payload == {"a": True, "b": [None, False], "c": "x, }"}
+
+
+def test_code_fence_and_truncation():
+    payload, repaired = repair_json('```json\n{"title": "Light", "sections": {"Materials": ["Torch", "Mirr')
+    assert repaired
+    assert payload["title"] == "Light"
+    assert payload["sections"]["Materials"][0] == "Torch"
+
+
+def test_single_quotes_and_bare_keys():
+    payload, _ = repair_json("{'title': 'It\\'s \"fine\"', 'sections': {'Materials': ['chalk']}}")
+    assert payload == {"title": 'It\'s "fine"', "sections": {"Materials": ["chalk"]}}
+    payload, _ = repair_json('{title: "Plan", Lesson Flow: ["Warm up"]}')
+    assert payload == {"title": "Plan", "Lesson Flow": ["Warm up"]}
+
+
+def test_salvage_maps_section_names_and_lists_the_missing_ones():
+    payload, missing = salvage('{"title": "P", "sections": {"Objectives": ["a"], "Homework": ["b"]}}')
+    assert payload["sections"] == {"Learning Outcomes": ["a"], "Homework/Extensions": ["b"]}
+    assert "Learning Outcomes" not in missing and "Lesson Flow" in missing
+
+
+def test_not_json():
+    assert repair_json("Sorry, I cannot help with that.") == (None, True)
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_cold_import_within_budget():
+    # A fresh interpreter, as on a Streamlit cold start; core.startup times the UIs' core.* imports
+    env = dict(os.environ, LLM_BACKEND="fake")
+    proc = subprocess.run([sys.executable, "-m", "core.startup", "--check"], cwd=SRC, env=env,
+                          capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "OK: within" in proc.stdout
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from core.backends import FakeBackend, get_backend, set_backend
+from core.generator import LessonRequest, agenerate_lesson_stream, generate_lesson_stream
+
+REQUEST = LessonRequest(board="CBSE", grade=7, subject="Mathematics", topic="Fractions", duration="45 min",
+                        pedagogy="Inquiry-based", bloom="Apply")
+
+
+class CutOff(FakeBackend):
+    """Streams the plan only up to the end of Differentiation, as if the token budget ran out there."""
+
+    def _cut(self, text):
+        return text[:text.index('"Assessment"')]
+
+    def stream(self, prompt, **kwargs):
+        yield self._cut("".join(super().stream(prompt, **kwargs)))
+
+    async def astream(self, prompt, **kwargs):
+        yield self._cut("".join([chunk async for chunk in super().astream(prompt, **kwargs)]))
+
+
+@pytest.fixture
+def cut_off_backend():
+    previous = get_backend()
+    set_backend(CutOff(latency=0, jitter=0))
+    yield
+    set_backend(previous)
+
+
+def _collect(items):
+    title, sections, sent = None, {}, []
+    for name, content in items:
+        sent.append(name)
+        if name == "title":
+            title = content
+        else:
+            sections[name] = content
+    return title, sections, sent
+
+
+def test_stream_sends_each_section_once():
+    _, sections, sent = _collect(generate_lesson_stream(REQUEST, use_cache=False))
+    assert len(sent) == len(set(sent))
+
+
+def test_section_refetched_after_cut_off_is_sent_again(cut_off_backend):
+    items = list(generate_lesson_stream(REQUEST, use_cache=False))
+    _, sections, sent = _collect(items)
+    # Differentiation was streamed, then dropped as possibly incomplete and re-requested
+    assert sent.count("Differentiation") == 2
+    assert items[sent.index("Differentiation")][1] != sections["Differentiation"]
+    assert "References" in sections
+
+
+def test_async_stream_sends_refetched_section_again(cut_off_backend):
+    async def run():
+        return [item async for item in agenerate_lesson_stream(REQUEST, use_cache=False)]
+
+    _, sections, sent = _collect(asyncio.run(run()))
+    assert sent.count("Differentiation") == 2
+    assert "References" in sections